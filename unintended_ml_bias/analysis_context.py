@@ -0,0 +1,304 @@
+"""Caches subgroup masks, label partitions and score sorts of a dataset.
+
+A notebook session typically computes several analyses of the same scored
+dataset, e.g. compute_bias_metrics_for_models, then per_subgroup_negative_rates
+and per_subgroup_auc_diff_from_overall. Each analysis needs the same subgroup
+masks, label splits and sorted model scores. AnalysisContext wraps the dataset
+and computes these lazily, once, and the model_bias_analysis functions accept
+it as their context argument:
+
+  context = AnalysisContext(dataset)
+  results = model_bias_analysis.compute_bias_metrics_for_models(
+      dataset, subgroups, models, 'label', context=context)
+  rates = model_bias_analysis.per_subgroup_negative_rates(
+      dataset, subgroups, model_families, 0.5, 'label', context=context)
+
+Cached arrays are evicted least recently used first once they take more than
+memory_budget bytes.
+
+Cached values are invalidated when a column they were computed from changes.
+Columns are checked by a checksum of their values whenever an outermost
+model_bias_analysis function starts using the context (see entered), so
+in-place edits like dataset.loc[0, 'model'] = 0.9 are picked up too. Columns
+can also be replaced with set_column, or invalidated explicitly.
+
+With scores sorted once per model, every metric that reduces to an AUC of two
+subsets of the data (subgroup AUCs, cross AUCs and AEGs) is computed from the
+sorted scores of each subset with a binary search (sorted_auc), without
+sorting again. These metrics are defined once here, as functions of a
+partition of sorted scores (subgroup_auc, negative_aeg, ...), and shared by
+model_bias_analysis and compact_dataset.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import contextlib
+import zlib
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MEMORY_BUDGET = 1 << 30
+
+# Parts of a label partition: examples in or out of the subgroup, by label.
+SUBGROUP_NEGATIVE = 'subgroup_negative'
+SUBGROUP_POSITIVE = 'subgroup_positive'
+BACKGROUND_NEGATIVE = 'background_negative'
+BACKGROUND_POSITIVE = 'background_positive'
+
+
+def sorted_auc(sorted_positive, sorted_negative):
+  """Returns the AUC of two sorted score arrays, or NaN if one is empty.
+
+  This is the probability that a positive example scores higher than a
+  negative example, counting ties as one half, which is the ROC AUC and the
+  normalized Mann-Whitney U statistic.
+  """
+  if not len(sorted_positive) or not len(sorted_negative):
+    return np.nan
+  below = np.searchsorted(sorted_negative, sorted_positive, side='left')
+  below_or_tied = np.searchsorted(sorted_negative, sorted_positive,
+                                  side='right')
+  pairs = len(sorted_positive) * len(sorted_negative)
+  return (below.sum() + below_or_tied.sum()) / (2 * pairs)
+
+
+def count_around(sorted_values, values):
+  """Returns #(sorted_values < v) + #(sorted_values == v) / 2 for each v."""
+  left = np.searchsorted(sorted_values, values, side='left')
+  right = np.searchsorted(sorted_values, values, side='right')
+  return (left + right) / 2
+
+
+def within_group_pairs(rows, doc_ids, score_groups, labels, num_groups):
+  """Counts (positive, negative) pairs within each group's documents.
+
+  Groups may overlap, like the terms of term_discovery, or partition the
+  documents, like the slices of slice_analysis. A pair counts 1 if the
+  positive document scores higher, and 1/2 for ties.
+
+  Args:
+    rows: Group of each (group, document) posting.
+    doc_ids: Document of each posting.
+    score_groups: Dense rank of the score of each document (equal scores have
+      equal ranks).
+    labels: Boolean label of each document.
+    num_groups: Number of groups.
+  """
+  if not len(rows):
+    return np.zeros(num_groups)
+  groups = score_groups[doc_ids]
+  order = np.lexsort((groups, rows))
+  rows = rows[order]
+  groups = groups[order]
+  negative = ~labels[doc_ids[order]]
+  # Runs of postings with the same group and score.
+  starts = np.r_[True, (rows[1:] != rows[:-1]) | (groups[1:] != groups[:-1])]
+  run_ids = np.cumsum(starts) - 1
+  run_negatives = np.bincount(run_ids, weights=negative)
+  run_rows = rows[starts]
+  # Negatives of the same group in lower-scoring runs.
+  negatives_before = np.cumsum(run_negatives) - run_negatives
+  term_starts = np.r_[True, run_rows[1:] != run_rows[:-1]]
+  term_offsets = negatives_before[term_starts]
+  negatives_before -= np.repeat(term_offsets,
+                                np.diff(np.r_[np.flatnonzero(term_starts),
+                                              len(run_rows)]))
+  pair_counts = negatives_before + run_negatives / 2
+  positive = ~negative
+  return np.bincount(
+      rows[positive],
+      weights=pair_counts[run_ids[positive]],
+      minlength=num_groups)
+
+
+def partition_sorted_scores(sorted_scores, sorted_labels, sorted_mask):
+  """Splits sorted scores by subgroup membership and label.
+
+  Returns:
+    Dict of SUBGROUP_NEGATIVE, SUBGROUP_POSITIVE, BACKGROUND_NEGATIVE and
+    BACKGROUND_POSITIVE to the sorted scores of each part.
+  """
+  return {
+      SUBGROUP_NEGATIVE: sorted_scores[sorted_mask & ~sorted_labels],
+      SUBGROUP_POSITIVE: sorted_scores[sorted_mask & sorted_labels],
+      BACKGROUND_NEGATIVE: sorted_scores[~sorted_mask & ~sorted_labels],
+      BACKGROUND_POSITIVE: sorted_scores[~sorted_mask & sorted_labels],
+  }
+
+
+# The bias metrics of a subgroup, from the sorted scores of each part of its
+# label partition (see partition_sorted_scores). They are NaN where a part
+# they compare is empty.
+def subgroup_auc(scores):
+  return sorted_auc(scores[SUBGROUP_POSITIVE], scores[SUBGROUP_NEGATIVE])
+
+
+def negative_cross_auc(scores):
+  return sorted_auc(scores[BACKGROUND_POSITIVE], scores[SUBGROUP_NEGATIVE])
+
+
+def positive_cross_auc(scores):
+  return sorted_auc(scores[SUBGROUP_POSITIVE], scores[BACKGROUND_NEGATIVE])
+
+
+def negative_aeg(scores):
+  return 0.5 - sorted_auc(scores[BACKGROUND_NEGATIVE],
+                          scores[SUBGROUP_NEGATIVE])
+
+
+def positive_aeg(scores):
+  return 0.5 - sorted_auc(scores[BACKGROUND_POSITIVE],
+                          scores[SUBGROUP_POSITIVE])
+
+
+def _fingerprint(values):
+  dtype = values.dtype.str
+  if values.dtype == object:
+    # Object arrays hold pointers, so their values are hashed instead.
+    values = pd.util.hash_array(values)
+  values = np.ascontiguousarray(values)
+  return len(values), dtype, zlib.crc32(values.view(np.uint8))
+
+
+def _nbytes(value):
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  if isinstance(value, dict):
+    return sum(_nbytes(v) for v in value.values())
+  if isinstance(value, (list, tuple)):
+    return sum(_nbytes(v) for v in value)
+  return 0
+
+
+class AnalysisContext(object):
+  """Lazily computed, cached masks and score sorts of a dataset."""
+
+  def __init__(self, dataset, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Initializes the context.
+
+    Args:
+      dataset: DataFrame with the label, model score and subgroup columns, as
+        expected by model_bias_analysis.
+      memory_budget: Maximum number of bytes of cached arrays.
+    """
+    self.dataset = dataset
+    self.memory_budget = memory_budget
+    self.nbytes = 0
+    self.hits = 0
+    self.misses = 0
+    # Key -> (value, nbytes, columns the value was computed from).
+    self._cache = collections.OrderedDict()
+    # Column -> fingerprint when its cached values were computed.
+    self._fingerprints = {}
+    # Number of enclosing entered() calls.
+    self._depth = 0
+
+  def wraps(self, dataset):
+    return dataset is self.dataset
+
+  @contextlib.contextmanager
+  def entered(self):
+    """Refreshes the context, unless already entered by an enclosing call.
+
+    Entry points of model_bias_analysis run inside this, so that the columns
+    are checksummed once per outermost call rather than once per nested one.
+    """
+    if not self._depth:
+      self.refresh()
+    self._depth += 1
+    try:
+      yield self
+    finally:
+      self._depth -= 1
+
+  def refresh(self):
+    """Invalidates cached values of columns that changed since caching."""
+    changed = [
+        column for column, fingerprint in self._fingerprints.items()
+        if column not in self.dataset or
+        _fingerprint(self.dataset[column].values) != fingerprint
+    ]
+    if changed:
+      self.invalidate(changed)
+
+  def invalidate(self, columns=None):
+    """Drops cached values computed from columns, or everything if None."""
+    if columns is None:
+      self._cache.clear()
+      self._fingerprints.clear()
+      self.nbytes = 0
+      return
+    columns = set(columns)
+    for key, (_, nbytes, dependencies) in list(self._cache.items()):
+      if columns.intersection(dependencies):
+        del self._cache[key]
+        self.nbytes -= nbytes
+    for column in columns:
+      self._fingerprints.pop(column, None)
+
+  def set_column(self, column, values):
+    """Sets a dataset column and invalidates the values cached from it."""
+    self.dataset[column] = values
+    self.invalidate([column])
+
+  def _get(self, key, columns, compute):
+    """Returns the cached value of key, computing it if needed."""
+    if key in self._cache:
+      self.hits += 1
+      entry = self._cache.pop(key)
+      self._cache[key] = entry
+      return entry[0]
+    self.misses += 1
+    for column in columns:
+      if column not in self._fingerprints:
+        self._fingerprints[column] = _fingerprint(self.dataset[column].values)
+    value = compute()
+    nbytes = _nbytes(value)
+    self._cache[key] = (value, nbytes, columns)
+    self.nbytes += nbytes
+    while self.nbytes > self.memory_budget and len(self._cache) > 1:
+      _, (_, evicted_nbytes, _) = self._cache.popitem(last=False)
+      self.nbytes -= evicted_nbytes
+    return value
+
+  def mask(self, column):
+    """Returns a boolean column, e.g. a subgroup or the label, as an array."""
+    return self._get(('mask', column), (column,),
+                     lambda: np.asarray(self.dataset[column], dtype=bool))
+
+  def indices(self, column):
+    """Returns the row positions where a boolean column is True."""
+    return self._get(('indices', column), (column,),
+                     lambda: np.flatnonzero(self.mask(column)))
+
+  def subset(self, column):
+    """Returns the rows of the dataset where a boolean column is True."""
+    if column is None:
+      return self.dataset
+    return self.dataset.take(self.indices(column))
+
+  def sort_order(self, model):
+    """Returns the stable argsort of a model's scores."""
+    return self._get(
+        ('sort_order', model), (model,),
+        lambda: np.argsort(self.dataset[model].values, kind='mergesort'))
+
+  def sorted_scores(self, model, subgroup, label_col):
+    """Returns the sorted scores of a model in each part of a label partition.
+
+    The subsets are read off the model's sort order, so they are not sorted
+    again for every subgroup.
+    """
+
+    def compute():
+      order = self.sort_order(model)
+      return partition_sorted_scores(self.dataset[model].values[order],
+                                     self.mask(label_col)[order],
+                                     self.mask(subgroup)[order])
+
+    return self._get(('sorted_scores', model, subgroup, label_col),
+                     (model, subgroup, label_col), compute)
@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+import tensorflow as tf
+import analysis_context
+import model_bias_analysis as mba
+
+
+class AnalysisContextTest(tf.test.TestCase):
+
+  def make_dataset(self, size=200):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'label': rng.rand(size) < 0.4,
+        'model': np.round(rng.rand(size), 1),
+        'group_a': rng.rand(size) < 0.2,
+        'group_b': rng.rand(size) < 0.5,
+    })
+
+  def test_sorted_auc_matches_sklearn(self):
+    dataset = self.make_dataset()
+    positive = np.sort(dataset['model'][dataset['label']].values)
+    negative = np.sort(dataset['model'][~dataset['label']].values)
+    self.assertAlmostEqual(
+        analysis_context.sorted_auc(positive, negative),
+        metrics.roc_auc_score(dataset['label'], dataset['model']))
+    self.assertTrue(np.isnan(analysis_context.sorted_auc(positive, [])))
+
+  def test_object_columns(self):
+    dataset = self.make_dataset()
+    expected = mba.compute_bias_metrics_for_models(dataset, ['group_a'],
+                                                   ['model'], 'label')
+    dataset['group_a'] = dataset['group_a'].astype(object)
+    dataset['label'] = dataset['label'].astype(object)
+    results = mba.compute_bias_metrics_for_models(dataset, ['group_a'],
+                                                  ['model'], 'label')
+    self.assertAllClose(results['model_subgroup_auc'],
+                        expected['model_subgroup_auc'])
+
+    context = analysis_context.AnalysisContext(dataset)
+    context.indices('group_a')
+    dataset.loc[0, 'group_a'] = not dataset['group_a'][0]
+    with context.entered():
+      self.assertEqual(
+          len(context.indices('group_a')), dataset['group_a'].sum())
+
+  def test_refreshes_once_per_outermost_call(self):
+    dataset = self.make_dataset()
+    context = analysis_context.AnalysisContext(dataset)
+    refreshes = []
+    refresh = context.refresh
+
+    def counting_refresh():
+      refreshes.append(1)
+      refresh()
+
+    context.refresh = counting_refresh
+    mba.compute_bias_metrics_for_model_families(
+        dataset, ['group_a', 'group_b'], [['model']], 'label', context=context)
+    self.assertEqual(len(refreshes), 1)
+    mba.compute_bias_metrics_for_models(
+        dataset, ['group_a'], ['model'], 'label', context=context)
+    self.assertEqual(len(refreshes), 2)
+
+  def test_metrics_reuse_cache(self):
+    dataset = self.make_dataset()
+    context = analysis_context.AnalysisContext(dataset)
+    mba.compute_bias_metrics_for_models(
+        dataset, ['group_a', 'group_b'], ['model'], 'label', context=context)
+    misses = context.misses
+    mba.compute_bias_metrics_for_models(
+        dataset, ['group_a', 'group_b'], ['model'], 'label', context=context)
+    self.assertEqual(context.misses, misses)
+    self.assertGreater(context.hits, 0)
+
+  def test_column_changes_invalidate(self):
+    dataset = self.make_dataset()
+    context = analysis_context.AnalysisContext(dataset)
+    mba.compute_bias_metrics_for_models(
+        dataset, ['group_a'], ['model'], 'label', context=context)
+    dataset.loc[dataset.index[dataset['label']], 'model'] = 2.0
+    results = mba.compute_bias_metrics_for_models(
+        dataset, ['group_a'], ['model'], 'label', context=context)
+    self.assertEqual(results['model_subgroup_auc'][0], 1.0)
+
+    context.set_column('group_a', np.zeros(len(dataset), dtype=bool))
+    self.assertEqual(len(context.indices('group_a')), 0)
+
+  def test_metric_functions_refresh(self):
+    dataset = self.make_dataset()
+    context = analysis_context.AnalysisContext(dataset)
+    mba.compute_subgroup_auc(dataset, 'group_a', 'label', 'model', context)
+    dataset.loc[dataset.index[dataset['label']], 'model'] = 2.0
+    self.assertEqual(
+        mba.compute_subgroup_auc(dataset, 'group_a', 'label', 'model',
+                                 context), 1.0)
+    dataset['model'] = 1 - dataset['model']
+    record = mba.compute_bias_metrics_for_subgroup_and_model(
+        dataset, 'group_a', 'model', 'label', context=context)
+    self.assertEqual(record['model_subgroup_auc'], 0.0)
+
+  def test_memory_budget(self):
+    dataset = self.make_dataset()
+    context = analysis_context.AnalysisContext(dataset, memory_budget=2000)
+    context.indices('group_a')
+    context.indices('group_b')
+    context.sort_order('model')
+    self.assertLessEqual(context.nbytes, 2000)
+    context.mask('group_a')
+    self.assertLessEqual(context.nbytes, 2000)
+
+  def test_wrong_dataset_raises(self):
+    context = analysis_context.AnalysisContext(self.make_dataset())
+    with self.assertRaises(ValueError):
+      mba.compute_bias_metrics_for_models(
+          self.make_dataset(), ['group_a'], ['model'], 'label', context=context)
+
+
+if __name__ == '__main__':
+  tf.test.main()
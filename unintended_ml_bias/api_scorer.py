@@ -0,0 +1,265 @@
+"""Scores texts with production models served over an HTTP API.
+
+Production models, like the TOXICITY@1 and TOXICITY@6 columns of
+model_card/intersectional_madlibs_scored.csv, are scored through an API of the
+Perspective comment analyzer form rather than with a local ToxModel:
+
+  POST <url>?key=<api key>
+  {"comment": {"text": ...},
+   "requestedAttributes": {"TOXICITY@1": {}, "TOXICITY@6": {}},
+   "doNotStore": true}
+  -> {"attributeScores": {"TOXICITY@1": {"summaryScore": {"value": 0.1}}, ...}}
+
+ApiClient sends these requests concurrently over a pool of keep-alive
+connections, with at most max_concurrency requests in flight, a token-bucket
+limit of qps requests per second, and retries with exponential backoff on
+rate limiting (429), server errors and connection errors. Every request asks
+for all of the client's attributes (model versions) at once.
+
+ApiModel has the get_model_name/predict interface of ToxModel, so it can be
+passed to model_tool.score_dataset and load_maybe_score. The models of one
+client share its cache of scores, so scoring a dataset with several model
+versions sends one request per text:
+
+  client = ApiClient(URL, api_key, ['TOXICITY@1', 'TOXICITY@6'], qps=50)
+  model_tool.score_dataset(madlibs, client.models(), 'phrase')
+
+Since this code also runs on Python 2, concurrency uses threads rather than
+asyncio.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+from multiprocessing.pool import ThreadPool
+import random
+import socket
+import threading
+import time
+
+import numpy as np
+
+try:
+  import httplib  # Python 2
+  import Queue as queue
+  from urllib import urlencode
+  from urlparse import urlparse
+except ImportError:
+  import http.client as httplib  # Python 3
+  import queue
+  from urllib.parse import urlencode
+  from urllib.parse import urlparse
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_QPS = 10
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+DEFAULT_CACHE_SIZE = 100000
+
+# Status codes worth retrying: rate limiting and server errors.
+_RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class ApiError(Exception):
+  """The API returned an error that retrying won't fix, or retries ran out."""
+
+
+class TokenBucket(object):
+  """Thread-safe token bucket allowing rate acquisitions per second."""
+
+  def __init__(self, rate, capacity=None):
+    self.rate = rate
+    self.capacity = capacity or max(rate, 1)
+    self._tokens = self.capacity
+    self._last = time.time()
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    """Blocks until a token is available, and takes it."""
+    while True:
+      with self._lock:
+        now = time.time()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait = (1 - self._tokens) / self.rate
+      time.sleep(wait)
+
+
+class _ConnectionPool(object):
+  """Keep-alive connections to one host, each used by one thread at a time."""
+
+  def __init__(self, url, size, timeout):
+    parsed = urlparse(url)
+    self._connection_class = (
+        httplib.HTTPSConnection
+        if parsed.scheme == 'https' else httplib.HTTPConnection)
+    self._host = parsed.netloc
+    self._timeout = timeout
+    self._idle = queue.Queue()
+    for _ in range(size):
+      self._idle.put(None)
+
+  def request(self, method, path, body, headers):
+    """Sends a request. Returns the response status and body."""
+    connection = self._idle.get()
+    try:
+      if connection is None:
+        connection = self._connection_class(self._host, timeout=self._timeout)
+      connection.request(method, path, body, headers)
+      response = connection.getresponse()
+      return response.status, response.read()
+    except (httplib.HTTPException, socket.error):
+      if connection is not None:
+        connection.close()
+      connection = None
+      raise
+    finally:
+      self._idle.put(connection)
+
+
+class ApiClient(object):
+  """Concurrent, rate-limited client of a comment analyzer API."""
+
+  def __init__(self,
+               url,
+               api_key=None,
+               attributes=('TOXICITY',),
+               max_concurrency=DEFAULT_MAX_CONCURRENCY,
+               qps=DEFAULT_QPS,
+               max_retries=DEFAULT_MAX_RETRIES,
+               backoff=DEFAULT_BACKOFF,
+               timeout=30,
+               languages=('en',),
+               cache_size=DEFAULT_CACHE_SIZE):
+    """Initializes the client.
+
+    Args:
+      url: URL of the analyze endpoint.
+      api_key: API key, sent as the key query parameter.
+      attributes: Attributes (model versions) to request, e.g.
+        ['TOXICITY@1', 'TOXICITY@6'].
+      max_concurrency: Maximum number of requests in flight.
+      qps: Maximum number of requests started per second.
+      max_retries: Number of retries of a failed request.
+      backoff: Seconds to wait before the first retry. Doubles every retry.
+      timeout: Seconds to wait for a response.
+      languages: Languages of the texts, or None to let the API detect them.
+      cache_size: Maximum number of texts whose scores are cached. The least
+        recently used are evicted first.
+    """
+    parsed = urlparse(url)
+    self._path = parsed.path or '/'
+    query = [parsed.query] if parsed.query else []
+    if api_key:
+      query.append(urlencode({'key': api_key}))
+    if query:
+      self._path += '?' + '&'.join(query)
+    self.attributes = list(attributes)
+    self.max_concurrency = max_concurrency
+    self.max_retries = max_retries
+    self.backoff = backoff
+    self.languages = list(languages) if languages else None
+    self._pool = _ConnectionPool(url, max_concurrency, timeout)
+    self._bucket = TokenBucket(qps)
+    self.cache_size = cache_size
+    self._cache = collections.OrderedDict()
+    self._cache_lock = threading.Lock()
+
+  def _request_body(self, text):
+    body = {
+        'comment': {'text': text},
+        'requestedAttributes': dict((a, {}) for a in self.attributes),
+        'doNotStore': True,
+    }
+    if self.languages:
+      body['languages'] = self.languages
+    return json.dumps(body)
+
+  def score_text(self, text):
+    """Returns a dict of attribute to the score of one text. Retries errors."""
+    body = self._request_body(text)
+    headers = {'Content-Type': 'application/json'}
+    for attempt in range(self.max_retries + 1):
+      self._bucket.acquire()
+      try:
+        status, response = self._pool.request('POST', self._path, body,
+                                              headers)
+      except (httplib.HTTPException, socket.error) as e:
+        status, response = None, str(e)
+      if status == 200:
+        scores = json.loads(response.decode('utf-8'))['attributeScores']
+        return dict((attribute, scores[attribute]['summaryScore']['value'])
+                    for attribute in self.attributes)
+      if status is not None and status not in _RETRY_STATUSES:
+        raise ApiError('API error {}: {}'.format(status, response))
+      if attempt < self.max_retries:
+        # Exponential backoff, with jitter so that threads don't retry in sync.
+        time.sleep(self.backoff * 2**attempt * (0.5 + random.random()))
+    raise ApiError('API request failed after {} retries: {} {}'.format(
+        self.max_retries, status, response))
+
+  def _score_and_cache(self, text):
+    """Scores a text, caching its scores as soon as they arrive."""
+    scores = self.score_text(text)
+    with self._cache_lock:
+      self._cache[text] = scores
+      while len(self._cache) > self.cache_size:
+        self._cache.popitem(last=False)
+    return scores
+
+  def score_texts(self, texts):
+    """Returns a dict of attribute to the list of scores of texts.
+
+    Texts are scored concurrently. Scores are cached as each request
+    completes, so texts scored before (e.g. for another attribute's ApiModel,
+    or by a call that failed part way) aren't requested again.
+    """
+    texts = list(texts)
+    found = {}
+    with self._cache_lock:
+      for text in set(texts):
+        if text in self._cache:
+          # Moves the text to the most recently used end.
+          found[text] = self._cache.pop(text)
+          self._cache[text] = found[text]
+    missing = [text for text in set(texts) if text not in found]
+    if missing:
+      pool = ThreadPool(min(self.max_concurrency, len(missing)))
+      try:
+        scores = pool.map(self._score_and_cache, missing, chunksize=1)
+      finally:
+        pool.close()
+        pool.join()
+      found.update(zip(missing, scores))
+    return dict((attribute, [found[text][attribute] for text in texts])
+                for attribute in self.attributes)
+
+  def clear_cache(self):
+    with self._cache_lock:
+      self._cache.clear()
+
+  def models(self):
+    """Returns an ApiModel per attribute, all sharing this client."""
+    return [ApiModel(self, attribute) for attribute in self.attributes]
+
+
+class ApiModel(object):
+  """One attribute of an ApiClient, with the interface of ToxModel."""
+
+  def __init__(self, client, attribute):
+    self.client = client
+    self.attribute = attribute
+
+  def get_model_name(self):
+    return self.attribute
+
+  def predict(self, texts):
+    """Returns model predictions on texts."""
+    return np.array(self.client.score_texts(texts)[self.attribute])
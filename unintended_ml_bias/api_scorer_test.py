@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+import time
+
+import pandas as pd
+import tensorflow as tf
+import api_scorer
+import model_tool
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler  # Python 2
+  from BaseHTTPServer import HTTPServer
+  from SocketServer import ThreadingMixIn
+except ImportError:
+  from http.server import BaseHTTPRequestHandler  # Python 3
+  from http.server import HTTPServer
+  from socketserver import ThreadingMixIn
+
+
+class StubHandler(BaseHTTPRequestHandler):
+  """Scores TOXICITY@1 as len(text) / 100 and TOXICITY@6 as len(text) / 200.
+
+  Rate limits the first request of texts starting with 'retry', and rejects
+  texts starting with 'bad'.
+  """
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    request = json.loads(
+        self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+    text = request['comment']['text']
+    with self.server.lock:
+      self.server.requests.append((self.path, request))
+      first_try = text not in self.server.seen
+      self.server.seen.add(text)
+    if text.startswith('retry') and first_try:
+      self.send_json(429, {'error': 'rate limited'})
+    elif text.startswith('bad'):
+      self.send_json(400, {'error': 'bad request'})
+    else:
+      divisors = {'TOXICITY@1': 100, 'TOXICITY@6': 200}
+      self.send_json(200, {
+          'attributeScores':
+              dict((attribute, {
+                  'summaryScore': {
+                      'value': len(text) / divisors[attribute]
+                  }
+              }) for attribute in request['requestedAttributes'])
+      })
+
+  def send_json(self, code, value):
+    body = json.dumps(value).encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class ApiScorerTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(ApiScorerTest, self).setUp()
+    self.server = StubServer(('localhost', 0), StubHandler)
+    self.server.lock = threading.Lock()
+    self.server.requests = []
+    self.server.seen = set()
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.url = 'http://localhost:%d/v1/comments:analyze' % (
+        self.server.server_address[1])
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    super(ApiScorerTest, self).tearDown()
+
+  def make_client(self, **kwargs):
+    return api_scorer.ApiClient(
+        self.url, 'secret', ['TOXICITY@1', 'TOXICITY@6'], qps=1000,
+        backoff=0.01, **kwargs)
+
+  def test_score_dataset(self):
+    df = pd.DataFrame({'text': ['ab', 'abcd', 'retry this', 'ab']})
+    model_tool.score_dataset(df, self.make_client().models(), 'text')
+    self.assertEqual(df['TOXICITY@1'].tolist(), [0.02, 0.04, 0.1, 0.02])
+    self.assertEqual(df['TOXICITY@6'].tolist(), [0.01, 0.02, 0.05, 0.01])
+    # One request per distinct text, plus the rate limited one, each asking
+    # for both attributes.
+    self.assertEqual(len(self.server.requests), 4)
+    for path, request in self.server.requests:
+      self.assertEqual(path, '/v1/comments:analyze?key=secret')
+      self.assertEqual(
+          sorted(request['requestedAttributes']), ['TOXICITY@1', 'TOXICITY@6'])
+
+  def test_errors(self):
+    client = self.make_client()
+    with self.assertRaises(api_scorer.ApiError):
+      client.score_texts(['bad text'])
+    client = self.make_client(max_retries=0)
+    with self.assertRaises(api_scorer.ApiError):
+      client.score_texts(['retry once'])
+
+  def test_scores_are_cached_before_errors(self):
+    client = self.make_client()
+    with self.assertRaises(api_scorer.ApiError):
+      client.score_texts(['ab', 'abc', 'bad text'])
+    del self.server.requests[:]
+    self.assertEqual(client.score_texts(['ab', 'abc'])['TOXICITY@1'],
+                     [0.02, 0.03])
+    self.assertEqual(self.server.requests, [])
+
+  def test_cache_size(self):
+    client = self.make_client(cache_size=2)
+    client.score_texts(['a', 'ab', 'abc'])
+    self.assertEqual(len(client._cache), 2)
+    client.clear_cache()
+    for text in ['a', 'ab', 'a', 'abc']:
+      client.score_texts([text])
+    # 'ab' is the least recently used.
+    self.assertEqual(list(client._cache), ['a', 'abc'])
+
+  def test_token_bucket(self):
+    bucket = api_scorer.TokenBucket(100, capacity=1)
+    start = time.time()
+    for _ in range(6):
+      bucket.acquire()
+    self.assertGreater(time.time() - start, 0.04)
+
+
+if __name__ == '__main__':
+  tf.test.main()
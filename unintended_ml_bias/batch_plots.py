@@ -0,0 +1,84 @@
+"""Renders many model_bias_analysis figures in parallel.
+
+Report builds call plot functions such as plot_auc_heatmap, plot_aeg_heatmap
+and per_subgroup_scatterplots once per model or metric, and each figure takes
+seconds to draw. render_plots draws a batch of figures in a pool of worker
+processes using the non-interactive Agg backend, and saves each one to a file.
+
+A task is a (file_name, plot_fn, kwargs) tuple. plot_fn must be a module-level
+function (so it can be sent to the workers) that draws a single figure and
+returns its figure or axes. Pass out_dir=None to per_subgroup_scatterplots so
+it only draws.
+
+Example usage:
+
+  tasks = [(model, model_bias_analysis.plot_auc_heatmap,
+            {'bias_metrics_results': results, 'models': [model]})
+           for model in models]
+  paths = render_plots(tasks, '/tmp/report', file_format='png')
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+
+
+def _init_worker():
+  import matplotlib  # pylint: disable=g-import-not-at-top
+  matplotlib.use('Agg', force=True)
+  # matplotlib.use doesn't switch the backend of a pyplot the parent process
+  # already imported.
+  import matplotlib.pyplot as plt  # pylint: disable=g-import-not-at-top
+  plt.switch_backend('Agg')
+
+
+def _render(args):
+  """Draws and saves one figure. Runs in a pool worker."""
+  path, file_format, plot_fn, kwargs = args
+  import matplotlib.pyplot as plt  # pylint: disable=g-import-not-at-top
+  try:
+    result = plot_fn(**kwargs)
+    if hasattr(result, 'savefig'):
+      fig = result
+    elif getattr(result, 'figure', None) is not None:
+      fig = result.figure
+    else:
+      fig = plt.gcf()
+    fig.savefig(path, format=file_format, bbox_inches='tight')
+  finally:
+    plt.close('all')
+  return path
+
+
+def render_plots(tasks, out_dir, file_format='png', num_workers=None):
+  """Renders figures in parallel and saves them to out_dir.
+
+  Args:
+    tasks: List of (file_name, plot_fn, kwargs) tuples. Each figure is saved to
+      '<out_dir>/<file_name>.<file_format>'.
+    out_dir: Directory to save the figures to.
+    file_format: Format to save the figures in, e.g. 'png', 'svg' or 'eps'.
+    num_workers: Number of worker processes. Defaults to the number of CPUs. 1
+      renders in this process, with the current matplotlib backend.
+
+  Returns:
+    List of the paths of the saved figures, in the order of tasks.
+  """
+  if not os.path.exists(out_dir):
+    os.makedirs(out_dir)
+  render_args = [(os.path.join(out_dir, '%s.%s' % (file_name, file_format)),
+                  file_format, plot_fn, kwargs)
+                 for file_name, plot_fn, kwargs in tasks]
+  num_workers = num_workers or multiprocessing.cpu_count()
+  if num_workers <= 1 or len(render_args) <= 1:
+    return [_render(args) for args in render_args]
+  pool = multiprocessing.Pool(
+      min(num_workers, len(render_args)), initializer=_init_worker)
+  try:
+    return pool.map(_render, render_args, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import pandas as pd
+import tensorflow as tf
+import batch_plots
+import model_bias_analysis as mba
+
+
+class BatchPlotsTest(tf.test.TestCase):
+
+  def test_render_plots(self):
+    df = pd.DataFrame({
+        'subgroup': ['a', 'b', 'c'],
+        'aucs': [[0.9, 0.95], [0.85], [0.8, 0.82, 0.99]],
+    })
+    tasks = [('scatter_%d' % i, mba.per_subgroup_scatterplots, {
+        'df': df,
+        'subgroup_col': 'subgroup',
+        'values_col': 'aucs',
+        'title': str(i),
+        'out_dir': None,
+    }) for i in range(3)]
+    out_dir = os.path.join(self.get_temp_dir(), 'plots')
+    paths = batch_plots.render_plots(tasks, out_dir, num_workers=2)
+    self.assertEqual(paths, [
+        os.path.join(out_dir, 'scatter_%d.png' % i) for i in range(3)
+    ])
+    for path in paths:
+      self.assertGreater(os.path.getsize(path), 0)
+
+  def test_init_worker_switches_imported_pyplot(self):
+    import matplotlib.pyplot as plt
+    backend = plt.get_backend()
+    self.addCleanup(plt.switch_backend, backend)
+    plt.switch_backend('pdf')
+    batch_plots._init_worker()
+    self.assertEqual(plt.get_backend().lower(), 'agg')
+
+  def test_scatterplot_saves_to_out_dir(self):
+    df = pd.DataFrame({'subgroup': ['a', 'b'], 'aucs': [[0.9, 0.95], [0.85]]})
+    fig = mba.per_subgroup_scatterplots(
+        df, 'subgroup', 'aucs', out_dir=self.get_temp_dir(), file_format='svg')
+    self.assertEqual(len(fig.axes[0].collections), 1)
+    self.assertEqual(len(fig.axes[0].collections[0].get_offsets()), 3)
+    # Points are colored by subgroup.
+    colors = fig.axes[0].collections[0].get_facecolors()
+    self.assertAllEqual(colors[0], colors[1])
+    self.assertNotAllClose(colors[0], colors[2])
+    self.assertTrue(
+        os.path.exists(os.path.join(self.get_temp_dir(), 'plot_aucs.svg')))
+
+
+if __name__ == '__main__':
+  tf.test.main()
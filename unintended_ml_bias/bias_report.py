@@ -0,0 +1,194 @@
+"""Renders bias metrics results as color-coded HTML tables.
+
+plot_auc_heatmap and plot_aeg_heatmap in model_bias_analysis draw a seaborn
+heatmap per call, which is slow for reports with hundreds of subgroups and
+dozens of models, and the resulting images are heavy for browsers. This module
+renders the same heatmaps, with the same color scales, as HTML tables in a
+single pass over the results, without creating any matplotlib figures.
+
+Large tables are split into pages of page_size subgroups, each in its own
+collapsible <details> element. Browsers skip layout of closed pages, so very
+large reports stay responsive.
+
+Example usage:
+
+  results = model_bias_analysis.compute_bias_metrics_for_models(
+      dataset, subgroups, models, 'label')
+  with io.open('report.html', 'w', encoding='utf-8') as f:
+    write_bias_report(f, results, models)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+try:
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import model_bias_analysis
+
+# The seaborn palettes of plot_auc_heatmap (sns.color_palette('coolwarm', 9)[4:]
+# reversed) and plot_aeg_heatmap (sns.color_palette('coolwarm', 7)), as hex.
+AUC_PALETTE = ['#d65244', '#ee8468', '#f7ac8e', '#f2cbb7', '#dddcdc']
+AEG_PALETTE = [
+    '#6282ea', '#8db0fe', '#b9d0f9', '#dddcdc', '#f5c4ac', '#f4987a', '#dd5f4b'
+]
+
+DEFAULT_PAGE_SIZE = 100
+
+_STYLE = """<style>
+table.bias-metrics { border-collapse: collapse; font: 12px sans-serif; }
+table.bias-metrics th, table.bias-metrics td { padding: 2px 6px; }
+table.bias-metrics td { text-align: center; }
+table.bias-metrics th.subgroup { text-align: right; }
+table.bias-metrics .metric-start { border-left: 2px solid black; }
+</style>
+"""
+
+
+def _text(value):
+  """Returns value as escaped unicode, decoding byte strings as UTF-8."""
+  if isinstance(value, bytes):
+    value = value.decode('utf-8')
+  return escape(u'{}'.format(value))
+
+
+def _relative_luminance(hex_color):
+  """Relative luminance of a color, as seaborn uses to pick annotation color."""
+  rgb = np.array([int(hex_color[i:i + 2], 16) for i in (1, 3, 5)]) / 255
+  rgb = np.where(rgb <= .03928, rgb / 12.92, ((rgb + .055) / 1.055)**2.4)
+  return rgb.dot([.2126, .7152, .0722])
+
+
+def _cell_styles(palette):
+  """Returns the CSS style of a cell for each palette color, plus NaN cells."""
+  styles = []
+  for color in palette:
+    text_color = '#262626' if _relative_luminance(color) > .408 else '#ffffff'
+    styles.append('background:{};color:{}'.format(color, text_color))
+  return styles + ['background:#ffffff']
+
+
+def _color_indices(values, num_colors, vmin, vmax):
+  """Maps values to palette indices like a matplotlib ListedColormap.
+
+  NaNs map to num_colors, one past the last color.
+  """
+  with np.errstate(invalid='ignore'):
+    scaled = (values - vmin) / (vmax - vmin) * num_colors
+    indices = np.clip(np.floor(scaled), 0, num_colors - 1)
+  return np.where(np.isnan(values), num_colors, indices).astype(int)
+
+
+def metric_table_html(bias_metrics_results,
+                      models,
+                      metrics_list,
+                      palette,
+                      vmin,
+                      vmax,
+                      page_size=DEFAULT_PAGE_SIZE):
+  """Renders one heatmap table, like plot_metric_heatmap, as HTML.
+
+  Args:
+    bias_metrics_results: Results of compute_bias_metrics_for_models.
+    models: List of model names to include.
+    metrics_list: List of metrics to include, e.g. model_bias_analysis.AUCS.
+    palette: List of hex colors spread evenly over [vmin, vmax].
+    vmin: Value of the lowest color.
+    vmax: Value of the highest color.
+    page_size: Number of subgroups per page. None renders a single page.
+
+  Returns:
+    The HTML as a string.
+  """
+  columns = [
+      model_bias_analysis.column_name(model, metric)
+      for metric in metrics_list
+      for model in models
+  ]
+  values = bias_metrics_results[columns].values.astype(float)
+  styles = np.array(_cell_styles(palette))[_color_indices(
+      values, len(palette), vmin, vmax)]
+  # Like the heatmap's fmt='.2' annotations.
+  labels = [['' if np.isnan(v) else '{:.2}'.format(v) for v in row]
+            for row in values]
+  # Subgroups are often non-ASCII identity terms, so the rows are unicode.
+  subgroups = [
+      _text(s) for s in bias_metrics_results[model_bias_analysis.SUBGROUP]
+  ]
+  metric_start = [
+      ' class="metric-start"' if i % len(models) == 0 else ''
+      for i in range(len(columns))
+  ]
+
+  header = [u'<thead><tr><th></th>']
+  header.extend(u'<th colspan="{}" class="metric-start">{}</th>'.format(
+      len(models), _text(metric)) for metric in metrics_list)
+  header.append(u'</tr><tr><th class="subgroup">subgroup</th>')
+  header.extend(u'<th{}>{}</th>'.format(metric_start[i], _text(model))
+                for i, model in enumerate(models * len(metrics_list)))
+  header.append(u'</tr></thead>')
+  header = u''.join(header)
+
+  rows = []
+  for row, subgroup in enumerate(subgroups):
+    cells = ''.join(
+        '<td{} style="{}">{}</td>'.format(metric_start[i], styles[row, i],
+                                          labels[row][i])
+        for i in range(len(columns)))
+    rows.append(u'<tr><th class="subgroup">{}</th>{}</tr>'.format(
+        subgroup, cells))
+
+  page_size = page_size or max(len(rows), 1)
+  pages = []
+  for start in range(0, max(len(rows), 1), page_size):
+    end = min(start + page_size, len(rows))
+    table = u'<table class="bias-metrics">{}<tbody>{}</tbody></table>'.format(
+        header, u''.join(rows[start:end]))
+    if page_size >= len(rows):
+      pages.append(table)
+    else:
+      pages.append(
+          u'<details{}><summary>Subgroups {}-{} of {}</summary>{}</details>'
+          .format(' open' if start == 0 else '', start + 1, end, len(rows),
+                  table))
+  return u'\n'.join(pages)
+
+
+def auc_table_html(bias_metrics_results, models,
+                   page_size=DEFAULT_PAGE_SIZE):
+  """Renders the AUCs like plot_auc_heatmap."""
+  return metric_table_html(bias_metrics_results, models,
+                           model_bias_analysis.AUCS, AUC_PALETTE, 0.5, 1.0,
+                           page_size)
+
+
+def aeg_table_html(bias_metrics_results, models,
+                   page_size=DEFAULT_PAGE_SIZE):
+  """Renders the AEGs like plot_aeg_heatmap."""
+  return metric_table_html(bias_metrics_results, models,
+                           model_bias_analysis.AEGS, AEG_PALETTE, -0.5, 0.5,
+                           page_size)
+
+
+def write_bias_report(out,
+                      bias_metrics_results,
+                      models,
+                      title='Bias metrics',
+                      page_size=DEFAULT_PAGE_SIZE):
+  """Writes an HTML page with the AUC and AEG tables of models to out.
+
+  The page is written as unicode, so out should be a text file, e.g. opened
+  with io.open(path, 'w', encoding='utf-8').
+  """
+  out.write(u'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{}'
+            u'</title>\n{}</head><body>\n'.format(_text(title), _STYLE))
+  out.write(u'<h1>{}</h1>\n<h2>AUCs</h2>\n'.format(_text(title)))
+  out.write(auc_table_html(bias_metrics_results, models, page_size))
+  out.write(u'\n<h2>AEGs</h2>\n')
+  out.write(aeg_table_html(bias_metrics_results, models, page_size))
+  out.write(u'\n</body></html>\n')
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import bias_report
+import model_bias_analysis as mba
+
+
+class BiasReportTest(tf.test.TestCase):
+
+  def make_results(self, num_subgroups=3):
+    results = pd.DataFrame({
+        mba.SUBGROUP: ['group_%d' % i for i in range(num_subgroups)],
+        mba.SUBSET_SIZE: [10] * num_subgroups,
+    })
+    for metric in mba.AUCS + mba.AEGS:
+      results[mba.column_name('model', metric)] = 0.75
+    return results
+
+  def test_color_indices_match_colormap_bins(self):
+    values = np.array([0.5, 0.59, 0.61, 0.99, 1.0, 1.5, 0.1, np.nan])
+    self.assertEqual(
+        bias_report._color_indices(values, 5, 0.5, 1.0).tolist(),
+        [0, 0, 1, 4, 4, 4, 0, 5])
+
+  def test_auc_table(self):
+    results = self.make_results()
+    results.loc[1, 'model_subgroup_auc'] = np.nan
+    html = bias_report.auc_table_html(results, ['model'])
+    self.assertEqual(html.count('<tr><th class="subgroup">group_'), 3)
+    self.assertIn('>0.75</td>', html)
+    self.assertIn('background:#f7ac8e;color:#262626', html)
+    self.assertIn('style="background:#ffffff"></td>', html)
+    self.assertNotIn('<details', html)
+
+  def test_pagination(self):
+    html = bias_report.aeg_table_html(
+        self.make_results(5), ['model'], page_size=2)
+    self.assertEqual(html.count('<table'), 3)
+    self.assertEqual(html.count('<details open>'), 1)
+    self.assertIn('Subgroups 5-5 of 5', html)
+
+  def test_write_bias_report(self):
+    path = os.path.join(self.get_temp_dir(), 'report.html')
+    results = self.make_results()
+    results.loc[0, mba.SUBGROUP] = u'chr\xe9tien'
+    with io.open(path, 'w', encoding='utf-8') as f:
+      bias_report.write_bias_report(f, results, ['model'],
+                                    title='Report <test>')
+    with io.open(path, encoding='utf-8') as f:
+      html = f.read()
+    self.assertIn('Report &lt;test&gt;', html)
+    self.assertIn(u'<th class="subgroup">chr\xe9tien</th>', html)
+    self.assertEqual(html.count('<table'), 2)
+
+  def test_utf8_byte_strings(self):
+    path = os.path.join(self.get_temp_dir(), 'report.html')
+    model = u'mod\xe8le'.encode('utf-8')
+    results = self.make_results()
+    results.loc[0, mba.SUBGROUP] = u'chr\xe9tien'.encode('utf-8')
+    for metric in mba.AUCS + mba.AEGS:
+      results[mba.column_name(model, metric)] = 0.75
+    with io.open(path, 'w', encoding='utf-8') as f:
+      bias_report.write_bias_report(f, results, [model],
+                                    title=u'R\xe9sum\xe9'.encode('utf-8'))
+    with io.open(path, encoding='utf-8') as f:
+      html = f.read()
+    self.assertIn(u'<th class="subgroup">chr\xe9tien</th>', html)
+    self.assertIn(u'<th class="metric-start">mod\xe8le</th>', html)
+    self.assertIn(u'<h1>R\xe9sum\xe9</h1>', html)
+
+
+if __name__ == '__main__':
+  tf.test.main()
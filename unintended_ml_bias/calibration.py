@@ -0,0 +1,259 @@
+"""Per-subgroup calibration and score distributions, from one binning pass.
+
+ScoreHistograms bins the scores of each model once, into fine bins of [0, 1],
+and counts the examples and sums the scores of every (subgroup, label, bin).
+Reliability curves, expected calibration errors, score quantiles and coarser
+histograms of any subgroup are then computed from these counts alone.
+
+Subgroups overlap, so rows aren't binned per subgroup. Instead, the distinct
+combinations of subgroup memberships of the rows (usually far fewer than the
+rows) are found once, and each model's counts are one np.bincount over
+combined (combination, label, bin) codes. A subgroup's counts are the sum of
+the counts of the combinations it is part of. This costs O(rows) per model,
+whatever the number of subgroups.
+
+Example usage:
+
+  histograms = ScoreHistograms.from_frame(madlibs, terms + [None],
+                                          ['wiki_cnn_v3_100'], 'label')
+  print(histograms.calibration_errors())
+  print(histograms.reliability_curves('wiki_cnn_v3_100'))
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+try:
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import model_bias_analysis
+
+DEFAULT_NUM_BINS = 1000
+
+LABEL = 'label'
+BIN_LOW = 'bin_low'
+BIN_HIGH = 'bin_high'
+COUNT = 'count'
+MEAN_SCORE = 'mean_score'
+POSITIVE_RATE = 'positive_rate'
+ECE = 'ece'
+
+
+def _membership_combinations(dataset, subgroups):
+  """Returns each row's combination of subgroups, and each one's subgroups.
+
+  Args:
+    dataset: DataFrame with the boolean subgroup columns.
+    subgroups: Subgroup columns. None stands for the whole dataset.
+
+  Returns:
+    (codes, members): codes[i] is the combination of row i, and members is a
+    [num_combinations, len(subgroups)] boolean matrix.
+  """
+  width = (len(subgroups) + 7) // 8
+  # Memberships are packed into bits column by column, to keep memory low.
+  packed = np.zeros((len(dataset), max(width, 1)), dtype=np.uint8)
+  for i, subgroup in enumerate(subgroups):
+    if subgroup is None:
+      continue
+    mask = np.asarray(dataset[subgroup], dtype=np.uint8)
+    packed[:, i // 8] |= mask << (7 - i % 8)
+  rows = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+  combinations, codes = np.unique(rows, return_inverse=True)
+  members = np.unpackbits(
+      np.frombuffer(combinations.tobytes(), dtype=np.uint8).reshape(
+          len(combinations), -1),
+      axis=1)[:, :len(subgroups)].astype(bool)
+  members[:, [i for i, s in enumerate(subgroups) if s is None]] = True
+  return codes, members
+
+
+class ScoreHistograms(object):
+  """Fine score histograms of every model, subgroup and label."""
+
+  def __init__(self, models, subgroups, counts, score_sums):
+    """Initializes the histograms. Use from_frame to compute them.
+
+    Args:
+      models: List of models.
+      subgroups: List of subgroups. None stands for the whole dataset.
+      counts: [len(models), len(subgroups), 2, num_bins] number of examples of
+        each model, subgroup, label (False, True) and score bin. Bin i holds
+        scores in [i / num_bins, (i + 1) / num_bins), and the last bin also 1.
+      score_sums: Sum of the scores in each of the counts.
+    """
+    self.models = list(models)
+    self.subgroups = list(subgroups)
+    self.counts = counts
+    self.score_sums = score_sums
+    self.num_bins = counts.shape[-1]
+    self._model_index = dict((m, i) for i, m in enumerate(self.models))
+
+  @classmethod
+  def from_frame(cls,
+                 dataset,
+                 subgroups,
+                 models,
+                 label_col,
+                 num_bins=DEFAULT_NUM_BINS):
+    """Bins the scores of a model_bias_analysis data frame.
+
+    Args:
+      dataset: DataFrame with the label, model score and subgroup columns.
+      subgroups: Boolean subgroup columns. None stands for the whole dataset.
+      models: Model score columns, with scores in [0, 1].
+      label_col: Boolean label column.
+      num_bins: Number of fine bins. Coarser histograms can use any divisor of
+        num_bins as their number of bins.
+    """
+    codes, members = _membership_combinations(dataset, subgroups)
+    num_combinations = len(members)
+    labels = np.asarray(dataset[label_col], dtype=bool)
+    # Combined (combination, label) codes, shared by all models.
+    codes = (codes * 2 + labels) * num_bins
+    size = num_combinations * 2 * num_bins
+    shape = (num_combinations, 2 * num_bins)
+    counts = np.empty((len(models), len(subgroups), 2, num_bins))
+    score_sums = np.empty_like(counts)
+    for i, model in enumerate(models):
+      scores = np.asarray(dataset[model], dtype=float)
+      bins = np.clip((scores * num_bins).astype(int), 0, num_bins - 1)
+      combined = codes + bins
+      model_counts = np.bincount(combined, minlength=size).reshape(shape)
+      model_sums = np.bincount(
+          combined, weights=scores, minlength=size).reshape(shape)
+      counts[i] = members.T.dot(model_counts).reshape(counts.shape[1:])
+      score_sums[i] = members.T.dot(model_sums).reshape(counts.shape[1:])
+    return cls(models, subgroups, counts, score_sums)
+
+  def _coarse(self, values, num_bins):
+    """Sums values, [..., self.num_bins], into num_bins coarser bins."""
+    if self.num_bins % num_bins:
+      raise ValueError('num_bins must divide %d' % self.num_bins)
+    return values.reshape(values.shape[:-1] +
+                          (num_bins, self.num_bins // num_bins)).sum(axis=-1)
+
+  def _model(self, model):
+    i = self._model_index[model]
+    return self.counts[i], self.score_sums[i]
+
+  def histograms(self, model, num_bins=20):
+    """Returns the score histogram of each subgroup and label.
+
+    Returns:
+      DataFrame with SUBGROUP, LABEL, BIN_LOW, BIN_HIGH and COUNT columns.
+    """
+    counts = self._coarse(self._model(model)[0], num_bins)
+    edges = np.linspace(0, 1, num_bins + 1)
+    records = []
+    for subgroup, subgroup_counts in zip(self.subgroups, counts):
+      for label in (False, True):
+        for i, count in enumerate(subgroup_counts[int(label)]):
+          records.append({
+              model_bias_analysis.SUBGROUP: subgroup,
+              LABEL: label,
+              BIN_LOW: edges[i],
+              BIN_HIGH: edges[i + 1],
+              COUNT: int(count),
+          })
+    return pd.DataFrame(
+        records,
+        columns=[model_bias_analysis.SUBGROUP, LABEL, BIN_LOW, BIN_HIGH, COUNT])
+
+  def reliability_curves(self, model, num_bins=10):
+    """Returns the mean score and positive rate of each subgroup's score bins.
+
+    Returns:
+      DataFrame with SUBGROUP, BIN_LOW, BIN_HIGH, COUNT, MEAN_SCORE and
+      POSITIVE_RATE columns. Empty bins have NaN mean score and positive rate.
+    """
+    counts, score_sums = self._model(model)
+    counts = self._coarse(counts, num_bins)
+    score_sums = self._coarse(score_sums, num_bins).sum(axis=1)
+    totals = counts.sum(axis=1)
+    edges = np.linspace(0, 1, num_bins + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      mean_scores = score_sums / totals
+      positive_rates = counts[:, 1] / totals
+    return pd.DataFrame({
+        model_bias_analysis.SUBGROUP:
+            np.repeat(np.array(self.subgroups, dtype=object), num_bins),
+        BIN_LOW: np.tile(edges[:-1], len(self.subgroups)),
+        BIN_HIGH: np.tile(edges[1:], len(self.subgroups)),
+        COUNT: totals.ravel().astype(int),
+        MEAN_SCORE: mean_scores.ravel(),
+        POSITIVE_RATE: positive_rates.ravel(),
+    }, columns=[
+        model_bias_analysis.SUBGROUP, BIN_LOW, BIN_HIGH, COUNT, MEAN_SCORE,
+        POSITIVE_RATE
+    ])
+
+  def _subgroup_sizes(self):
+    return self.counts[0].sum(axis=(1, 2)).astype(int)
+
+  def calibration_errors(self, num_bins=10):
+    """Returns the expected calibration error of each subgroup and model.
+
+    The expected calibration error is the mean, over score bins weighted by
+    their number of examples, of |mean score - positive rate|.
+
+    Returns:
+      DataFrame in the layout of model_bias_analysis.compute_bias_metrics_for_
+      models, with an ECE column per model.
+    """
+    results = pd.DataFrame({
+        model_bias_analysis.SUBGROUP: self.subgroups,
+        model_bias_analysis.SUBSET_SIZE: self._subgroup_sizes(),
+    })
+    for model in self.models:
+      counts, score_sums = self._model(model)
+      counts = self._coarse(counts, num_bins)
+      score_sums = self._coarse(score_sums, num_bins).sum(axis=1)
+      # |sum of scores - number of positives| of a bin is its count times
+      # |mean score - positive rate|.
+      with np.errstate(invalid='ignore', divide='ignore'):
+        errors = (np.abs(score_sums - counts[:, 1]).sum(axis=1) /
+                  counts.sum(axis=(1, 2)))
+      results[model_bias_analysis.column_name(model, ECE)] = errors
+    return results
+
+  def quantiles(self, quantiles=(0.25, 0.5, 0.75)):
+    """Returns score quantiles of the negative and positive examples.
+
+    Quantiles are interpolated linearly within the fine bins, so they are
+    accurate to 1 / num_bins.
+
+    Returns:
+      DataFrame in the layout of model_bias_analysis.compute_bias_metrics_for_
+      models, with columns like <model>_negative_q50 and <model>_positive_q50.
+    """
+    results = pd.DataFrame({
+        model_bias_analysis.SUBGROUP: self.subgroups,
+        model_bias_analysis.SUBSET_SIZE: self._subgroup_sizes(),
+    })
+    edges = np.linspace(0, 1, self.num_bins + 1)
+    for model in self.models:
+      counts = self._model(model)[0]
+      for label, label_name in ((0, 'negative'), (1, 'positive')):
+        cumulative = np.cumsum(counts[:, label], axis=1)
+        for q in quantiles:
+          values = np.full(len(self.subgroups), np.nan)
+          for i, subgroup_cumulative in enumerate(cumulative):
+            total = subgroup_cumulative[-1]
+            if not total:
+              continue
+            # Interpolates between the edges of the bin reaching q * total.
+            target = q * total
+            b = min(np.searchsorted(subgroup_cumulative, target),
+                    self.num_bins - 1)
+            before = subgroup_cumulative[b - 1] if b else 0
+            fraction = (target - before) / max(subgroup_cumulative[b] - before,
+                                               1)
+            values[i] = edges[b] + fraction / self.num_bins
+          column = '%s_q%d' % (label_name, int(round(q * 100)))
+          results[model_bias_analysis.column_name(model, column)] = values
+    return results
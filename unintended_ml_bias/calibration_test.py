@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import calibration
+import model_bias_analysis as mba
+
+
+class CalibrationTest(tf.test.TestCase):
+
+  def make_dataset(self, size=500):
+    rng = np.random.RandomState(7)
+    label = rng.rand(size) < 0.3
+    return pd.DataFrame({
+        'label': label,
+        'gay': rng.rand(size) < 0.3,
+        'muslim': rng.rand(size) < 0.2,
+        'empty': np.zeros(size, dtype=bool),
+        'model': np.clip(0.5 * label + 0.5 * rng.rand(size), 0, 1),
+    })
+
+  def test_histograms(self):
+    dataset = self.make_dataset()
+    histograms = calibration.ScoreHistograms.from_frame(
+        dataset, ['gay', 'muslim', None], ['model'], 'label', num_bins=100)
+    result = histograms.histograms('model', num_bins=4)
+    self.assertEqual(len(result), 3 * 2 * 4)
+    subset = dataset[dataset['muslim'] & dataset['label']]
+    expected = np.histogram(subset['model'], bins=np.linspace(0, 1, 5))[0]
+    rows = result[(result[mba.SUBGROUP] == 'muslim') &
+                  result[calibration.LABEL]]
+    self.assertEqual(rows[calibration.COUNT].tolist(), expected.tolist())
+    total = result[result[mba.SUBGROUP].isnull()][calibration.COUNT].sum()
+    self.assertEqual(total, len(dataset))
+    with self.assertRaises(ValueError):
+      histograms.histograms('model', num_bins=3)
+
+  def test_reliability_curves_and_calibration_errors(self):
+    dataset = self.make_dataset()
+    histograms = calibration.ScoreHistograms.from_frame(
+        dataset, ['gay', 'empty'], ['model'], 'label')
+    curves = histograms.reliability_curves('model', num_bins=10)
+    subset = dataset[dataset['gay']]
+    bins = np.minimum((subset['model'] * 10).astype(int), 9)
+    grouped = subset.groupby(bins)
+    gay = curves[curves[mba.SUBGROUP] == 'gay']
+    gay.index = (gay[calibration.BIN_LOW] * 10).round().astype(int)
+    nonempty = sorted(grouped.groups.keys())
+    self.assertAllClose(gay.loc[nonempty, calibration.MEAN_SCORE],
+                        grouped['model'].mean()[nonempty])
+    self.assertAllClose(gay.loc[nonempty, calibration.POSITIVE_RATE],
+                        grouped['label'].mean()[nonempty])
+    expected_ece = (grouped.size() * (grouped['model'].mean() -
+                                      grouped['label'].mean()).abs()).sum()
+    errors = histograms.calibration_errors(num_bins=10).set_index(
+        mba.SUBGROUP)
+    column = mba.column_name('model', calibration.ECE)
+    self.assertAlmostEqual(errors.loc['gay', column],
+                           expected_ece / len(subset))
+    self.assertTrue(np.isnan(errors.loc['empty', column]))
+    self.assertEqual(errors.loc['empty', mba.SUBSET_SIZE], 0)
+
+  def test_quantiles(self):
+    dataset = self.make_dataset()
+    histograms = calibration.ScoreHistograms.from_frame(
+        dataset, ['gay'], ['model'], 'label')
+    result = histograms.quantiles([0.5, 0.9])
+    subset = dataset[dataset['gay'] & ~dataset['label']]
+    self.assertAllClose(
+        [result[mba.column_name('model', 'negative_q50')][0],
+         result[mba.column_name('model', 'negative_q90')][0]],
+        np.percentile(subset['model'], [50, 90]), atol=0.01)
+
+
+if __name__ == '__main__':
+  tf.test.main()
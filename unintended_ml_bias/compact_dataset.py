@@ -0,0 +1,220 @@
+"""Compact in-memory representation of scored analysis datasets.
+
+model_bias_analysis works on a DataFrame with a float64 score column per model
+and a bool column per subgroup. With dozens of models, hundreds of subgroups
+and millions of rows, that frame takes tens of GB. CompactDataset holds the
+same data in a fraction of the memory:
+
+  scores: [num_models, num_rows] matrix of float32 scores, or of uint16 scores
+      quantized to 65536 levels of [0, 1] (a quarter of the size of float64).
+  subgroups: [num_subgroups, ceil(num_rows / 8)] bit-packed membership.
+  labels: bool array.
+
+compute_bias_metrics computes the model_bias_analysis bias metrics directly on
+a CompactDataset, with the same output layout as
+model_bias_analysis.compute_bias_metrics_for_models. quantization_error reports
+how much the compact representation changes the metrics.
+
+Example usage:
+
+  compact = CompactDataset.from_frame(dataset, models, subgroups, 'label',
+                                      score_dtype='uint16')
+  del dataset
+  results = compute_bias_metrics(compact)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+try:
+  import analysis_context
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import analysis_context
+  from unintended_ml_bias import model_bias_analysis
+
+FLOAT32 = 'float32'
+UINT16 = 'uint16'
+
+_UINT16_LEVELS = np.iinfo(np.uint16).max
+
+
+def quantize_scores(scores, score_dtype):
+  """Converts scores in [0, 1] to score_dtype, FLOAT32 or UINT16."""
+  scores = np.asarray(scores)
+  if score_dtype == FLOAT32:
+    return scores.astype(np.float32)
+  if score_dtype == UINT16:
+    return np.round(np.clip(scores, 0, 1) * _UINT16_LEVELS).astype(np.uint16)
+  raise ValueError('unknown score dtype: %s' % score_dtype)
+
+
+class CompactDataset(object):
+  """Quantized scores, bit-packed subgroups and bool labels of a dataset."""
+
+  def __init__(self, models, subgroups, scores, packed_subgroups, labels):
+    self.models = list(models)
+    self.subgroups = list(subgroups)
+    self.scores = scores
+    self.packed_subgroups = packed_subgroups
+    self.labels = labels
+    self._model_index = dict((m, i) for i, m in enumerate(self.models))
+    self._subgroup_index = dict((s, i) for i, s in enumerate(self.subgroups))
+
+  @classmethod
+  def from_frame(cls, df, models, subgroups, label_col, score_dtype=FLOAT32):
+    """Builds a CompactDataset from a model_bias_analysis data frame.
+
+    Args:
+      df: DataFrame with the label, model score and subgroup columns.
+      models: Model score columns. Scores must be in [0, 1] for UINT16.
+      subgroups: Boolean subgroup columns.
+      label_col: Boolean label column.
+      score_dtype: FLOAT32 or UINT16.
+    """
+    num_rows = len(df)
+    scores = np.empty(
+        (len(models), num_rows),
+        dtype=np.uint16 if score_dtype == UINT16 else np.float32)
+    for i, model in enumerate(models):
+      scores[i] = quantize_scores(df[model].values, score_dtype)
+    packed = np.empty((len(subgroups), (num_rows + 7) // 8), dtype=np.uint8)
+    for i, subgroup in enumerate(subgroups):
+      packed[i] = np.packbits(np.asarray(df[subgroup], dtype=bool))
+    labels = np.asarray(df[label_col], dtype=bool)
+    return cls(models, subgroups, scores, packed, labels)
+
+  def __len__(self):
+    return len(self.labels)
+
+  @property
+  def nbytes(self):
+    return (self.scores.nbytes + self.packed_subgroups.nbytes +
+            self.labels.nbytes)
+
+  def model_scores(self, model):
+    """Returns a model's scores, as stored (float32 or uint16)."""
+    return self.scores[self._model_index[model]]
+
+  def float_scores(self, model):
+    """Returns a model's scores as floats in the original scale."""
+    scores = self.model_scores(model)
+    if scores.dtype == np.uint16:
+      return scores / _UINT16_LEVELS
+    return scores
+
+  def subgroup_mask(self, subgroup):
+    packed = self.packed_subgroups[self._subgroup_index[subgroup]]
+    return np.unpackbits(packed)[:len(self)].astype(bool)
+
+  def subgroup_size(self, subgroup):
+    # Bits past the last row are always 0, so they don't affect the count.
+    packed = self.packed_subgroups[self._subgroup_index[subgroup]]
+    return int(np.unpackbits(packed).sum())
+
+  def save(self, path):
+    """Saves the dataset as an .npz file."""
+    np.savez(
+        path,
+        models=np.array(self.models),
+        subgroups=np.array(self.subgroups),
+        scores=self.scores,
+        packed_subgroups=self.packed_subgroups,
+        labels=self.labels)
+
+  @classmethod
+  def load(cls, path):
+    arrays = np.load(path)
+    return cls(arrays['models'].tolist(), arrays['subgroups'].tolist(),
+               arrays['scores'], arrays['packed_subgroups'], arrays['labels'])
+
+
+# Bias metric of a partition of sorted scores, for each metric.
+_METRIC_FNS = {
+    model_bias_analysis.SUBGROUP_AUC: analysis_context.subgroup_auc,
+    model_bias_analysis.NEGATIVE_CROSS_AUC: analysis_context.negative_cross_auc,
+    model_bias_analysis.POSITIVE_CROSS_AUC: analysis_context.positive_cross_auc,
+    model_bias_analysis.NEGATIVE_AEG: analysis_context.negative_aeg,
+    model_bias_analysis.POSITIVE_AEG: analysis_context.positive_aeg,
+}
+
+
+def _model_bias_metrics(sorted_scores, sorted_labels, sorted_mask):
+  """Returns the bias metrics of one model and subgroup, from sorted scores."""
+  scores = analysis_context.partition_sorted_scores(sorted_scores,
+                                                    sorted_labels, sorted_mask)
+  return dict((metric, metric_fn(scores))
+              for metric, metric_fn in _METRIC_FNS.items())
+
+
+def compute_bias_metrics(compact, models=None, subgroups=None):
+  """Computes per-subgroup bias metrics on a CompactDataset.
+
+  Args:
+    compact: CompactDataset.
+    models: Models to compute metrics for. Defaults to all of them.
+    subgroups: Subgroups to compute metrics for. Defaults to all of them.
+
+  Returns:
+    DataFrame like model_bias_analysis.compute_bias_metrics_for_models, with
+    NaN where that has None.
+  """
+  models = compact.models if models is None else models
+  subgroups = compact.subgroups if subgroups is None else subgroups
+  records = [{
+      model_bias_analysis.SUBGROUP: subgroup,
+      model_bias_analysis.SUBSET_SIZE: compact.subgroup_size(subgroup)
+  } for subgroup in subgroups]
+  for model in models:
+    # Scores are sorted once per model; uint16 scores sort exactly as ints.
+    scores = compact.model_scores(model)
+    order = np.argsort(scores, kind='mergesort')
+    sorted_scores = scores[order]
+    sorted_labels = compact.labels[order]
+    # Masks are unpacked one at a time, to keep memory compact.
+    for record, subgroup in zip(records, subgroups):
+      sorted_mask = compact.subgroup_mask(subgroup)[order]
+      metrics = _model_bias_metrics(sorted_scores, sorted_labels, sorted_mask)
+      for metric, value in metrics.items():
+        record[model_bias_analysis.column_name(model, metric)] = value
+  return pd.DataFrame(records)
+
+
+def quantization_error(df, models, subgroups, label_col, score_dtype=UINT16):
+  """Compares the bias metrics of a compact dataset with the exact ones.
+
+  Args:
+    df: DataFrame with the label, model score and subgroup columns.
+    models: Model score columns.
+    subgroups: Boolean subgroup columns.
+    label_col: Boolean label column.
+    score_dtype: FLOAT32 or UINT16.
+
+  Returns:
+    DataFrame with a row per model and metric, and the max and mean absolute
+    difference of the metric over subgroups.
+  """
+  exact = model_bias_analysis.compute_bias_metrics_for_models(
+      df, subgroups, models, label_col).set_index(model_bias_analysis.SUBGROUP)
+  compact = compute_bias_metrics(
+      CompactDataset.from_frame(df, models, subgroups, label_col,
+                                score_dtype)).set_index(
+                                    model_bias_analysis.SUBGROUP)
+  records = []
+  for model in models:
+    for metric in model_bias_analysis.METRICS:
+      column = model_bias_analysis.column_name(model, metric)
+      errors = np.abs(compact[column].astype(float) -
+                      exact.loc[compact.index, column].astype(float))
+      records.append({
+          'model': model,
+          'metric': metric,
+          'max_abs_error': errors.max(),
+          'mean_abs_error': errors.mean(),
+      })
+  return pd.DataFrame(
+      records, columns=['model', 'metric', 'max_abs_error', 'mean_abs_error'])
@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import compact_dataset
+import model_bias_analysis as mba
+
+
+class CompactDatasetTest(tf.test.TestCase):
+
+  def make_dataset(self, size=500):
+    rng = np.random.RandomState(1)
+    label = rng.rand(size) < 0.3
+    return pd.DataFrame({
+        'label': label,
+        'model_a': np.clip(0.3 * label + rng.rand(size) * 0.7, 0, 1),
+        'model_b': rng.rand(size),
+        'group_a': rng.rand(size) < 0.1,
+        'group_b': rng.rand(size) < 0.6,
+    })
+
+  def test_float32_metrics_match(self):
+    dataset = self.make_dataset()
+    models = ['model_a', 'model_b']
+    subgroups = ['group_a', 'group_b']
+    compact = compact_dataset.CompactDataset.from_frame(
+        dataset, models, subgroups, 'label')
+    expected = mba.compute_bias_metrics_for_models(dataset, subgroups, models,
+                                                   'label')
+    results = compact_dataset.compute_bias_metrics(compact)
+    self.assertEqual(results[mba.SUBSET_SIZE].tolist(),
+                     expected[mba.SUBSET_SIZE].tolist())
+    for model in models:
+      for metric in mba.METRICS:
+        column = mba.column_name(model, metric)
+        self.assertAllClose(results[column].astype(float),
+                            expected[column].astype(float))
+
+  def test_uint16_quantization_error(self):
+    dataset = self.make_dataset()
+    errors = compact_dataset.quantization_error(
+        dataset, ['model_a'], ['group_a', 'group_b'], 'label')
+    self.assertEqual(len(errors), len(mba.METRICS))
+    self.assertLess(errors['max_abs_error'].max(), 1e-3)
+
+  def test_compact_representation(self):
+    dataset = self.make_dataset(size=13)
+    compact = compact_dataset.CompactDataset.from_frame(
+        dataset, ['model_a'], ['group_b'], 'label', score_dtype='uint16')
+    self.assertEqual(compact.scores.dtype, np.uint16)
+    self.assertEqual(compact.packed_subgroups.shape, (1, 2))
+    self.assertAllEqual(compact.subgroup_mask('group_b'), dataset['group_b'])
+    self.assertEqual(compact.subgroup_size('group_b'), dataset['group_b'].sum())
+    self.assertAllClose(
+        compact.float_scores('model_a'), dataset['model_a'], atol=1e-5)
+
+    path = os.path.join(self.get_temp_dir(), 'compact.npz')
+    compact.save(path)
+    loaded = compact_dataset.CompactDataset.load(path)
+    self.assertEqual(loaded.models, ['model_a'])
+    self.assertAllEqual(loaded.scores, compact.scores)
+    self.assertAllEqual(loaded.labels, compact.labels)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,327 @@
+"""Identity term bias in word embeddings, measured before training.
+
+ToxModel.load_embeddings initializes the CNN's embedding layer from GloVe
+vectors, so associations between identity terms and toxic words in those
+vectors can bias the model from the start. This module measures them with the
+Word Embedding Association Test (WEAT, Caliskan et al. 2017):
+
+  s(w, A, B) = mean cos(w, a) over a in A - mean cos(w, b) over b in B
+  effect size = (mean s(x, A, B) over x in X - mean s(y, A, B) over y in Y)
+                / std of s(w, A, B) over w in X and Y
+
+for target sets X, Y (e.g. identity terms of two religions) and attribute sets
+A, B (e.g. toxic and nontoxic adjectives). Its p-value is the fraction of
+equal-size re-partitions of X and Y with at least the observed difference.
+
+All cosine similarities of a set of terms are one matrix product of
+L2-normalized vectors, and permutations are drawn in batches of index
+matrices, so testing every pair of identity term sets takes a few matrix
+products.
+
+The GloVe text file is converted once into a sorted vocabulary array and an
+.npy matrix, which is memory-mapped, so only the rows of the terms looked up
+are read. Words are found by binary search in the sorted vocabulary, without
+building a dict of the whole vocabulary.
+
+Example usage:
+
+  convert_glove(model_tool.DEFAULT_EMBEDDINGS_PATH, '../data/glove_100d')
+  embeddings = EmbeddingMatrix.load('../data/glove_100d')
+  word_sets = read_word_sets('new_madlibber/input_data/English/words.csv')
+  print(pairwise_effect_sizes(
+      embeddings, dict((s, word_sets[s]) for s in ['religion', 'sexuality']),
+      word_sets['toxic'], word_sets['nontoxic']))
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import itertools
+
+import numpy as np
+import pandas as pd
+
+try:
+  import fast_tokenizer
+except ImportError:
+  from unintended_ml_bias import fast_tokenizer
+
+TARGET_X = 'target_x'
+TARGET_Y = 'target_y'
+EFFECT_SIZE = 'effect_size'
+P_VALUE = 'p_value'
+NUM_X = 'num_x'
+NUM_Y = 'num_y'
+TERM = 'term'
+ASSOCIATION = 'association'
+
+DEFAULT_NUM_PERMUTATIONS = 10000
+
+# Maximum number of random numbers drawn at once for a batch of permutations.
+_MAX_BATCH_ELEMENTS = 10000000
+
+
+def _vocabulary_path(path_prefix):
+  return path_prefix + '_vocabulary.npy'
+
+
+def _vectors_path(path_prefix):
+  return path_prefix + '_vectors.npy'
+
+
+def convert_glove(glove_path, path_prefix):
+  """Converts a GloVe text file for EmbeddingMatrix.load.
+
+  Writes <path_prefix>_vocabulary.npy, the sorted words, and
+  <path_prefix>_vectors.npy, the float32 vectors in the same order. The
+  vectors are written through a memory map, so the file is never fully in
+  memory.
+  """
+  words = []
+  dim = None
+  with io.open(glove_path, encoding='utf-8') as f:
+    for line in f:
+      word, _, rest = line.rstrip(u'\n').partition(u' ')
+      words.append(word)
+      if dim is None:
+        dim = len(rest.split(u' '))
+  order = np.argsort(np.array(words), kind='mergesort')
+  # Row of each line of the file in the sorted matrix.
+  rows = np.empty(len(words), dtype=np.int64)
+  rows[order] = np.arange(len(words))
+  vectors = np.lib.format.open_memmap(
+      _vectors_path(path_prefix),
+      mode='w+',
+      dtype=np.float32,
+      shape=(len(words), dim or 0))
+  with io.open(glove_path, encoding='utf-8') as f:
+    for row, line in zip(rows, f):
+      vectors[row] = np.array(line.rstrip(u'\n').split(u' ')[1:],
+                              dtype=np.float32)
+  vectors.flush()
+  del vectors
+  np.save(_vocabulary_path(path_prefix), np.array(words)[order])
+
+
+class EmbeddingMatrix(object):
+  """Word vectors with a sorted vocabulary, usually memory-mapped."""
+
+  def __init__(self, vocabulary, vectors):
+    """Initializes the matrix. Use load to open a converted GloVe file.
+
+    Args:
+      vocabulary: Sorted array of words.
+      vectors: [len(vocabulary), dim] array of the words' vectors.
+    """
+    self.vocabulary = vocabulary
+    self.vectors = vectors
+
+  @classmethod
+  def load(cls, path_prefix):
+    """Opens the files written by convert_glove, memory-mapping the vectors."""
+    return cls(
+        np.load(_vocabulary_path(path_prefix)),
+        np.load(_vectors_path(path_prefix), mmap_mode='r'))
+
+  def lookup(self, words):
+    """Returns the row of each word, or -1 for words not in the vocabulary."""
+    words = [
+        word if isinstance(word, type(u'')) else word.decode('utf-8')
+        for word in words
+    ]
+    if not len(self.vocabulary) or not words:
+      return np.full(len(words), -1, dtype=np.int64)
+    words = np.array(words)
+    rows = np.searchsorted(self.vocabulary, words)
+    found = rows < len(self.vocabulary)
+    found[found] = self.vocabulary[rows[found]] == words[found]
+    return np.where(found, rows, -1)
+
+  def term_vectors(self, terms):
+    """Returns the unit vectors of the terms found in the vocabulary.
+
+    A term of several words, like 'african american', is represented by the
+    mean of its words' vectors, and is only found if all of them are.
+
+    Returns:
+      (found_terms, vectors): the found terms, and their [len(found_terms),
+      dim] L2-normalized vectors.
+    """
+    term_words = [fast_tokenizer.text_to_word_sequence(term) for term in terms]
+    rows = self.lookup(itertools.chain.from_iterable(term_words))
+    found_terms = []
+    vectors = []
+    start = 0
+    for term, words in zip(terms, term_words):
+      word_rows = rows[start:start + len(words)]
+      start += len(words)
+      if len(words) and (word_rows >= 0).all():
+        found_terms.append(term)
+        # Rows are read in sorted order, which is faster on a memory map.
+        vectors.append(self.vectors[np.sort(word_rows)].mean(axis=0))
+    if not vectors:
+      return [], np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return found_terms, vectors / np.maximum(norms, 1e-12)
+
+
+def read_word_sets(words_csv_path):
+  """Reads the word sets of a new_madlibber words.csv file.
+
+  Identity terms are grouped by subtype (e.g. 'religion'), adjectives and
+  verbs by connotation ('toxic' and 'nontoxic'), and other words by type (e.g.
+  'name').
+
+  Returns:
+    Dict of set name to list of words.
+  """
+  words = pd.read_csv(words_csv_path, encoding='utf-8')
+  word_sets = {}
+  for _, row in words.iterrows():
+    if pd.notnull(row['subtype']):
+      name = row['subtype']
+    elif row['connotation'] in ('toxic', 'nontoxic'):
+      name = row['connotation']
+    else:
+      name = row['type']
+    word_sets.setdefault(name, []).append(row['word'])
+  return word_sets
+
+
+def _associations(embeddings, terms, attributes_a, attributes_b):
+  """Returns the found terms and their s(w, A, B)."""
+  found_terms, vectors = embeddings.term_vectors(terms)
+  _, vectors_a = embeddings.term_vectors(attributes_a)
+  _, vectors_b = embeddings.term_vectors(attributes_b)
+  if not len(vectors_a) or not len(vectors_b):
+    raise ValueError('no attribute words found in the embedding vocabulary')
+  # Cosine similarities to every attribute word, as one matrix product.
+  similarities = vectors.dot(np.concatenate([vectors_a, vectors_b]).T)
+  num_a = len(vectors_a)
+  return found_terms, (similarities[:, :num_a].mean(axis=1) -
+                       similarities[:, num_a:].mean(axis=1))
+
+
+def term_associations(embeddings, terms, attributes_a, attributes_b):
+  """Returns s(w, A, B) of each term found in the embeddings.
+
+  Returns:
+    DataFrame with TERM and ASSOCIATION columns, most associated with
+    attributes_a first.
+  """
+  found_terms, associations = _associations(embeddings, terms, attributes_a,
+                                            attributes_b)
+  results = pd.DataFrame({TERM: found_terms, ASSOCIATION: associations},
+                         columns=[TERM, ASSOCIATION])
+  return results.sort_values(ASSOCIATION, ascending=False).reset_index(
+      drop=True)
+
+
+def _effect_size(associations_x, associations_y, num_permutations, rng):
+  """Returns the WEAT effect size and permutation p-value of X and Y."""
+  num_x, num_y = len(associations_x), len(associations_y)
+  if num_x < 1 or num_y < 1 or num_x + num_y < 3:
+    return np.nan, np.nan
+  pooled = np.concatenate([associations_x, associations_y])
+  effect_size = ((associations_x.mean() - associations_y.mean()) /
+                 pooled.std(ddof=1))
+  if not num_permutations:
+    return effect_size, np.nan
+  # sum(x) - sum(y) = 2 sum(x) - sum(pooled), so the sums over X decide.
+  observed = associations_x.sum()
+  num_pooled = len(pooled)
+  batch_size = max(1, _MAX_BATCH_ELEMENTS // num_pooled)
+  at_least = 0
+  for start in range(0, num_permutations, batch_size):
+    size = min(batch_size, num_permutations - start)
+    x = rng.rand(size, num_pooled).argpartition(num_x - 1, axis=1)[:, :num_x]
+    at_least += (pooled[x].sum(axis=1) >= observed - 1e-12).sum()
+  return effect_size, (1 + at_least) / (1 + num_permutations)
+
+
+def effect_size(embeddings,
+                targets_x,
+                targets_y,
+                attributes_a,
+                attributes_b,
+                num_permutations=DEFAULT_NUM_PERMUTATIONS,
+                seed=0):
+  """Returns the WEAT effect size and p-value of two target sets.
+
+  Terms not in the embeddings are ignored.
+
+  Returns:
+    Dict with EFFECT_SIZE, P_VALUE, NUM_X and NUM_Y, the numbers of found
+    target terms.
+  """
+  results = pairwise_effect_sizes(embeddings, {
+      TARGET_X: targets_x,
+      TARGET_Y: targets_y
+  }, attributes_a, attributes_b, num_permutations, seed, [(TARGET_X,
+                                                           TARGET_Y)])
+  row = results.iloc[0]
+  return dict((column, row[column])
+              for column in [EFFECT_SIZE, P_VALUE, NUM_X, NUM_Y])
+
+
+def pairwise_effect_sizes(embeddings,
+                          target_sets,
+                          attributes_a,
+                          attributes_b,
+                          num_permutations=DEFAULT_NUM_PERMUTATIONS,
+                          seed=0,
+                          pairs=None):
+  """Returns the WEAT effect size and p-value of pairs of target sets.
+
+  The associations of all target terms are computed with one matrix product.
+
+  Args:
+    embeddings: EmbeddingMatrix.
+    target_sets: Dict of set name to terms, e.g. identity terms by subtype.
+    attributes_a: Attribute terms, e.g. toxic words.
+    attributes_b: Contrasting attribute terms, e.g. nontoxic words.
+    num_permutations: Number of permutations per pair, or 0 for no p-values.
+    seed: Random seed.
+    pairs: Optional list of (name, name) pairs of target sets. Defaults to
+      every pair of distinct sets, in sorted order.
+
+  Returns:
+    DataFrame with TARGET_X, TARGET_Y, EFFECT_SIZE, P_VALUE, NUM_X and NUM_Y
+    columns, and a row per pair. Positive effect sizes mean X is more
+    associated with attributes_a than Y is.
+  """
+  names = sorted(target_sets)
+  if pairs is None:
+    pairs = list(itertools.combinations(names, 2))
+  all_terms = list(
+      itertools.chain.from_iterable(target_sets[name] for name in names))
+  set_names = list(
+      itertools.chain.from_iterable(
+          [name] * len(target_sets[name]) for name in names))
+  found_terms, associations = _associations(embeddings, all_terms,
+                                            attributes_a, attributes_b)
+  # Found terms keep their input order, so they can be matched to their sets.
+  found = set(found_terms)
+  found_set_names = np.array(
+      [name for term, name in zip(all_terms, set_names) if term in found])
+  rng = np.random.RandomState(seed)
+  records = []
+  for name_x, name_y in pairs:
+    associations_x = associations[found_set_names == name_x]
+    associations_y = associations[found_set_names == name_y]
+    size, p_value = _effect_size(associations_x, associations_y,
+                                 num_permutations, rng)
+    records.append({
+        TARGET_X: name_x,
+        TARGET_Y: name_y,
+        EFFECT_SIZE: size,
+        P_VALUE: p_value,
+        NUM_X: len(associations_x),
+        NUM_Y: len(associations_y),
+    })
+  return pd.DataFrame(
+      records,
+      columns=[TARGET_X, TARGET_Y, EFFECT_SIZE, P_VALUE, NUM_X, NUM_Y])
@@ -0,0 +1,102 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+import embedding_association as ea
+
+# 'good' and 'bad' are the attributes; set_a words point towards 'bad'.
+VECTORS = {
+    u'good': [1, 0, 0],
+    u'bad': [0, 1, 0],
+    u'nice': [0.9, 0.1, 0.1],
+    u'nasty': [0.1, 0.9, 0.1],
+    u'alpha': [0.2, 0.8, 0.3],
+    u'beta': [0.3, 0.7, 0.2],
+    u'gamma': [0.8, 0.2, 0.3],
+    u'delta': [0.7, 0.3, 0.2],
+    u'african': [0.5, 0.5, 0.0],
+    u'american': [0.5, 0.5, 1.0],
+    u'chrétien': [0.4, 0.6, 0.1],
+}
+
+
+class EmbeddingAssociationTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    glove_path = os.path.join(self.tmp_dir, 'glove.txt')
+    with io.open(glove_path, 'w', encoding='utf-8') as f:
+      # Not in sorted order, to check that conversion sorts the vocabulary.
+      for word in reversed(sorted(VECTORS)):
+        f.write(u' '.join([word] + [u'%.2f' % v for v in VECTORS[word]]) +
+                u'\n')
+    self.prefix = os.path.join(self.tmp_dir, 'glove')
+    ea.convert_glove(glove_path, self.prefix)
+    self.embeddings = ea.EmbeddingMatrix.load(self.prefix)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_load_and_lookup(self):
+    self.assertIsInstance(self.embeddings.vectors, np.memmap)
+    self.assertEqual(list(self.embeddings.vocabulary), sorted(VECTORS))
+    rows = self.embeddings.lookup(['nice', u'chrétien', 'missing', 'zzz'])
+    self.assertAllClose(self.embeddings.vectors[rows[0]], VECTORS[u'nice'])
+    self.assertAllClose(self.embeddings.vectors[rows[1]], VECTORS[u'chrétien'])
+    self.assertAllEqual(rows[2:], [-1, -1])
+
+  def test_term_vectors(self):
+    terms, vectors = self.embeddings.term_vectors(
+        ['African American', 'missing', 'good'])
+    self.assertEqual(terms, ['African American', 'good'])
+    expected = np.array([0.5, 0.5, 0.5])
+    self.assertAllClose(vectors[0], expected / np.linalg.norm(expected))
+    self.assertAllClose(vectors[1], [1, 0, 0])
+
+  def test_term_associations(self):
+    results = ea.term_associations(self.embeddings, ['alpha', 'gamma'],
+                                   ['bad', 'nasty'], ['good', 'nice'])
+    self.assertEqual(results[ea.TERM].tolist(), ['alpha', 'gamma'])
+    self.assertGreater(results[ea.ASSOCIATION][0], 0)
+    self.assertLess(results[ea.ASSOCIATION][1], 0)
+
+  def test_effect_size(self):
+    result = ea.effect_size(
+        self.embeddings, ['alpha', 'beta', 'missing'], ['gamma', 'delta'],
+        ['bad', 'nasty'], ['good', 'nice'],
+        num_permutations=1000)
+    self.assertEqual(result[ea.NUM_X], 2)
+    self.assertEqual(result[ea.NUM_Y], 2)
+    self.assertGreater(result[ea.EFFECT_SIZE], 1)
+    # 1 of the 6 partitions of 4 terms into 2 and 2 is as extreme.
+    self.assertAllClose(result[ea.P_VALUE], 1 / 6, atol=0.05)
+    with self.assertRaises(ValueError):
+      ea.effect_size(self.embeddings, ['alpha'], ['gamma'], ['missing'],
+                     ['good'])
+
+  def test_pairwise_effect_sizes(self):
+    results = ea.pairwise_effect_sizes(
+        self.embeddings, {
+            'x': ['alpha', 'beta'],
+            'y': ['gamma', 'delta'],
+            'z': ['alpha', 'gamma']
+        }, ['bad'], ['good'],
+        num_permutations=0)
+    self.assertEqual(
+        list(zip(results[ea.TARGET_X], results[ea.TARGET_Y])),
+        [('x', 'y'), ('x', 'z'), ('y', 'z')])
+    self.assertGreater(results[ea.EFFECT_SIZE][0], 0)
+    self.assertLess(results[ea.EFFECT_SIZE][2], 0)
+    self.assertTrue(results[ea.P_VALUE].isnull().all())
+
+
+if __name__ == '__main__':
+  tf.test.main()
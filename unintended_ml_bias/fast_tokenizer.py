@@ -0,0 +1,163 @@
+"""Fast conversion of texts to padded token sequences.
+
+SequenceTokenizer produces the same integer sequences as the Keras
+Tokenizer.texts_to_sequences followed by pad_sequences (pre-padding and
+pre-truncation), given the tokenizer's word_index and num_words. Instead of
+building a Python list per comment and padding afterwards, it looks every word
+up in a single vocabulary dict and writes the ids straight into a preallocated
+int32 [num_texts, max_sequence_length] buffer. Large inputs can be split into
+chunks that are tokenized by a pool of worker processes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import string
+
+import numpy as np
+
+# Default filters of the Keras Tokenizer.
+FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+
+try:
+  _BYTES_TRANSLATION = string.maketrans(FILTERS, ' ' * len(FILTERS))
+except AttributeError:  # Python 3 strings are always unicode.
+  _BYTES_TRANSLATION = None
+_UNICODE_TRANSLATION = dict((ord(c), u' ') for c in FILTERS)
+
+# Settings of the Keras Tokenizer that SequenceTokenizer implements.
+_KERAS_DEFAULTS = [
+    ('filters', FILTERS),
+    ('lower', True),
+    ('split', ' '),
+    ('char_level', False),
+    ('oov_token', None),
+]
+
+
+def text_to_word_sequence(text):
+  """Splits text into words like the default Keras Tokenizer does."""
+  text = text.lower()
+  if _BYTES_TRANSLATION is not None and isinstance(text, str):
+    text = text.translate(_BYTES_TRANSLATION)
+  else:
+    text = text.translate(_UNICODE_TRANSLATION)
+  return [word for word in text.split(' ') if word]
+
+
+class SequenceTokenizer(object):
+  """Turns texts into pre-padded int32 sequences of word ids."""
+
+  def __init__(self, word_index, num_words, max_sequence_length):
+    """Initializes the tokenizer.
+
+    Args:
+      word_index: Dict of word to id, e.g. Keras Tokenizer.word_index.
+      num_words: Only words with ids below num_words are kept, as in the
+        Keras Tokenizer. None keeps all words.
+      max_sequence_length: Length of the output sequences.
+    """
+    if num_words:
+      word_index = dict(
+          (word, i) for word, i in word_index.items() if i < num_words)
+    self.word_index = word_index
+    self.num_words = num_words
+    self.max_sequence_length = max_sequence_length
+
+  @classmethod
+  def from_keras(cls, tokenizer, max_sequence_length):
+    """Creates a SequenceTokenizer from a fitted Keras Tokenizer.
+
+    Raises:
+      ValueError: if the tokenizer splits text differently from the default
+        Keras Tokenizer, which is the only splitting implemented here.
+    """
+    for attribute, default in _KERAS_DEFAULTS:
+      # Tokenizers pickled by older Keras versions lack newer attributes.
+      value = getattr(tokenizer, attribute, default)
+      if value != default:
+        raise ValueError('unsupported Keras Tokenizer setting {}={!r}'.format(
+            attribute, value))
+    return cls(tokenizer.word_index, tokenizer.num_words, max_sequence_length)
+
+  def _fill(self, texts, buffer):
+    """Writes the padded sequences of texts into the rows of buffer."""
+    lookup = self.word_index.get
+    max_sequence_length = self.max_sequence_length
+    for row, text in enumerate(texts):
+      text = text.lower()
+      if _BYTES_TRANSLATION is not None and isinstance(text, str):
+        text = text.translate(_BYTES_TRANSLATION)
+      else:
+        text = text.translate(_UNICODE_TRANSLATION)
+      # Empty strings from repeated separators are never in the vocabulary.
+      ids = [i for i in map(lookup, text.split(' ')) if i is not None]
+      if ids:
+        ids = ids[-max_sequence_length:]
+        buffer[row, max_sequence_length - len(ids):] = ids
+
+  def texts_to_padded(self, texts, num_workers=1, chunk_size=20000):
+    """Returns an int32 [len(texts), max_sequence_length] array of word ids.
+
+    Args:
+      texts: Sequence of text strings.
+      num_workers: Number of worker processes. 1 tokenizes in this process.
+      chunk_size: Number of texts handed to a worker at a time.
+    """
+    texts = list(texts)
+    buffer = np.zeros((len(texts), self.max_sequence_length), dtype=np.int32)
+    if num_workers <= 1 or len(texts) <= chunk_size:
+      self._fill(texts, buffer)
+      return buffer
+    pool = multiprocessing.Pool(
+        num_workers, initializer=_init_worker, initargs=(self,))
+    try:
+      starts = range(0, len(texts), chunk_size)
+      chunks = pool.imap(_tokenize_chunk,
+                         (texts[start:start + chunk_size] for start in starts))
+      for start, chunk in zip(starts, chunks):
+        buffer[start:start + len(chunk)] = chunk
+    finally:
+      pool.close()
+      pool.join()
+    return buffer
+
+
+def unique_sequences(sequences):
+  """Returns the distinct rows of padded sequences, and each row's index.
+
+  Texts that differ only in punctuation or out-of-vocabulary words have the
+  same padded sequence, so models only need to score the distinct ones. Rows
+  are compared as raw bytes, which is much faster than np.unique(axis=0).
+
+  Args:
+    sequences: [num_texts, max_sequence_length] padded sequences.
+
+  Returns:
+    (unique, inverse): unique[inverse] == sequences.
+  """
+  sequences = np.ascontiguousarray(sequences)
+  if not len(sequences):
+    return sequences, np.zeros(0, dtype=np.intp)
+  rows = sequences.view(
+      np.dtype((np.void, sequences.dtype.itemsize * sequences.shape[1])))
+  _, first, inverse = np.unique(
+      rows.ravel(), return_index=True, return_inverse=True)
+  return sequences[first], inverse
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+  global _worker_tokenizer
+  _worker_tokenizer = tokenizer
+
+
+def _tokenize_chunk(texts):
+  buffer = np.zeros((len(texts), _worker_tokenizer.max_sequence_length),
+                    dtype=np.int32)
+  _worker_tokenizer._fill(texts, buffer)  # pylint: disable=protected-access
+  return buffer
@@ -0,0 +1,69 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from keras.preprocessing.sequence import pad_sequences
+from keras.preprocessing.text import Tokenizer
+import numpy as np
+import tensorflow as tf
+import fast_tokenizer
+
+TEXTS = [
+    'You are a wonderful person!', 'i hate you, you idiot', '', '   ',
+    'Being gay is great.\tReally.\nYes', u'Je suis chrétien, très chrétien',
+    'THE, the; the-the the the the the the the the the the the the',
+    'a b c d e f g h i j k l m n o p q r s t u v w x y z',
+    "don't stop\rme now"
+]
+
+
+class FastTokenizerTest(tf.test.TestCase):
+
+  def assert_matches_keras(self, texts, num_words, max_sequence_length,
+                           **kwargs):
+    tokenizer = Tokenizer(num_words=num_words)
+    tokenizer.fit_on_texts(TEXTS)
+    expected = pad_sequences(
+        tokenizer.texts_to_sequences(texts), maxlen=max_sequence_length)
+    sequence_tokenizer = fast_tokenizer.SequenceTokenizer.from_keras(
+        tokenizer, max_sequence_length)
+    actual = sequence_tokenizer.texts_to_padded(texts, **kwargs)
+    self.assertEqual(actual.dtype, expected.dtype)
+    self.assertAllEqual(actual, expected)
+
+  def test_matches_keras(self):
+    self.assert_matches_keras(TEXTS, None, 10)
+    self.assert_matches_keras(TEXTS, 15, 10)
+    self.assert_matches_keras(TEXTS, 15, 40)
+
+  def test_multiprocess_matches_keras(self):
+    self.assert_matches_keras(TEXTS * 20, 20, 8, num_workers=3, chunk_size=7)
+
+  def test_from_keras_rejects_other_settings(self):
+    for kwargs in [{'lower': False}, {'filters': ''}, {'split': ','},
+                   {'char_level': True}, {'oov_token': 'UNK'}]:
+      tokenizer = Tokenizer(**kwargs)
+      tokenizer.fit_on_texts(TEXTS)
+      with self.assertRaises(ValueError):
+        fast_tokenizer.SequenceTokenizer.from_keras(tokenizer, 10)
+
+  def test_text_to_word_sequence(self):
+    self.assertEqual(
+        fast_tokenizer.text_to_word_sequence('Hello,  World!\tbye'),
+        ['hello', 'world', 'bye'])
+
+  def test_unique_sequences(self):
+    sequences = np.array([[0, 1, 2], [0, 0, 3], [0, 1, 2], [0, 0, 3],
+                          [4, 5, 6]], dtype=np.int32)
+    unique, inverse = fast_tokenizer.unique_sequences(sequences)
+    self.assertEqual(len(unique), 3)
+    self.assertAllEqual(unique[inverse], sequences)
+    unique, inverse = fast_tokenizer.unique_sequences(
+        np.zeros((0, 3), dtype=np.int32))
+    self.assertEqual(unique.shape, (0, 3))
+    self.assertEqual(len(inverse), 0)
+
+
+if __name__ == '__main__':
+  tf.test.main()
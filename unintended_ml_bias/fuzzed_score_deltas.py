@@ -0,0 +1,304 @@
+"""Paired analysis of model scores on fuzzed and non-fuzzed test sets.
+
+The fuzzed and non-fuzzed test sets built by identity_fuzzing contain the same
+comments (keyed by rev_id), differing only in which identity terms they use.
+Joining the scores of a model on both sets shows, per swapped identity term,
+how much the score moves when only the identity term changes.
+
+Results use the same layout as model_bias_analysis: one row per identity term
+('subgroup' column, with a first row for all pairs whose subgroup is None),
+a 'subset_size' column with the number of pairs, and one column per model and
+metric (see model_bias_analysis.column_name).
+
+For large fuzzed sets with many variants per comment, feed the fuzzed set in
+chunks:
+
+  deltas = PairedScoreDeltas(nonfuzzed, models, 'toxic')
+  for chunk in pd.read_csv(fuzzed_scored_path, chunksize=100000):
+    deltas.update(chunk)
+  results = deltas.result()
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+try:
+  import identity_fuzzing
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import identity_fuzzing
+  from unintended_ml_bias import model_bias_analysis
+
+MEAN_SCORE_DELTA = 'mean_score_delta'
+MEAN_ABS_SCORE_DELTA = 'mean_abs_score_delta'
+STD_SCORE_DELTA = 'std_score_delta'
+LABEL_FLIP_RATE = 'label_flip_rate'
+NONFUZZED_AUC = 'nonfuzzed_auc'
+FUZZED_AUC = 'fuzzed_auc'
+AUC_CHANGE = 'auc_change'
+
+DELTA_METRICS = [
+    MEAN_SCORE_DELTA, MEAN_ABS_SCORE_DELTA, STD_SCORE_DELTA, LABEL_FLIP_RATE,
+    NONFUZZED_AUC, FUZZED_AUC, AUC_CHANGE
+]
+
+# Indices into the per-term running sums.
+_COUNT, _SUM, _SUM_ABS, _SUM_SQUARES, _FLIPS = range(5)
+
+
+def swapped_terms(nonfuzzed_texts, fuzzed_texts, identity_terms):
+  """Recovers which identity terms were swapped in each fuzzed text.
+
+  For fuzzed sets that don't record their swapped terms, pairs the n-th
+  identity term found in the non-fuzzed text with the n-th one found in the
+  fuzzed text.
+
+  Returns:
+    A (original_terms, fuzzed_terms) tuple of lists of '|'-separated terms, in
+    the format of identity_fuzzing.fuzz_comments.
+  """
+  pattern = identity_fuzzing.identity_term_pattern(identity_terms)
+  all_original, all_fuzzed = [], []
+  for nonfuzzed_text, fuzzed_text in zip(nonfuzzed_texts, fuzzed_texts):
+    swaps = []
+    for original, new in zip(pattern.findall(nonfuzzed_text),
+                             pattern.findall(fuzzed_text)):
+      swap = (original.lower(), new.lower())
+      if swap[0] not in [seen for seen, _ in swaps]:
+        swaps.append(swap)
+    all_original.append(
+        identity_fuzzing.TERM_SEPARATOR.join(old for old, _ in swaps))
+    all_fuzzed.append(
+        identity_fuzzing.TERM_SEPARATOR.join(new for _, new in swaps))
+  return all_original, all_fuzzed
+
+
+def _histogram_auc(histograms):
+  """Computes AUC from [negative, positive] score histograms.
+
+  Pairs of examples that fall in the same bin count as ties.
+  """
+  negatives, positives = histograms
+  num_pairs = negatives.sum() * positives.sum()
+  if num_pairs == 0:
+    return np.nan
+  negatives_below = np.cumsum(negatives) - negatives
+  return np.sum(positives * (negatives_below + 0.5 * negatives)) / num_pairs
+
+
+class PairedScoreDeltas(object):
+  """Accumulates paired fuzzed/non-fuzzed score statistics per swapped term.
+
+  Memory use only depends on the non-fuzzed set, the number of terms and
+  num_bins, not on the size of the fuzzed set. AUCs are computed from score
+  histograms with num_bins bins, so are exact up to ties within a bin.
+  """
+
+  def __init__(self,
+               nonfuzzed,
+               models,
+               label_col,
+               threshold=0.5,
+               key_col='rev_id',
+               by=identity_fuzzing.ORIGINAL_TERMS,
+               identity_terms=None,
+               text_col='comment',
+               num_bins=1000):
+    """Initializes the accumulator.
+
+    Args:
+      nonfuzzed: Scored non-fuzzed DataFrame with key_col, label_col and one
+        score column per model. key_col may also be the index.
+      models: List of model names (score columns).
+      label_col: Column containing the boolean label.
+      threshold: Threshold above which a score counts as a positive label.
+        Either a float, or a dict of model name to float threshold.
+      key_col: Integer column joining the two sets.
+      by: Which swapped term to group by: 'original_terms' (the term present
+        in the non-fuzzed comment) or 'fuzzed_terms' (its replacement).
+      identity_terms: Identity terms, only needed if fuzzed chunks do not have
+        the swapped term columns (see swapped_terms).
+      text_col: Text column, only needed with identity_terms.
+      num_bins: Number of score histogram bins used to compute AUCs.
+    """
+    if key_col not in nonfuzzed.columns:
+      nonfuzzed = nonfuzzed.reset_index()
+    keys = nonfuzzed[key_col].values.astype(np.int64)
+    order = np.argsort(keys, kind='mergesort')
+    self._keys = keys[order]
+    if np.any(self._keys[1:] == self._keys[:-1]):
+      raise ValueError('Non-fuzzed set has duplicate {} keys'.format(key_col))
+    self._scores = nonfuzzed[models].values[order].astype(np.float64)
+    self._labels = nonfuzzed[label_col].values[order].astype(bool)
+    self._texts = (
+        nonfuzzed[text_col].values[order] if identity_terms else None)
+    self._thresholds = np.array([
+        threshold[model] if isinstance(threshold, dict) else threshold
+        for model in models
+    ])
+    self.models = list(models)
+    self.key_col = key_col
+    self.by = by
+    self.identity_terms = identity_terms
+    self._text_col = text_col
+    self.num_bins = num_bins
+    # Term (None for all pairs) to [num models, 5] running sums, and to
+    # [num models, fuzzed/non-fuzzed, negative/positive, num_bins] histograms.
+    self._sums = {}
+    self._histograms = {}
+
+  def _bins(self, scores):
+    return np.clip((scores * self.num_bins).astype(np.int64), 0,
+                   self.num_bins - 1)
+
+  def _join(self, fuzzed_chunk):
+    """Returns positions into the non-fuzzed arrays of fuzzed_chunk's rows."""
+    if self.key_col not in fuzzed_chunk.columns:
+      fuzzed_chunk = fuzzed_chunk.reset_index()
+    chunk_keys = fuzzed_chunk[self.key_col].values.astype(np.int64)
+    positions = np.searchsorted(self._keys, chunk_keys)
+    positions = np.minimum(positions, len(self._keys) - 1)
+    found = self._keys[positions] == chunk_keys
+    if not np.all(found):
+      raise ValueError('{} fuzzed {} keys are missing from the non-fuzzed set'
+                       .format(np.sum(~found), self.key_col))
+    return positions
+
+  def _chunk_terms(self, fuzzed_chunk, positions):
+    if self.by in fuzzed_chunk.columns:
+      return fuzzed_chunk[self.by].fillna('').values
+    if not self.identity_terms:
+      raise ValueError(
+          'Fuzzed chunk has no {} column; pass identity_terms to recover it.'
+          .format(self.by))
+    original, fuzzed = swapped_terms(
+        self._texts[positions], fuzzed_chunk[self._text_col].values,
+        self.identity_terms)
+    return original if self.by == identity_fuzzing.ORIGINAL_TERMS else fuzzed
+
+  def update(self, fuzzed_chunk):
+    """Adds a chunk of scored fuzzed rows to the statistics."""
+    positions = self._join(fuzzed_chunk)
+    nonfuzzed_scores = self._scores[positions]
+    fuzzed_scores = fuzzed_chunk[self.models].values.astype(np.float64)
+    labels = self._labels[positions].astype(np.int64)
+    deltas = fuzzed_scores - nonfuzzed_scores
+    flips = ((fuzzed_scores >= self._thresholds) !=
+             (nonfuzzed_scores >= self._thresholds))
+    bins = np.stack([self._bins(fuzzed_scores), self._bins(nonfuzzed_scores)])
+
+    # Explodes rows into one (row, term) pair per swapped term, plus one pair
+    # per row for the all pairs (None) group.
+    rows, terms = [np.arange(len(positions))], [[None] * len(positions)]
+    for row, joined_terms in enumerate(self._chunk_terms(fuzzed_chunk,
+                                                         positions)):
+      for term in set(joined_terms.split(identity_fuzzing.TERM_SEPARATOR)):
+        if term:
+          rows.append([row])
+          terms.append([term])
+    rows = np.concatenate(rows)
+    codes, unique_terms = pd.factorize(
+        pd.Series([term for group in terms for term in group]))
+    if np.any(codes < 0):
+      # pd.factorize marks None with -1.
+      unique_terms = list(unique_terms) + [None]
+      codes = np.where(codes < 0, len(unique_terms) - 1, codes)
+    num_terms = len(unique_terms)
+
+    for model_index in range(len(self.models)):
+      model_deltas = deltas[rows, model_index]
+      sums = np.stack([
+          np.bincount(codes, minlength=num_terms),
+          np.bincount(codes, model_deltas, num_terms),
+          np.bincount(codes, np.abs(model_deltas), num_terms),
+          np.bincount(codes, np.square(model_deltas), num_terms),
+          np.bincount(codes, flips[rows, model_index], num_terms),
+      ], axis=1)
+      histogram_codes = ((codes[:, np.newaxis] * 2 + np.arange(2)) * 2 +
+                         labels[rows][:, np.newaxis]) * self.num_bins + bins[
+                             :, rows, model_index].T
+      histograms = np.bincount(
+          histogram_codes.ravel(),
+          minlength=num_terms * 2 * 2 * self.num_bins).reshape(
+              num_terms, 2, 2, self.num_bins)
+      for term_index, term in enumerate(unique_terms):
+        if term not in self._sums:
+          self._sums[term] = np.zeros((len(self.models), 5))
+          self._histograms[term] = np.zeros(
+              (len(self.models), 2, 2, self.num_bins), dtype=np.int64)
+        self._sums[term][model_index] += sums[term_index]
+        self._histograms[term][model_index] += histograms[term_index]
+
+  def result(self):
+    """Returns the per-term results frame."""
+    records = []
+    terms = sorted(self._sums, key=lambda term: (term is not None, term))
+    for term in terms:
+      sums = self._sums[term]
+      count = sums[0, _COUNT]
+      record = {
+          model_bias_analysis.SUBGROUP: term,
+          model_bias_analysis.SUBSET_SIZE: int(count)
+      }
+      for model_index, model in enumerate(self.models):
+        model_sums = sums[model_index]
+        mean = model_sums[_SUM] / count
+        fuzzed_auc = _histogram_auc(self._histograms[term][model_index, 0])
+        nonfuzzed_auc = _histogram_auc(self._histograms[term][model_index, 1])
+        record.update({
+            model_bias_analysis.column_name(model, MEAN_SCORE_DELTA):
+                mean,
+            model_bias_analysis.column_name(model, MEAN_ABS_SCORE_DELTA):
+                model_sums[_SUM_ABS] / count,
+            model_bias_analysis.column_name(model, STD_SCORE_DELTA):
+                np.sqrt(max(model_sums[_SUM_SQUARES] / count - mean**2, 0)),
+            model_bias_analysis.column_name(model, LABEL_FLIP_RATE):
+                model_sums[_FLIPS] / count,
+            model_bias_analysis.column_name(model, NONFUZZED_AUC):
+                nonfuzzed_auc,
+            model_bias_analysis.column_name(model, FUZZED_AUC):
+                fuzzed_auc,
+            model_bias_analysis.column_name(model, AUC_CHANGE):
+                fuzzed_auc - nonfuzzed_auc,
+        })
+      records.append(record)
+    return pd.DataFrame(records)
+
+
+def paired_score_deltas(nonfuzzed,
+                        fuzzed,
+                        models,
+                        label_col,
+                        threshold=0.5,
+                        chunksize=None,
+                        **kwargs):
+  """Computes per-term paired score deltas between fuzzed and non-fuzzed sets.
+
+  Args:
+    nonfuzzed: Scored non-fuzzed DataFrame.
+    fuzzed: Scored fuzzed DataFrame, or an iterable of DataFrame chunks (e.g.
+      pd.read_csv(path, chunksize=...)).
+    models: List of model names (score columns).
+    label_col: Column containing the boolean label.
+    threshold: Threshold for label flips, a float or dict of model to float.
+    chunksize: If given, fuzzed is processed in chunks of this many rows.
+    **kwargs: Further PairedScoreDeltas arguments.
+
+  Returns:
+    DataFrame with one row per swapped term, and the DELTA_METRICS for each
+    model.
+  """
+  deltas = PairedScoreDeltas(nonfuzzed, models, label_col, threshold, **kwargs)
+  if isinstance(fuzzed, pd.DataFrame):
+    step = chunksize or max(len(fuzzed), 1)
+    chunks = (fuzzed.iloc[start:start + step]
+              for start in range(0, len(fuzzed), step))
+  else:
+    chunks = fuzzed
+  for chunk in chunks:
+    deltas.update(chunk)
+  return deltas.result()
@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import fuzzed_score_deltas
+import model_bias_analysis as mba
+
+
+class FuzzedScoreDeltasTest(tf.test.TestCase):
+
+  def make_testsets(self):
+    nonfuzzed = pd.DataFrame({
+        'rev_id': [3, 1, 2, 4],
+        'comment': ['i am gay', 'a muslim', 'hello', 'gay and muslim'],
+        'toxic': [False, True, False, True],
+        'model': [0.2, 0.7, 0.1, 0.6],
+    })
+    fuzzed = pd.DataFrame({
+        'rev_id': [1, 1, 2, 3, 3, 4],
+        'comment': ['a jew', 'a gay', 'hello', 'i am sikh', 'i am jew',
+                    'jew and sikh'],
+        'toxic': [True, True, False, False, False, True],
+        'model': [0.4, 0.8, 0.1, 0.6, 0.3, 0.5],
+        'original_terms': ['muslim', 'muslim', '', 'gay', 'gay',
+                           'gay|muslim'],
+    })
+    return nonfuzzed, fuzzed
+
+  def test_paired_score_deltas(self):
+    nonfuzzed, fuzzed = self.make_testsets()
+    results = fuzzed_score_deltas.paired_score_deltas(
+        nonfuzzed, fuzzed, ['model'], 'toxic').set_index(mba.SUBGROUP)
+    self.assertEqual(results.loc['gay', mba.SUBSET_SIZE], 3)
+    self.assertAlmostEqual(results.loc['gay', 'model_mean_score_delta'],
+                           (0.4 + 0.1 - 0.1) / 3)
+    self.assertAlmostEqual(results.loc['gay', 'model_label_flip_rate'], 1 / 3)
+    self.assertAlmostEqual(results.loc['muslim', 'model_mean_score_delta'],
+                           (-0.3 + 0.1 - 0.1) / 3)
+    self.assertEqual(results[mba.SUBSET_SIZE].iloc[0], 6)
+    self.assertAlmostEqual(results['model_nonfuzzed_auc'].iloc[0], 1.0)
+    self.assertAlmostEqual(
+        results['model_fuzzed_auc'].iloc[0],
+        mba.compute_auc(fuzzed['toxic'], fuzzed['model']))
+
+  def test_chunked_matches_unchunked(self):
+    nonfuzzed, fuzzed = self.make_testsets()
+    whole = fuzzed_score_deltas.paired_score_deltas(
+        nonfuzzed, fuzzed, ['model'], 'toxic')
+    chunked = fuzzed_score_deltas.paired_score_deltas(
+        nonfuzzed, fuzzed, ['model'], 'toxic', chunksize=4)
+    pd.util.testing.assert_frame_equal(whole, chunked)
+
+  def test_swapped_terms(self):
+    original, fuzzed = fuzzed_score_deltas.swapped_terms(
+        ['Gay and muslim, gay'], ['jew and sikh, jew'], ['gay', 'muslim',
+                                                         'jew', 'sikh'])
+    self.assertEqual(original, ['gay|muslim'])
+    self.assertEqual(fuzzed, ['jew|sikh'])
+
+  def test_missing_key_raises(self):
+    nonfuzzed, fuzzed = self.make_testsets()
+    fuzzed.loc[0, 'rev_id'] = 99
+    with self.assertRaises(ValueError):
+      fuzzed_score_deltas.paired_score_deltas(nonfuzzed, fuzzed, ['model'],
+                                              'toxic')
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,408 @@
+"""Hyperparameter sweeps of ToxModels, with shared preprocessing.
+
+Tuning DEFAULT_HPARAMS by calling ToxModel.train once per configuration fits
+the tokenizer, tokenizes and pads the data and loads the embeddings again for
+every trial, although they only depend on a few hparams:
+
+  - The tokenizer's word index doesn't depend on any hparam, so it is fitted
+    once per sweep.
+  - Tokenized shards (see training_pipeline) depend on max_num_words and
+    max_sequence_length, and are cached under <sweep_dir>/shards.
+  - Embedding matrices depend on embedding_dim, the embeddings file and the
+    tokenizer's word index, and are cached under <sweep_dir>/embeddings.
+
+run_sweep prepares these inputs once per distinct value, then trains the
+trials in parallel worker processes, like model_family_training. Trials are
+stopped early by the median stopping rule: after grace_epochs, a trial stops
+when its best validation loss is worse than the median of the other trials'
+best validation losses at the same epoch.
+
+Each trained trial is scored on a madlibs eval set, and
+<sweep_dir>/results.csv gets a row per trial with its hparams, its validation
+loss, its madlibs AUC and summaries of its per-subgroup bias metrics. The
+per-subgroup metrics of each trial are written to <trial>_bias.csv.
+
+Example usage:
+
+  madlibs = pd.read_csv('eval_datasets/bias_madlibs_77k.csv')
+  model_tool.postprocess_madlibs(madlibs)
+  terms = model_bias_analysis.read_identity_terms('bias_madlibs_data/...')
+  results = run_sweep('cnn_sweep',
+                      grid(max_sequence_length=[100, 250],
+                           dropout_rate=[0.2, 0.3]),
+                      'wiki_train.csv', 'wiki_dev.csv', 'comment', 'is_toxic',
+                      '../models/cnn_sweep', madlibs, terms)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+  import model_bias_analysis
+  import model_tool
+  import training_pipeline
+except ImportError:
+  from unintended_ml_bias import model_bias_analysis
+  from unintended_ml_bias import model_tool
+  from unintended_ml_bias import training_pipeline
+
+TRIAL = 'trial'
+EPOCHS = 'epochs'
+BEST_VAL_LOSS = 'best_val_loss'
+STOPPED_EARLY = 'stopped_early'
+MADLIBS_AUC = 'madlibs_auc'
+
+_RESULTS_FILE = 'results.csv'
+
+
+def grid(**values):
+  """Returns the list of hparams dicts of every combination of values.
+
+  For example, grid(dropout_rate=[0.2, 0.3], max_num_words=[10000]) returns
+  [{'dropout_rate': 0.2, 'max_num_words': 10000},
+   {'dropout_rate': 0.3, 'max_num_words': 10000}].
+  """
+  names = sorted(values)
+  return [
+      dict(zip(names, combination))
+      for combination in itertools.product(*[values[name] for name in names])
+  ]
+
+
+def trial_name(sweep_name, index):
+  return '{}_{:03d}'.format(sweep_name, index)
+
+
+def _history_path(sweep_dir, name):
+  return os.path.join(sweep_dir, '%s_history.json' % name)
+
+
+def _write_history(sweep_dir, name, val_losses, stopped):
+  path = _history_path(sweep_dir, name)
+  with open(path + '.tmp', 'w') as f:
+    json.dump({'val_losses': val_losses, 'stopped': stopped}, f)
+  os.rename(path + '.tmp', path)
+
+
+def _read_histories(sweep_dir, sweep_name, exclude):
+  """Returns the validation losses of every trial of the sweep but one."""
+  # Other sweeps may share sweep_dir, so only this sweep's trials are read.
+  pattern = re.compile(re.escape(sweep_name) + r'_\d+_history\.json$')
+  histories = []
+  for file_name in os.listdir(sweep_dir):
+    if (pattern.match(file_name) and
+        file_name != os.path.basename(_history_path(sweep_dir, exclude))):
+      with open(os.path.join(sweep_dir, file_name)) as f:
+        histories.append(json.load(f)['val_losses'])
+  return histories
+
+
+def should_stop(val_losses, other_histories, grace_epochs=1):
+  """Median stopping rule.
+
+  Args:
+    val_losses: Validation loss of a trial after each epoch so far.
+    other_histories: Validation losses of the other trials after each epoch.
+    grace_epochs: Number of epochs a trial always trains for.
+
+  Returns:
+    Whether the trial's best loss so far is worse than the median of the best
+    losses of the other trials that trained for at least as many epochs.
+  """
+  epochs = len(val_losses)
+  if epochs < max(grace_epochs, 1):
+    return False
+  others = [min(history[:epochs]) for history in other_histories
+            if len(history) >= epochs]
+  if not others:
+    return False
+  return min(val_losses) > np.median(others)
+
+
+def _median_stopping_callback(sweep_dir, sweep_name, name, grace_epochs):
+  """Returns a Keras callback applying should_stop after every epoch."""
+  from keras.callbacks import Callback
+
+  class MedianStopping(Callback):
+
+    def __init__(self):
+      super(MedianStopping, self).__init__()
+      self.val_losses = []
+      self.stopped = False
+
+    def on_epoch_end(self, epoch, logs=None):
+      self.val_losses.append(float((logs or {})['val_loss']))
+      if should_stop(self.val_losses,
+                     _read_histories(sweep_dir, sweep_name, name),
+                     grace_epochs):
+        print('{}: stopping, worse than the median trial'.format(name))
+        self.stopped = True
+        self.model.stop_training = True
+      _write_history(sweep_dir, name, self.val_losses, self.stopped)
+
+  return MedianStopping()
+
+
+def _fit_tokenizer(training_data_path, text_column):
+  """Fits a Keras Tokenizer without a num_words limit."""
+  from keras.preprocessing.text import Tokenizer
+  tokenizer = Tokenizer()
+  tokenizer.fit_on_texts(
+      training_pipeline.iter_csv_texts(training_data_path, text_column))
+  return tokenizer
+
+
+def _trial_tokenizer(tokenizer, max_num_words):
+  """Returns a copy of the sweep's tokenizer limited to max_num_words."""
+  trial_tokenizer = copy.copy(tokenizer)
+  trial_tokenizer.num_words = max_num_words
+  return trial_tokenizer
+
+
+def _embeddings_key(embeddings_path, tokenizer, dim):
+  """Returns a hash of the inputs of an embedding matrix.
+
+  Like training_pipeline's shard cache keys, it covers the embeddings file and
+  the tokenizer's word index, which gives the row of each word.
+  """
+  stat = os.stat(embeddings_path)
+  key = {
+      'embeddings_path': os.path.abspath(embeddings_path),
+      'embeddings_size': stat.st_size,
+      'embeddings_mtime': stat.st_mtime,
+      'embedding_dim': dim,
+      'word_index': sorted(tokenizer.word_index.items()),
+  }
+  return hashlib.md5(json.dumps(key, sort_keys=True).encode(
+      'utf-8')).hexdigest()
+
+
+def _prepare_inputs(sweep_dir, trials_hparams, tokenizer, training_data_path,
+                    validation_data_path, text_column, label_column,
+                    embeddings_path, num_workers):
+  """Builds the shards and embedding matrices of every trial, once each.
+
+  Returns:
+    List of (shard_dirs, embedding_path) per trial.
+  """
+  shards = {}
+  embeddings = {}
+  inputs = []
+  for hparams in trials_hparams:
+    shard_key = (hparams['max_num_words'], hparams['max_sequence_length'])
+    if shard_key not in shards:
+      model = model_tool.ToxModel(model_dir=sweep_dir, hparams=hparams)
+      model.tokenizer = _trial_tokenizer(tokenizer, hparams['max_num_words'])
+      shards[shard_key] = model.prepare_shards(
+          training_data_path,
+          validation_data_path,
+          text_column,
+          label_column,
+          os.path.join(sweep_dir, 'shards',
+                       'words_%d_length_%d' % shard_key),
+          num_workers=num_workers)
+    dim = hparams['embedding_dim']
+    if dim not in embeddings:
+      dim_embeddings_path = (
+          embeddings_path[dim]
+          if isinstance(embeddings_path, dict) else embeddings_path)
+      path = os.path.join(
+          sweep_dir, 'embeddings', 'dim_%d_%s.npy' % (dim, _embeddings_key(
+              dim_embeddings_path, tokenizer, dim)))
+      if not os.path.exists(path):
+        model = model_tool.ToxModel(
+            model_dir=sweep_dir,
+            embeddings_path=dim_embeddings_path,
+            hparams=hparams)
+        model.tokenizer = tokenizer
+        model.load_embeddings()
+        if not os.path.exists(os.path.dirname(path)):
+          os.makedirs(os.path.dirname(path))
+        np.save(path, model.embedding_matrix)
+      embeddings[dim] = path
+    inputs.append((shards[shard_key], embeddings[dim]))
+  return inputs
+
+
+def _bias_summary(bias_metrics, model_name):
+  """Summarizes a trial's per-subgroup bias metrics in a few numbers."""
+  summary = {}
+  for metric in model_bias_analysis.METRICS:
+    values = bias_metrics[model_bias_analysis.column_name(
+        model_name, metric)].astype(float)
+    if metric in model_bias_analysis.AEGS:
+      summary['mean_abs_' + metric] = values.abs().mean()
+    else:
+      summary['mean_' + metric] = values.mean()
+      summary['min_' + metric] = values.min()
+  return summary
+
+
+def _run_trial(args):
+  """Trains and evaluates one trial. Runs in its own worker process."""
+  (sweep_name, name, sweep_dir, hparams, tokenizer, shard_dirs,
+   embedding_path, madlibs, madlibs_text_col, madlibs_label_col, subgroups,
+   grace_epochs, seed, threads_per_process) = args
+  # Set before TensorFlow is first imported, which happens in this process,
+  # so that its MKL/OpenMP thread pools are bounded too.
+  for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS']:
+    os.environ[variable] = str(threads_per_process)
+  import keras.backend as K  # pylint: disable=g-import-not-at-top
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+  K.set_session(
+      tf.Session(
+          config=tf.ConfigProto(
+              intra_op_parallelism_threads=threads_per_process,
+              inter_op_parallelism_threads=threads_per_process)))
+  random.seed(seed)
+  np.random.seed(seed)
+  tf.set_random_seed(seed)
+
+  model = model_tool.ToxModel(model_dir=sweep_dir, hparams=hparams)
+  model.model_name = name
+  model.save_hparams(name)
+  model.tokenizer = _trial_tokenizer(tokenizer, hparams['max_num_words'])
+  model.save_tokenizer()
+  model.embedding_matrix = np.load(embedding_path, mmap_mode='r')
+  model.build_model()
+  stopping = _median_stopping_callback(sweep_dir, sweep_name, name,
+                                       grace_epochs)
+  model.fit_shards(shard_dirs, seed=seed, extra_callbacks=[stopping])
+
+  record = {
+      TRIAL: name,
+      EPOCHS: len(stopping.val_losses),
+      BEST_VAL_LOSS: min(stopping.val_losses) if stopping.val_losses else None,
+      STOPPED_EARLY: stopping.stopped,
+  }
+  if madlibs is not None:
+    madlibs = madlibs.copy()
+    madlibs[name] = model.predict(madlibs[madlibs_text_col])
+    record[MADLIBS_AUC] = model_tool.compute_auc(madlibs[madlibs_label_col],
+                                                 madlibs[name])
+    bias_metrics = model_bias_analysis.compute_bias_metrics_for_model(
+        madlibs, subgroups, name, madlibs_label_col)
+    bias_metrics.to_csv(
+        os.path.join(sweep_dir, '%s_bias.csv' % name), index=False)
+    record.update(_bias_summary(bias_metrics, name))
+  return record
+
+
+def run_sweep(sweep_name,
+              trials,
+              training_data_path,
+              validation_data_path,
+              text_column,
+              label_column,
+              sweep_dir,
+              madlibs=None,
+              subgroups=None,
+              madlibs_text_col='text',
+              madlibs_label_col='label',
+              embeddings_path=model_tool.DEFAULT_EMBEDDINGS_PATH,
+              base_hparams=None,
+              grace_epochs=1,
+              seed=0,
+              num_processes=None,
+              threads_per_process=None):
+  """Trains and evaluates a ToxModel per trial hparams.
+
+  Args:
+    sweep_name: Prefix of the trial model names, '<sweep_name>_<index>'.
+    trials: List of hparams dicts, one per trial, e.g. from grid.
+    training_data_path: CSV of training data.
+    validation_data_path: CSV of validation data.
+    text_column: Column containing the text.
+    label_column: Column containing the boolean label.
+    sweep_dir: Directory for the trial models, caches and results.
+    madlibs: Optional DataFrame of madlibs examples to compute bias metrics on,
+      e.g. postprocessed by model_tool.postprocess_madlibs.
+    subgroups: Boolean subgroup columns of madlibs. Terms that aren't columns
+      of madlibs are added with add_subgroup_columns_from_text.
+    madlibs_text_col: Text column of madlibs.
+    madlibs_label_col: Boolean label column of madlibs.
+    embeddings_path: Word embeddings file, or dict of embedding_dim to
+      embeddings file when embedding_dim is swept.
+    base_hparams: Hyperparameters overriding model_tool.DEFAULT_HPARAMS in
+      every trial.
+    grace_epochs: Epochs every trial trains for before median stopping.
+    seed: Random seed of every trial.
+    num_processes: Number of trials trained at once. Defaults to the number of
+      CPUs, up to the number of trials.
+    threads_per_process: TensorFlow threads per process. Defaults to splitting
+      the CPUs evenly across processes.
+
+  Returns:
+    DataFrame of results, also written to <sweep_dir>/results.csv.
+  """
+  if not os.path.exists(sweep_dir):
+    os.makedirs(sweep_dir)
+  num_processes = num_processes or min(multiprocessing.cpu_count(),
+                                       len(trials))
+  threads_per_process = threads_per_process or max(
+      1, multiprocessing.cpu_count() // num_processes)
+  trials_hparams = []
+  for trial in trials:
+    hparams = model_tool.DEFAULT_HPARAMS.copy()
+    hparams.update(base_hparams or {})
+    hparams.update(trial)
+    trials_hparams.append(hparams)
+  if madlibs is not None:
+    madlibs = madlibs.copy()
+    missing = [s for s in subgroups if s not in madlibs.columns]
+    model_bias_analysis.add_subgroup_columns_from_text(
+        madlibs, madlibs_text_col, missing)
+
+  print('Fitting tokenizer...')
+  tokenizer = _fit_tokenizer(training_data_path, text_column)
+  print('Preparing data and embeddings...')
+  inputs = _prepare_inputs(sweep_dir, trials_hparams, tokenizer,
+                           training_data_path, validation_data_path,
+                           text_column, label_column, embeddings_path,
+                           num_processes)
+
+  print('Training {} trials in {} processes with {} threads each...'.format(
+      len(trials), num_processes, threads_per_process))
+  names = [trial_name(sweep_name, i) for i in range(len(trials))]
+  for name in names:
+    if os.path.exists(_history_path(sweep_dir, name)):
+      os.remove(_history_path(sweep_dir, name))
+  tasks = [(sweep_name, name, sweep_dir, hparams, tokenizer, shard_dirs,
+            embedding_path, madlibs, madlibs_text_col, madlibs_label_col,
+            subgroups, grace_epochs, seed, threads_per_process)
+           for name, hparams, (shard_dirs, embedding_path) in zip(
+               names, trials_hparams, inputs)]
+  # A fresh process per trial, so that no TensorFlow state is shared.
+  pool = multiprocessing.Pool(num_processes, maxtasksperchild=1)
+  try:
+    records = pool.map(_run_trial, tasks, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+  swept = sorted(set(name for trial in trials for name in trial))
+  for record, trial in zip(records, trials):
+    for hparam in swept:
+      value = trial.get(hparam)
+      record[hparam] = json.dumps(value) if isinstance(value,
+                                                       (list, tuple)) else value
+  results = pd.DataFrame(records)
+  results = results[[TRIAL] + swept +
+                    [c for c in results.columns if c not in swept + [TRIAL]]]
+  results.to_csv(os.path.join(sweep_dir, _RESULTS_FILE), index=False)
+  print('Sweep results saved to {}'.format(
+      os.path.join(sweep_dir, _RESULTS_FILE)))
+  return results
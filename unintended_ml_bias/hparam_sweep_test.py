@@ -0,0 +1,138 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import os
+import shutil
+import tempfile
+
+import keras.backend as K
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import hparam_sweep
+import model_bias_analysis as mba
+
+HPARAMS = {
+    'max_sequence_length': 8,
+    'max_num_words': 20,
+    'embedding_dim': 4,
+    'cnn_filter_sizes': [4],
+    'cnn_kernel_sizes': [3],
+    'cnn_pooling_sizes': [2],
+    'epochs': 2,
+    'batch_size': 8,
+    'verbose': False,
+}
+
+
+class HparamSweepTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.sweep_dir = tempfile.mkdtemp()
+    rng = np.random.RandomState(0)
+    words = ['you', 'are', 'nice', 'idiot', 'gay', 'tall', 'hate', 'love']
+    for split, size in [('train', 64), ('valid', 16)]:
+      texts = [' '.join(rng.choice(words, 4)) for _ in range(size)]
+      pd.DataFrame({
+          'comment': texts,
+          'is_toxic': ['idiot' in text or 'hate' in text for text in texts],
+      }).to_csv(os.path.join(self.sweep_dir, '%s.csv' % split), index=False)
+    self.embeddings_path = os.path.join(self.sweep_dir, 'embeddings.txt')
+    with open(self.embeddings_path, 'w') as f:
+      for word in words:
+        f.write(' '.join([word] + ['%.2f' % v for v in rng.randn(4)]) + '\n')
+
+  def tearDown(self):
+    shutil.rmtree(self.sweep_dir)
+    # _run_trial replaces the Keras session, which later tests must not use.
+    K.clear_session()
+
+  def test_grid(self):
+    self.assertEqual(
+        hparam_sweep.grid(dropout_rate=[0.2, 0.3], max_num_words=[100]), [{
+            'dropout_rate': 0.2,
+            'max_num_words': 100
+        }, {
+            'dropout_rate': 0.3,
+            'max_num_words': 100
+        }])
+
+  def test_should_stop(self):
+    others = [[0.5, 0.4, 0.3], [0.6, 0.5], [0.9]]
+    self.assertFalse(hparam_sweep.should_stop([1.0], others, grace_epochs=2))
+    self.assertTrue(hparam_sweep.should_stop([1.0, 0.9], others))
+    self.assertFalse(hparam_sweep.should_stop([0.5, 0.45], others))
+    self.assertFalse(hparam_sweep.should_stop([1.0, 0.9, 0.8], []))
+
+  def test_read_histories_of_sweep(self):
+    hparam_sweep._write_history(self.sweep_dir, 'cnn_000', [0.5], False)
+    hparam_sweep._write_history(self.sweep_dir, 'cnn_001', [0.6], False)
+    hparam_sweep._write_history(self.sweep_dir, 'cnn_x_000', [0.7], False)
+    hparam_sweep._write_history(self.sweep_dir, 'rnn_000', [0.8], False)
+    self.assertEqual(
+        hparam_sweep._read_histories(self.sweep_dir, 'cnn', 'cnn_001'),
+        [[0.5]])
+
+  def test_embeddings_cache_depends_on_inputs(self):
+    train_path = os.path.join(self.sweep_dir, 'train.csv')
+    valid_path = os.path.join(self.sweep_dir, 'valid.csv')
+    tokenizer = hparam_sweep._fit_tokenizer(train_path, 'comment')
+    embedding_path = hparam_sweep._prepare_inputs(
+        self.sweep_dir, [HPARAMS], tokenizer, train_path, valid_path,
+        'comment', 'is_toxic', self.embeddings_path, 1)[0][1]
+    other_tokenizer = copy.copy(tokenizer)
+    other_tokenizer.word_index = dict(
+        (word, len(tokenizer.word_index) + 1 - i)
+        for word, i in tokenizer.word_index.items())
+    other_embedding_path = hparam_sweep._prepare_inputs(
+        self.sweep_dir, [HPARAMS], other_tokenizer, train_path, valid_path,
+        'comment', 'is_toxic', self.embeddings_path, 1)[0][1]
+    self.assertNotEqual(embedding_path, other_embedding_path)
+    matrix = np.load(embedding_path)
+    other_matrix = np.load(other_embedding_path)
+    for word, i in tokenizer.word_index.items():
+      self.assertAllEqual(matrix[i],
+                          other_matrix[other_tokenizer.word_index[word]])
+
+  def test_prepare_and_run_trial(self):
+    trials = [
+        dict(HPARAMS, dropout_rate=0.1),
+        dict(HPARAMS, dropout_rate=0.2),
+        dict(HPARAMS, max_sequence_length=6),
+    ]
+    tokenizer = hparam_sweep._fit_tokenizer(
+        os.path.join(self.sweep_dir, 'train.csv'), 'comment')
+    inputs = hparam_sweep._prepare_inputs(
+        self.sweep_dir, trials, tokenizer,
+        os.path.join(self.sweep_dir, 'train.csv'),
+        os.path.join(self.sweep_dir, 'valid.csv'), 'comment', 'is_toxic',
+        self.embeddings_path, 1)
+    # Trials differing only in dropout share their shards.
+    self.assertEqual(inputs[0], inputs[1])
+    self.assertNotEqual(inputs[0][0], inputs[2][0])
+    self.assertEqual(inputs[0][1], inputs[2][1])
+    self.assertEqual(len(os.listdir(os.path.join(self.sweep_dir, 'shards'))),
+                     2)
+
+    madlibs = pd.DataFrame({
+        'text': ['you are gay', 'gay idiot', 'you are tall', 'tall idiot'],
+        'label': [False, True, False, True],
+    })
+    mba.add_subgroup_columns_from_text(madlibs, 'text', ['gay', 'tall'])
+    shard_dirs, embedding_path = inputs[0]
+    record = hparam_sweep._run_trial(
+        ('trial', 'trial_000', self.sweep_dir, trials[0], tokenizer, shard_dirs,
+         embedding_path, madlibs, 'text', 'label', ['gay', 'tall'], 1, 0, 1))
+    self.assertEqual(record[hparam_sweep.TRIAL], 'trial_000')
+    self.assertEqual(record[hparam_sweep.EPOCHS], 2)
+    self.assertFalse(record[hparam_sweep.STOPPED_EARLY])
+    self.assertIn('mean_subgroup_auc', record)
+    self.assertIn('mean_abs_negative_aeg', record)
+    self.assertTrue(
+        os.path.exists(os.path.join(self.sweep_dir, 'trial_000_bias.csv')))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,221 @@
+"""Builds test sets "fuzzed" over a set of identity terms.
+
+Fuzzing replaces every identity term in a comment with a randomly chosen
+identity term. For the most part, the specific identity term used should not be
+what determines whether a comment is toxic, so a model that is not biased
+should give the fuzzed and non-fuzzed versions of a comment similar scores.
+
+All identity terms in a comment are found with one pass of a single combined
+regex (built as a trie over the terms) and are swapped in one rewrite, so a
+term that was inserted by a replacement is never replaced again.
+
+Example usage:
+
+  testsets = build_fuzzed_testset(test_comments, num_variants=5, num_workers=8)
+  testsets['fuzzed'].to_csv('toxicity_fuzzed_testset.csv')
+  testsets['nonfuzzed'].to_csv('toxicity_nonfuzzed_testset.csv')
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import random
+import re
+
+import pandas as pd
+
+DEFAULT_IDENTITY_TERMS = [
+    'christian', 'catholic', 'protestant', 'muslim', 'sikh', 'jewish', 'jew',
+    'lesbian', 'gay', 'transgender', 'queer', 'homosexual', 'heterosexual'
+]
+
+# Separator used to store the list of swapped terms of a comment in one cell.
+TERM_SEPARATOR = '|'
+
+ROW = 'row'
+VARIANT = 'variant'
+ORIGINAL_TERMS = 'original_terms'
+FUZZED_TERMS = 'fuzzed_terms'
+
+
+def _trie_pattern(terms):
+  """Returns a regex alternation over terms, factored as a prefix trie.
+
+  e.g. ['jew', 'jewish', 'gay'] becomes 'gay|jew(?:ish)?'. Factoring the
+  common prefixes means the regex engine never re-tries the same prefix for
+  each term that shares it, which matters for long term lists.
+  """
+  trie = {}
+  for term in terms:
+    node = trie
+    for char in term:
+      node = node.setdefault(char, {})
+    node[''] = True
+
+  def to_pattern(node):
+    is_terminal = '' in node
+    branches = [
+        re.escape(char) + to_pattern(child)
+        for char, child in sorted(node.items())
+        if char
+    ]
+    if not branches:
+      return ''
+    if len(branches) == 1 and not is_terminal:
+      return branches[0]
+    pattern = u'(?:{})'.format(u'|'.join(branches))
+    if is_terminal:
+      pattern += '?'
+    return pattern
+
+  return to_pattern(trie)
+
+
+def identity_term_pattern(identity_terms):
+  """Returns a compiled regex matching any identity term on word boundaries."""
+  terms = sorted(set(term.lower() for term in identity_terms))
+  return re.compile(u'\\b{}\\b'.format(_trie_pattern(terms)),
+                    flags=re.UNICODE | re.IGNORECASE)
+
+
+def fuzz_comment(text, identity_terms, rng=random, pattern=None):
+  """Replaces each identity term in text with a random identity term.
+
+  Every occurrence of the same term (ignoring case) gets the same replacement.
+
+  Args:
+    text: Comment text to fuzz.
+    identity_terms: List of identity terms to find and to draw replacements
+      from.
+    rng: Source of randomness, e.g. a random.Random instance.
+    pattern: Optional precompiled identity_term_pattern(identity_terms).
+
+  Returns:
+    A (fuzzed_text, swaps) tuple, where swaps is a list of
+    (original_term, replacement_term) pairs in order of first appearance.
+  """
+  if pattern is None:
+    pattern = identity_term_pattern(identity_terms)
+  replacements = {}
+  swaps = []
+
+  def replace(match):
+    term = match.group(0).lower()
+    if term not in replacements:
+      replacements[term] = rng.choice(identity_terms)
+      swaps.append((term, replacements[term]))
+    return replacements[term]
+
+  return pattern.sub(replace, text), swaps
+
+
+# Per-process compiled pattern, so that pool workers only compile it once.
+_worker_pattern_cache = {}
+
+
+def _fuzz_chunk(args):
+  """Fuzzes one chunk of comments. Runs in a pool worker."""
+  start, texts, identity_terms, num_variants, seed = args
+  key = tuple(identity_terms)
+  if key not in _worker_pattern_cache:
+    _worker_pattern_cache[key] = identity_term_pattern(identity_terms)
+  pattern = _worker_pattern_cache[key]
+  # Seeding by chunk start makes the output independent of the number of
+  # workers and of the order in which chunks finish.
+  rng = random.Random('{}-{}'.format(seed, start))
+  records = []
+  for offset, text in enumerate(texts):
+    if not pattern.search(text):
+      continue
+    for variant in range(num_variants):
+      fuzzed, swaps = fuzz_comment(text, identity_terms, rng, pattern)
+      records.append((start + offset, variant, fuzzed,
+                      TERM_SEPARATOR.join(original for original, _ in swaps),
+                      TERM_SEPARATOR.join(new for _, new in swaps)))
+  return records
+
+
+def fuzz_comments(texts,
+                  identity_terms=DEFAULT_IDENTITY_TERMS,
+                  num_variants=1,
+                  seed=0,
+                  num_workers=1,
+                  chunk_size=10000):
+  """Fuzzes every comment that contains an identity term.
+
+  Args:
+    texts: Sequence of comment texts.
+    identity_terms: List of identity terms.
+    num_variants: Number of independently fuzzed variants to emit per comment.
+    seed: Random seed. The output only depends on seed and chunk_size.
+    num_workers: Number of worker processes. 1 fuzzes in this process.
+    chunk_size: Number of comments handed to a worker at a time.
+
+  Returns:
+    DataFrame with one row per fuzzed variant, with columns 'row' (position of
+    the comment in texts), 'variant', 'comment' (the fuzzed text),
+    'original_terms' and 'fuzzed_terms' (the swapped terms, '|'-separated).
+  """
+  texts = list(texts)
+  identity_terms = list(identity_terms)
+  chunks = [(start, texts[start:start + chunk_size], identity_terms,
+             num_variants, seed) for start in range(0, len(texts), chunk_size)]
+  if num_workers > 1:
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      chunk_records = pool.map(_fuzz_chunk, chunks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    chunk_records = [_fuzz_chunk(chunk) for chunk in chunks]
+  return pd.DataFrame(
+      [record for records in chunk_records for record in records],
+      columns=[ROW, VARIANT, 'comment', ORIGINAL_TERMS, FUZZED_TERMS])
+
+
+def build_fuzzed_testset(comments,
+                         identity_terms=DEFAULT_IDENTITY_TERMS,
+                         text_col='comment',
+                         num_variants=1,
+                         seed=0,
+                         num_workers=1,
+                         chunk_size=10000):
+  """Builds a test set 'fuzzed' over the given identity terms.
+
+  Returns both a fuzzed and non-fuzzed test set. Each are comprised of the
+  same comments: those that contain an identity term, plus an equally sized
+  random sample of the comments that don't. The fuzzed version contains
+  num_variants fuzzed copies of each identity comment (numbered in the
+  'variant' column), whereas the non-fuzzed comments have not been modified.
+  The fuzzed set also records the swapped terms of each comment in the
+  'original_terms' and 'fuzzed_terms' columns. Both sets keep the index of
+  comments (e.g. rev_id).
+
+  We also sample comments without identity terms because the absolute score
+  ranges are important: AUC can still be high even if all identity term
+  comments have elevated scores relative to other comments.
+  """
+  fuzzed = fuzz_comments(comments[text_col], identity_terms, num_variants,
+                         seed, num_workers, chunk_size)
+  identity_rows = fuzzed[ROW].unique()
+  identity_comments = comments.iloc[identity_rows]
+  non_identity_comments = comments.drop(identity_comments.index).sample(
+      len(identity_comments), random_state=seed)
+
+  fuzzed_identity_comments = comments.iloc[fuzzed[ROW].values].copy()
+  fuzzed_identity_comments[text_col] = fuzzed['comment'].values
+  for column in [VARIANT, ORIGINAL_TERMS, FUZZED_TERMS]:
+    fuzzed_identity_comments[column] = fuzzed[column].values
+  non_identity_fuzzed = non_identity_comments.copy()
+  non_identity_fuzzed[VARIANT] = 0
+  non_identity_fuzzed[ORIGINAL_TERMS] = ''
+  non_identity_fuzzed[FUZZED_TERMS] = ''
+
+  nonfuzzed_testset = pd.concat([identity_comments,
+                                 non_identity_comments]).sort_index()
+  fuzzed_testset = pd.concat([fuzzed_identity_comments,
+                              non_identity_fuzzed]).sort_index(kind='mergesort')
+  return {'fuzzed': fuzzed_testset, 'nonfuzzed': nonfuzzed_testset}
@@ -0,0 +1,62 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+
+import pandas as pd
+import tensorflow as tf
+import identity_fuzzing
+
+
+class IdentityFuzzingTest(tf.test.TestCase):
+
+  def test_identity_term_pattern(self):
+    pattern = identity_fuzzing.identity_term_pattern(
+        [u'jew', u'jewish', u'gay', u'chrétien'])
+    self.assertEqual(
+        [m.group(0) for m in pattern.finditer(
+            u'A Jewish jew, a gay man, jewishness, gayety, chrétien')],
+        [u'Jewish', u'jew', u'gay', u'chrétien'])
+
+  def test_fuzz_comment_replaces_all_terms_once(self):
+    terms = ['gay', 'homosexual']
+    # A replacement that maps gay -> homosexual must not itself be replaced.
+    text, swaps = identity_fuzzing.fuzz_comment(
+        'Gay is a term for a homosexual person, gay or not', terms,
+        random.Random(3))
+    self.assertEqual([original for original, _ in swaps],
+                     ['gay', 'homosexual'])
+    expected = '{0} is a term for a {1} person, {0} or not'.format(
+        swaps[0][1], swaps[1][1])
+    self.assertEqual(text, expected)
+
+  def test_fuzz_comments_is_deterministic_across_workers(self):
+    texts = ['i am gay', 'nothing here', 'a muslim and a jew'] * 10
+    serial = identity_fuzzing.fuzz_comments(
+        texts, num_variants=3, seed=7, chunk_size=4)
+    parallel = identity_fuzzing.fuzz_comments(
+        texts, num_variants=3, seed=7, num_workers=2, chunk_size=4)
+    pd.util.testing.assert_frame_equal(serial, parallel)
+    self.assertEqual(len(serial), 20 * 3)
+    self.assertNotIn(1, serial['row'].values)
+
+  def test_build_fuzzed_testset(self):
+    comments = pd.DataFrame(
+        {'comment': ['i am gay', 'hello', 'a sikh', 'bye', 'hi'],
+         'toxic': [False] * 5},
+        index=[10, 11, 12, 13, 14])
+    testsets = identity_fuzzing.build_fuzzed_testset(
+        comments, num_variants=2, seed=1)
+    self.assertEqual(len(testsets['nonfuzzed']), 4)
+    self.assertEqual(len(testsets['fuzzed']), 6)
+    self.assertEqual(set(testsets['fuzzed'].index),
+                     set(testsets['nonfuzzed'].index))
+    fuzzed_gay = testsets['fuzzed'].loc[10]
+    self.assertEqual(list(fuzzed_gay['variant']), [0, 1])
+    self.assertEqual(list(fuzzed_gay['original_terms']), ['gay', 'gay'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,87 @@
+"""Guards against regressions in the import time of the analysis modules.
+
+Each module is imported in a fresh interpreter, which reports how long the
+import took and which heavy dependencies it pulled in. Run this file directly
+to print the import times as a benchmark.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+
+import tensorflow as tf
+
+# pandas itself imports the matplotlib core when it is installed, so only
+# pyplot counts as a heavy matplotlib import.
+HEAVY_MODULES = [
+    'keras', 'matplotlib.pyplot', 'scipy.stats', 'seaborn', 'sklearn',
+    'tensorflow'
+]
+
+LIGHTWEIGHT_MODULES = [
+    'model_bias_analysis', 'model_tool', 'fast_tokenizer', 'numpy_model'
+]
+
+# Generous bound on the import time of a lightweight module. NumPy and pandas
+# alone take a fraction of this; Keras/TensorFlow take several times as long.
+MAX_IMPORT_SECONDS = 3.0
+
+_MEASURE = """
+import json, sys, time
+start = time.time()
+import {module}
+elapsed = time.time() - start
+heavy = sorted(set(sys.modules) & set({heavy}))
+print(json.dumps({{'seconds': elapsed, 'heavy_modules': heavy}}))
+"""
+
+
+def import_from_package(modules):
+  """Imports modules as unintended_ml_bias.<module> in a fresh interpreter.
+
+  The interpreter runs from the repository root, as an installed package would
+  be imported, so the modules' imports of each other must work without this
+  directory on the path.
+  """
+  subprocess.check_call(
+      [sys.executable, '-c', '; '.join(
+          'import unintended_ml_bias.' + module for module in modules)],
+      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure_import(module):
+  """Imports module in a fresh interpreter and returns its import stats."""
+  output = subprocess.check_output(
+      [sys.executable, '-c',
+       _MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+      cwd=os.path.dirname(os.path.abspath(__file__)))
+  return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+class ImportTimeTest(tf.test.TestCase):
+
+  def test_lightweight_modules_do_not_import_heavy_dependencies(self):
+    for module in LIGHTWEIGHT_MODULES:
+      stats = measure_import(module)
+      self.assertEqual(stats['heavy_modules'], [], module)
+      self.assertLess(stats['seconds'], MAX_IMPORT_SECONDS, module)
+
+  def test_package_imports(self):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    modules = sorted(
+        name[:-len('.py')]
+        for name in os.listdir(directory)
+        if name.endswith('.py') and not name.endswith('_test.py') and
+        name != '__init__.py')
+    import_from_package(modules)
+
+
+if __name__ == '__main__':
+  for benchmarked_module in LIGHTWEIGHT_MODULES:
+    print('{}: {:.3f}s'.format(benchmarked_module,
+                               measure_import(benchmarked_module)['seconds']))
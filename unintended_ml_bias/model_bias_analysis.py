@@ -23,15 +23,23 @@ from __future__ import print_function
 
 import base64
 import io
+import json
 import os
 import re
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import scipy.stats as stats
-import seaborn as sns
-from sklearn import metrics
+
+try:
+  import analysis_context
+  import profiling
+except ImportError:
+  from unintended_ml_bias import analysis_context
+  from unintended_ml_bias import profiling
+
+# matplotlib, seaborn, scipy and sklearn are slow to import, and most callers
+# only need some of them (e.g. batch jobs computing metrics never plot), so
+# they are imported by the functions that use them.
 
 
 PINNED_AUC = 'pinned_auc'  # Deprecated, don't use pinned AUC anymore!
@@ -45,6 +53,8 @@ POSITIVE_ASEG = 'positive_aseg'
 
 SUBSET_SIZE = 'subset_size'
 SUBGROUP = 'subgroup'
+# Label column of the results of the multi-label functions.
+LABEL = 'label'
 
 METRICS = [
     SUBGROUP_AUC, NEGATIVE_CROSS_AUC, POSITIVE_CROSS_AUC, NEGATIVE_AEG,
@@ -59,28 +69,46 @@ def column_name(model, metric):
   return model + '_' + metric
 
 
+def _analysis_context(dataset, context):
+  """Enters context, or a new context, for the duration of an entry point."""
+  if context is None:
+    context = analysis_context.AnalysisContext(dataset)
+  elif not context.wraps(dataset):
+    raise ValueError('context wraps a different dataset')
+  return context.entered()
+
+
 def compute_auc(y_true, y_pred):
-  try:
-    return metrics.roc_auc_score(y_true, y_pred)
-  except ValueError:
-    return np.nan
+  from sklearn import metrics
+  with profiling.stage('roc_auc_score', rows=len(y_true)):
+    try:
+      return metrics.roc_auc_score(y_true, y_pred)
+    except ValueError:
+      return np.nan
 
 
 ### Per-subgroup pinned AUC analysis.
-def model_family_auc(dataset, model_names, label_col):
-  aucs = [
-      compute_auc(dataset[label_col], dataset[model_name])
-      for model_name in model_names
-  ]
-  return {
-      'aucs': aucs,
-      'mean': np.mean(aucs),
-      'median': np.median(aucs),
-      'std': np.std(aucs),
-  }
+def model_family_auc(dataset, model_names, label_col, context=None):
+  with _analysis_context(dataset, context) as context:
+    label = context.mask(label_col)
+    aucs = []
+    for model_name in model_names:
+      order = context.sort_order(model_name)
+      sorted_scores = dataset[model_name].values[order]
+      sorted_label = label[order]
+      aucs.append(
+          analysis_context.sorted_auc(sorted_scores[sorted_label],
+                                      sorted_scores[~sorted_label]))
+    return {
+        'aucs': aucs,
+        'mean': np.mean(aucs),
+        'median': np.median(aucs),
+        'std': np.std(aucs),
+    }
 
 
 def plot_model_family_auc(dataset, model_names, label_col, min_auc=0.9):
+  import matplotlib.pyplot as plt
   result = model_family_auc(dataset, model_names, label_col)
   print('mean AUC:', result['mean'])
   print('median:', result['median'])
@@ -102,10 +130,11 @@ def add_subgroup_columns_from_text(df, text_column, subgroups):
     New column contains True if the text contains that subgroup term.
     """
   for term in subgroups:
-    # pylint: disable=cell-var-from-loop
-    df[term] = df[text_column].apply(
-        lambda x: bool(re.search(ur'\b{}\b'.format(term), x,
-                                 flags=re.UNICODE|re.IGNORECASE)))
+    with profiling.stage('regex_tagging', subgroup=term, rows=len(df)):
+      # pylint: disable=cell-var-from-loop
+      df[term] = df[text_column].apply(
+          lambda x: bool(re.search(ur'\b{}\b'.format(term), x,
+                                   flags=re.UNICODE|re.IGNORECASE)))
 
 
 def balanced_subgroup_subset(df, subgroup):
@@ -134,6 +163,17 @@ def model_family_name(model_names):
   return prefix.strip('_')
 
 
+def read_model_family(manifest_path):
+  """Returns the model names of a family trained by model_family_training."""
+  with open(manifest_path) as f:
+    return json.load(f)['model_names']
+
+
+def _sorted_scores(df, subgroup, label, model_name, context):
+  with _analysis_context(df, context) as context:
+    return context.sorted_scores(model_name, subgroup, label)
+
+
 def normalized_mwu(data1, data2, model_name):
   """Returns the number of pairs where the datapoint in data1 has a greater score than that from data2."""
   scores_1 = data1[model_name]
@@ -142,7 +182,9 @@ def normalized_mwu(data1, data2, model_name):
   n2 = len(scores_2)
   if n1 == 0 or n2 == 0:
     return None
-  u, _ = stats.mannwhitneyu(scores_1, scores_2, alternative='less')
+  import scipy.stats as stats
+  with profiling.stage('mannwhitneyu', rows=n1 + n2):
+    u, _ = stats.mannwhitneyu(scores_1, scores_2, alternative='less')
   return u / (n1 * n2)
 
 
@@ -165,101 +207,119 @@ def squared_diff_integral(y, x):
   return np.trapz(np.square(np.subtract(y, x)), x)
 
 
-def compute_negative_aeg(df, subgroup, label, model_name):
-  mwu = normalized_mwu(df[~df[subgroup] & ~df[label]],
-                       df[df[subgroup] & ~df[label]], model_name)
-  if mwu is None:
+def compute_negative_aeg(df, subgroup, label, model_name, context=None):
+  aeg = analysis_context.negative_aeg(
+      _sorted_scores(df, subgroup, label, model_name, context))
+  if np.isnan(aeg):
     return None
-  return 0.5 - mwu
+  return aeg
 
 
-def compute_positive_aeg(df, subgroup, label, model_name):
-  mwu = normalized_mwu(df[~df[subgroup] & df[label]],
-                       df[df[subgroup] & df[label]], model_name)
-  if mwu is None:
+def compute_positive_aeg(df, subgroup, label, model_name, context=None):
+  aeg = analysis_context.positive_aeg(
+      _sorted_scores(df, subgroup, label, model_name, context))
+  if np.isnan(aeg):
     return None
-  return 0.5 - mwu
+  return aeg
 
 
-def compute_subgroup_auc(df, subgroup, label, model_name):
-  subgroup_examples = df[df[subgroup]]
-  return compute_auc(subgroup_examples[label], subgroup_examples[model_name])
+def compute_subgroup_auc(df, subgroup, label, model_name, context=None):
+  return analysis_context.subgroup_auc(
+      _sorted_scores(df, subgroup, label, model_name, context))
 
 
-def compute_negative_cross_auc(df, subgroup, label, model_name):
+def compute_negative_cross_auc(df, subgroup, label, model_name, context=None):
   """Computes the AUC of the within-subgroup negative examples and the background positive examples."""
-  subgroup_negative_examples = df[df[subgroup] & ~df[label]]
-  non_subgroup_positive_examples = df[~df[subgroup] & df[label]]
-  examples = subgroup_negative_examples.append(non_subgroup_positive_examples)
-  return compute_auc(examples[label], examples[model_name])
+  return analysis_context.negative_cross_auc(
+      _sorted_scores(df, subgroup, label, model_name, context))
 
 
-def compute_positive_cross_auc(df, subgroup, label, model_name):
+def compute_positive_cross_auc(df, subgroup, label, model_name, context=None):
   """Computes the AUC of the within-subgroup positive examples and the background negative examples."""
-  subgroup_positive_examples = df[df[subgroup] & df[label]]
-  non_subgroup_negative_examples = df[~df[subgroup] & ~df[label]]
-  examples = subgroup_positive_examples.append(non_subgroup_negative_examples)
-  return compute_auc(examples[label], examples[model_name])
+  return analysis_context.positive_cross_auc(
+      _sorted_scores(df, subgroup, label, model_name, context))
 
 
 def compute_bias_metrics_for_subgroup_and_model(dataset,
                                                 subgroup,
                                                 model,
                                                 label_col,
-                                                include_asegs=False):
-  """Computes per-subgroup metrics for one model and subgroup."""
-  record = {
-      SUBGROUP: subgroup,
-      SUBSET_SIZE: len(dataset[dataset[subgroup]])
-  }
-  record[column_name(model, SUBGROUP_AUC)] = compute_subgroup_auc(
-      dataset, subgroup, label_col, model)
-  record[column_name(model, NEGATIVE_CROSS_AUC)] = compute_negative_cross_auc(
-      dataset, subgroup, label_col, model)
-  record[column_name(model, POSITIVE_CROSS_AUC)] = compute_positive_cross_auc(
-      dataset, subgroup, label_col, model)
-  record[column_name(model, NEGATIVE_AEG)] = compute_negative_aeg(
-      dataset, subgroup, label_col, model)
-  record[column_name(model, POSITIVE_AEG)] = compute_positive_aeg(
-      dataset, subgroup, label_col, model)
-
-  if include_asegs:
-    record[column_name(model, POSITIVE_ASEG)], record[column_name(
-        model, NEGATIVE_ASEG)] = compute_average_squared_equality_gap(
-            dataset, subgroup, label_col, model)
-  return record
+                                                include_asegs=False,
+                                                context=None):
+  """Computes per-subgroup metrics for one model and subgroup.
+
+  Args:
+    dataset: DataFrame of scored examples.
+    subgroup: Boolean subgroup column.
+    model: Model score column.
+    label_col: Boolean label column.
+    include_asegs: Whether to also compute the ASEG metrics.
+    context: Optional analysis_context.AnalysisContext wrapping dataset, to
+      reuse masks and score sorts across calls.
+  """
+  with _analysis_context(dataset, context) as context:
+    subset_size = len(context.indices(subgroup))
+    record = {
+        SUBGROUP: subgroup,
+        SUBSET_SIZE: subset_size
+    }
+    metric_fns = [
+        (SUBGROUP_AUC, compute_subgroup_auc),
+        (NEGATIVE_CROSS_AUC, compute_negative_cross_auc),
+        (POSITIVE_CROSS_AUC, compute_positive_cross_auc),
+        (NEGATIVE_AEG, compute_negative_aeg),
+        (POSITIVE_AEG, compute_positive_aeg),
+    ]
+    for metric, metric_fn in metric_fns:
+      with profiling.stage('bias_metric', subgroup, model, metric,
+                           subset_size):
+        record[column_name(model, metric)] = metric_fn(
+            dataset, subgroup, label_col, model, context)
+
+    if include_asegs:
+      with profiling.stage('bias_metric', subgroup, model, 'aseg',
+                           subset_size):
+        record[column_name(model, POSITIVE_ASEG)], record[column_name(
+            model, NEGATIVE_ASEG)] = compute_average_squared_equality_gap(
+                dataset, subgroup, label_col, model)
+    return record
 
 
 def compute_bias_metrics_for_model(dataset,
                                    subgroups,
                                    model,
                                    label_col,
-                                   include_asegs=False):
+                                   include_asegs=False,
+                                   context=None):
   """Computes per-subgroup metrics for all subgroups and one model."""
-  records = []
-  for subgroup in subgroups:
-    subgroup_record = compute_bias_metrics_for_subgroup_and_model(
-        dataset, subgroup, model, label_col, include_asegs)
-    records.append(subgroup_record)
-  return pd.DataFrame(records)
+  with _analysis_context(dataset, context) as context:
+    records = []
+    for subgroup in subgroups:
+      subgroup_record = compute_bias_metrics_for_subgroup_and_model(
+          dataset, subgroup, model, label_col, include_asegs, context)
+      records.append(subgroup_record)
+    return pd.DataFrame(records)
 
 
 def compute_bias_metrics_for_models(dataset,
                                     subgroups,
                                     models,
                                     label_col,
-                                    include_asegs=False):
+                                    include_asegs=False,
+                                    context=None):
   """Computes per-subgroup metrics for all subgroups and a list of models."""
-  output = None
+  with _analysis_context(dataset, context) as context:
+    output = None
 
-  for model in models:
-    model_results = compute_bias_metrics_for_model(dataset, subgroups, model,
-                                                   label_col, include_asegs)
-    if output is None:
-      output = model_results
-    else:
-      output = output.merge(model_results, on=[SUBGROUP, SUBSET_SIZE])
-  return output
+    for model in models:
+      model_results = compute_bias_metrics_for_model(
+          dataset, subgroups, model, label_col, include_asegs, context)
+      if output is None:
+        output = model_results
+      else:
+        with profiling.stage('merge', model=model, rows=len(output)):
+          output = output.merge(model_results, on=[SUBGROUP, SUBSET_SIZE])
+    return output
 
 
 def merge_family(model_family_results, models, metrics_list):
@@ -276,23 +336,106 @@ def compute_bias_metrics_for_model_families(dataset,
                                             subgroups,
                                             model_families,
                                             label_col,
-                                            include_asegs=False):
+                                            include_asegs=False,
+                                            context=None):
   """Computes per-subgroup metrics for all subgroups and a list of model families (list of lists of models)."""
-  output = None
-  metrics_list = METRICS
-  if include_asegs:
-    metrics_list = METRICS + ASEGS
-  for model_family in model_families:
-    model_family_results = compute_bias_metrics_for_models(
-        dataset, subgroups, model_family, label_col, include_asegs)
-    model_family_results = merge_family(model_family_results, model_family,
-                                        metrics_list)
-    if output is None:
-      output = model_family_results
-    else:
-      output = output.merge(
-          model_family_results, on=[SUBGROUP, SUBSET_SIZE])
-  return output
+  with _analysis_context(dataset, context) as context:
+    output = None
+    metrics_list = METRICS
+    if include_asegs:
+      metrics_list = METRICS + ASEGS
+    for model_family in model_families:
+      model_family_results = compute_bias_metrics_for_models(
+          dataset, subgroups, model_family, label_col, include_asegs, context)
+      with profiling.stage('merge_family',
+                           model=model_family_name(model_family)):
+        model_family_results = merge_family(model_family_results,
+                                            model_family, metrics_list)
+      if output is None:
+        output = model_family_results
+      else:
+        with profiling.stage('merge', rows=len(output)):
+          output = output.merge(
+              model_family_results, on=[SUBGROUP, SUBSET_SIZE])
+    return output
+
+
+### Multi-label analysis.
+def _pairs_by_label(items, label_cols, pairs):
+  """Groups (item, label column) pairs by label column, in label_cols order.
+
+  Args:
+    items: Models or model families.
+    label_cols: Label columns.
+    pairs: Optional list of (item, label column) pairs to evaluate. Defaults to
+      every item with every label column.
+
+  Returns:
+    List of (label column, items paired with it) tuples, skipping label
+    columns without items.
+  """
+  if pairs is None:
+    return [(label_col, list(items)) for label_col in label_cols]
+  by_label = []
+  for label_col in label_cols:
+    label_items = [item for item, label in pairs if label == label_col]
+    if label_items:
+      by_label.append((label_col, label_items))
+  return by_label
+
+
+def _concat_label_results(label_results):
+  """Concatenates per-label result frames, with a LABEL column.
+
+  Labels may score different models, so columns are ordered as they first
+  appear rather than sorted by pd.concat.
+  """
+  frames = []
+  columns = []
+  for label_col, results in label_results:
+    results = results.copy()
+    results.insert(0, LABEL, label_col)
+    frames.append(results)
+    columns.extend(c for c in results.columns if c not in columns)
+  return pd.concat(frames, ignore_index=True, sort=False)[columns]
+
+
+def compute_bias_metrics_for_labels(dataset,
+                                    subgroups,
+                                    models,
+                                    label_cols,
+                                    pairs=None,
+                                    include_asegs=False,
+                                    context=None):
+  """Computes per-subgroup metrics for several label columns at once.
+
+  Subgroup masks and model score sorts are computed once and shared by all
+  labels.
+
+  Args:
+    dataset: DataFrame of scored examples.
+    subgroups: Boolean subgroup columns.
+    models: Model score columns.
+    label_cols: Boolean label columns, e.g. toxicity and its subtypes.
+    pairs: Optional list of (model, label column) pairs to evaluate, e.g. to
+      evaluate each subtype model on its own label. Defaults to every model
+      with every label.
+    include_asegs: Whether to also compute the ASEG metrics.
+    context: Optional analysis_context.AnalysisContext wrapping dataset.
+
+  Returns:
+    DataFrame like compute_bias_metrics_for_models, with a row per label and
+    subgroup and a LABEL column. Metrics of unpaired models and labels are
+    NaN.
+  """
+  with _analysis_context(dataset, context) as context:
+    return _concat_label_results([
+        (label_col,
+         compute_bias_metrics_for_models(dataset, subgroups, label_models,
+                                         label_col, include_asegs, context))
+        for label_col, label_models in _pairs_by_label(
+            models, label_cols, pairs)
+    ])
 
 
 # TODO(lucyvasserman): Deprecate this, and Pinned AUC completely.
@@ -300,14 +443,22 @@ def per_subgroup_aucs(dataset,
                       subgroups,
                       model_families,
                       label_col,
-                      include_asegs=False):
+                      include_asegs=False,
+                      context=None):
   """Computes per-subgroup metrics, including deprecated pinned auc for all subgroups and model families."""
   new_bias_metrics = compute_bias_metrics_for_model_families(
-      dataset, subgroups, model_families, label_col, include_asegs=include_asegs)
+      dataset,
+      subgroups,
+      model_families,
+      label_col,
+      include_asegs=include_asegs,
+      context=context)
 
   records = []
   for subgroup in subgroups:
-    subgroup_subset = balanced_subgroup_subset(dataset, subgroup)
+    with profiling.stage('balanced_subset', subgroup=subgroup,
+                         rows=len(dataset)):
+      subgroup_subset = balanced_subgroup_subset(dataset, subgroup)
     subgroup_record = {
         SUBGROUP: subgroup,
         'pinned_auc_subset_size': len(subgroup_subset)
@@ -417,7 +568,7 @@ def per_model_eer(dataset, label_col, model_names, num_eer_thresholds=101):
 
 
 def per_subgroup_negative_rates(df, subgroups, model_families, threshold,
-                                label_col):
+                                label_col, context=None):
   """Computes per-subgroup true/false negative rates for all model families.
 
     Args:
@@ -430,6 +581,7 @@ def per_subgroup_negative_rates(df, subgroups, model_families, threshold,
       threshold: threshold to use to compute negative rates. Can either be a
         float, or a dictionary mapping model name to float threshold in order to
         use a different threshold for each model.
+      context: Optional analysis_context.AnalysisContext wrapping df.
 
     Returns:
       DataFrame with per-subgroup false/true negative rates for each model
@@ -437,40 +589,77 @@ def per_subgroup_negative_rates(df, subgroups, model_families, threshold,
           Results are summarized across each model family, giving mean, median,
           and standard deviation of each negative rate.
     """
-  records = []
-  for subgroup in subgroups:
-    if subgroup is None:
-      subgroup_subset = df
-    else:
-      subgroup_subset = df[df[subgroup]]
-    subgroup_record = {
-        SUBGROUP: subgroup,
-        SUBSET_SIZE: len(subgroup_subset)
-    }
-    for model_family in model_families:
-      family_name = model_family_name(model_family)
-      family_rates = []
-      for model_name in model_family:
-        model_threshold = (
-            threshold[model_name] if isinstance(threshold, dict) else threshold)
-        assert isinstance(model_threshold, float)
-        model_rates = compute_confusion_rates(subgroup_subset, model_name,
-                                              label_col, model_threshold)
-        family_rates.append(model_rates)
-      tnrs, fnrs = ([rates['tnr'] for rates in family_rates],
-                    [rates['fnr'] for rates in family_rates])
-      subgroup_record.update({
-          family_name + '_tnr_median': np.median(tnrs),
-          family_name + '_tnr_mean': np.mean(tnrs),
-          family_name + '_tnr_std': np.std(tnrs),
-          family_name + '_tnr_values': tnrs,
-          family_name + '_fnr_median': np.median(fnrs),
-          family_name + '_fnr_mean': np.mean(fnrs),
-          family_name + '_fnr_std': np.std(fnrs),
-          family_name + '_fnr_values': fnrs,
-      })
-    records.append(subgroup_record)
-  return pd.DataFrame(records)
+  with _analysis_context(df, context) as context:
+    records = []
+    for subgroup in subgroups:
+      subgroup_subset = context.subset(subgroup)
+      subgroup_record = {
+          SUBGROUP: subgroup,
+          SUBSET_SIZE: len(subgroup_subset)
+      }
+      for model_family in model_families:
+        family_name = model_family_name(model_family)
+        family_rates = []
+        for model_name in model_family:
+          model_threshold = (
+              threshold[model_name]
+              if isinstance(threshold, dict) else threshold)
+          assert isinstance(model_threshold, float)
+          with profiling.stage('confusion_rates', subgroup, model_name,
+                               rows=len(subgroup_subset)):
+            model_rates = compute_confusion_rates(subgroup_subset, model_name,
+                                                  label_col, model_threshold)
+          family_rates.append(model_rates)
+        tnrs, fnrs = ([rates['tnr'] for rates in family_rates],
+                      [rates['fnr'] for rates in family_rates])
+        subgroup_record.update({
+            family_name + '_tnr_median': np.median(tnrs),
+            family_name + '_tnr_mean': np.mean(tnrs),
+            family_name + '_tnr_std': np.std(tnrs),
+            family_name + '_tnr_values': tnrs,
+            family_name + '_fnr_median': np.median(fnrs),
+            family_name + '_fnr_mean': np.mean(fnrs),
+            family_name + '_fnr_std': np.std(fnrs),
+            family_name + '_fnr_values': fnrs,
+        })
+      records.append(subgroup_record)
+    return pd.DataFrame(records)
+
+
+def per_subgroup_negative_rates_for_labels(df,
+                                           subgroups,
+                                           model_families,
+                                           threshold,
+                                           label_cols,
+                                           pairs=None,
+                                           context=None):
+  """Computes per-subgroup negative rates for several label columns at once.
+
+    Args:
+      df: dataset to compute rates on.
+      subgroups: negative rates are computed on subsets of the dataset
+        containing each subgroup.
+      model_families: list of model families; each model family is a list of
+        model names in the family.
+      threshold: threshold to use to compute negative rates, as in
+        per_subgroup_negative_rates.
+      label_cols: columns in df containing boolean labels.
+      pairs: optional list of (model family, label column) pairs to evaluate.
+        Defaults to every model family with every label.
+      context: Optional analysis_context.AnalysisContext wrapping df.
+
+    Returns:
+      DataFrame like per_subgroup_negative_rates, with a row per label and
+      subgroup and a LABEL column.
+    """
+  with _analysis_context(df, context) as context:
+    return _concat_label_results([
+        (label_col,
+         per_subgroup_negative_rates(df, subgroups, label_families, threshold,
+                                     label_col, context))
+        for label_col, label_families in _pairs_by_label(
+            model_families, label_cols, pairs)
+    ])
 
 
 ### Summary metrics
@@ -529,51 +718,59 @@ def per_subgroup_auc_diff_from_overall(dataset,
                                        subgroups,
                                        model_families,
                                        squared_error,
-                                       normed_auc=False):
+                                       normed_auc=False,
+                                       context=None):
   """Calculates the sum of differences between the per-subgroup pinned AUC and the overall AUC."""
-  per_subgroup_auc_results = per_subgroup_aucs(dataset, subgroups,
-                                               model_families, 'label')
-  overall_aucs = {}
-  for fams in model_families:
-    family_name = model_family_name(fams)
-    overall_aucs[family_name] = model_family_auc(dataset, fams, 'label')['aucs']
-  auc_column = '_normalized_pinned_aucs' if normed_auc else '_aucs'
-  d = diff_per_subgroup_from_overall(overall_aucs, per_subgroup_auc_results,
-                                     model_families, auc_column, squared_error)
-  return pd.DataFrame(
-      d.items(), columns=['model_family', 'pinned_auc_equality_difference'])
+  with _analysis_context(dataset, context) as context:
+    per_subgroup_auc_results = per_subgroup_aucs(
+        dataset, subgroups, model_families, 'label', context=context)
+    overall_aucs = {}
+    for fams in model_families:
+      family_name = model_family_name(fams)
+      overall_aucs[family_name] = model_family_auc(
+          dataset, fams, 'label', context=context)['aucs']
+    auc_column = '_normalized_pinned_aucs' if normed_auc else '_aucs'
+    d = diff_per_subgroup_from_overall(overall_aucs, per_subgroup_auc_results,
+                                       model_families, auc_column,
+                                       squared_error)
+    return pd.DataFrame(
+        d.items(), columns=['model_family', 'pinned_auc_equality_difference'])
 
 
 def per_subgroup_nr_diff_from_overall(df, subgroups, model_families, threshold,
-                                      metric_column, squared_error):
+                                      metric_column, squared_error,
+                                      context=None):
   """Calculates the sum of differences between the per-subgroup true or false negative rate and the overall rate."""
-  per_subgroup_nrs = per_subgroup_negative_rates(df, subgroups, model_families,
-                                                 threshold, 'label')
-  all_nrs = per_subgroup_negative_rates(df, [None], model_families, threshold,
-                                        'label')
-  overall_nrs = {}
-  for fams in model_families:
-    family_name = model_family_name(fams)
-    overall_nrs[family_name] = all_nrs[family_name + metric_column][0]
-  return diff_per_subgroup_from_overall(overall_nrs, per_subgroup_nrs,
-                                        model_families, metric_column,
-                                        squared_error)
+  with _analysis_context(df, context) as context:
+    per_subgroup_nrs = per_subgroup_negative_rates(
+        df, subgroups, model_families, threshold, 'label', context)
+    all_nrs = per_subgroup_negative_rates(df, [None], model_families, threshold,
+                                          'label', context)
+    overall_nrs = {}
+    for fams in model_families:
+      family_name = model_family_name(fams)
+      overall_nrs[family_name] = all_nrs[family_name + metric_column][0]
+    return diff_per_subgroup_from_overall(overall_nrs, per_subgroup_nrs,
+                                          model_families, metric_column,
+                                          squared_error)
 
 
 def per_subgroup_fnr_diff_from_overall(df, subgroups, model_families, threshold,
-                                       squared_error):
+                                       squared_error, context=None):
   """Calculates the sum of differences between the per-subgroup false negative rate and the overall FNR."""
   d = per_subgroup_nr_diff_from_overall(df, subgroups, model_families,
-                                        threshold, '_fnr_values', squared_error)
+                                        threshold, '_fnr_values', squared_error,
+                                        context)
   return pd.DataFrame(
       d.items(), columns=['model_family', 'fnr_equality_difference'])
 
 
 def per_subgroup_tnr_diff_from_overall(df, subgroups, model_families, threshold,
-                                       squared_error):
+                                       squared_error, context=None):
   """Calculates the sum of differences between the per-subgroup true negative rate and the overall TNR."""
   d = per_subgroup_nr_diff_from_overall(df, subgroups, model_families,
-                                        threshold, '_tnr_values', squared_error)
+                                        threshold, '_tnr_values', squared_error,
+                                        context)
   return pd.DataFrame(
       d.items(), columns=['model_family', 'tnr_equality_difference'])
 
@@ -588,7 +785,9 @@ def per_subgroup_scatterplots(df,
                               y_lim=(0.8, 1.0),
                               figsize=(15, 5),
                               point_size=8,
-                              file_name='plot'):
+                              file_name='plot',
+                              out_dir='/tmp',
+                              file_format='eps'):
   """Displays a series of one-dimensional scatterplots, 1 scatterplot per subgroup.
 
     Args:
@@ -600,22 +799,37 @@ def per_subgroup_scatterplots(df,
       title: Plot title.
       y_lim: Plot bounds for y axis.
       figsize: Plot figure size.
+      point_size: Size of the scatterplot points.
+      file_name: Prefix of the saved file name, '<file_name>_<values_col>'.
+      out_dir: Directory to save the figure to. None doesn't save the figure.
+      file_format: Format to save the figure in, e.g. 'eps', 'png' or 'svg'.
+
+    Returns:
+      The figure.
   """
+  import matplotlib.pyplot as plt
   fig = plt.figure(figsize=figsize)
   ax = fig.add_subplot(111)
-  for i, (_, row) in enumerate(df.iterrows()):
-    # For each subgroup, we plot a 1D scatterplot. The x-value is the position
-    # of the item in the dataframe. To change the ordering of the subgroups,
-    # sort the dataframe before passing to this function.
-    x = [i] * len(row[values_col])
-    y = row[values_col]
-    ax.scatter(x, y, s=point_size)
+  # For each subgroup, we plot a 1D scatterplot. The x-value is the position
+  # of the item in the dataframe. To change the ordering of the subgroups,
+  # sort the dataframe before passing to this function. All points are drawn
+  # in a single scatter call, colored by subgroup as separate calls would be.
+  values = [np.asarray(v, dtype=float).ravel() for v in df[values_col]]
+  x = np.repeat(np.arange(len(values)), [len(v) for v in values])
+  y = np.concatenate(values) if values else np.array([])
+  colors = np.array(plt.rcParams['axes.prop_cycle'].by_key()['color'])
+  ax.scatter(x, y, s=point_size, c=colors[x % len(colors)])
   ax.set_xticklabels(df[subgroup_col], rotation=90)
   ax.set_xticks(range(len(df)))
   ax.set_ylim(y_lim)
   ax.set_title(title)
   fig.tight_layout()
-  fig.savefig('/tmp/%s_%s.eps' % (file_name, values_col), format='eps')
+  if out_dir is not None:
+    fig.savefig(
+        os.path.join(out_dir, '%s_%s.%s' % (file_name, values_col,
+                                            file_format)),
+        format=file_format)
+  return fig
 
 
 def save_inline_png(fig, out, **kwargs):
@@ -633,6 +847,8 @@ def plot_metric_heatmap(bias_metrics_results,
                         cmap=None,
                         vmin=0,
                         vmax=1.0):
+  import matplotlib.pyplot as plt
+  import seaborn as sns
   df = bias_metrics_results.set_index(SUBGROUP)
   columns = []
   vlines = [i * len(models) for i in range(len(metrics_list))]
@@ -656,14 +872,14 @@ def plot_metric_heatmap(bias_metrics_results,
   if out:
     # Note: Saving as PNG causes larger file sizes compared with SVGs, but with
     # large reports, browsers don't handle all the SVGs on a single page very
-    # well. We should consider using HTML tables instead, using
-    # DataFrame.style.applymap for styling the table background color.
+    # well. bias_report renders the same heatmaps as HTML tables instead.
     save_inline_png(fig, out, bbox_inches='tight')
     plt.close()
   return ax
 
 
 def plot_auc_heatmap(bias_metrics_results, models, out=None):
+  import seaborn as sns
   # Hack to align these colors with the AEG colors below.
   cmap = sns.color_palette('coolwarm', 9)[4:]
   cmap.reverse()
@@ -672,6 +888,7 @@ def plot_auc_heatmap(bias_metrics_results, models, out=None):
 
 
 def plot_aeg_heatmap(bias_metrics_results, models, out=None):
+  import seaborn as sns
   cmap = sns.color_palette('coolwarm', 7)
   return plot_metric_heatmap(
       bias_metrics_results, models, AEGS, out, cmap=cmap, vmin=-0.5, vmax=0.5)
@@ -94,6 +94,47 @@ class ModelBiasAnalysisTest(tf.test.TestCase):
         positive_cross_auc = mba.compute_positive_cross_auc(df, 'subgroup', 'label', 'model_score')
         self.assertAlmostEquals(negative_cross_auc, 0.88, places = 1)
         self.assertAlmostEquals(positive_cross_auc, 1.0, places = 1)
+
+    def test_bias_metrics_for_labels(self):
+        df = self.make_biased_dataset()
+        df['insult'] = df['model_score'] > 0.5
+        df['other_score'] = 1 - df['model_score']
+        results = mba.compute_bias_metrics_for_labels(
+            df, ['subgroup'], ['model_score', 'other_score'],
+            ['label', 'insult'], pairs=[('model_score', 'label'),
+                                        ('model_score', 'insult'),
+                                        ('other_score', 'insult')])
+        self.assertEqual(results[mba.LABEL].tolist(), ['label', 'insult'])
+        # Columns keep the order of the per-label results, with the columns
+        # of models of later labels appended.
+        first_columns = [mba.LABEL] + list(mba.compute_bias_metrics_for_models(
+            df, ['subgroup'], ['model_score'], 'label').columns)
+        columns = list(results.columns)
+        self.assertEqual(columns[:len(first_columns)], first_columns)
+        for column in columns[len(first_columns):]:
+            self.assertTrue(column.startswith('other_score_'))
+        for label_col in ['label', 'insult']:
+            expected = mba.compute_bias_metrics_for_subgroup_and_model(
+                df, 'subgroup', 'model_score', label_col)
+            row = results[results[mba.LABEL] == label_col].iloc[0]
+            for metric in mba.METRICS:
+                column = mba.column_name('model_score', metric)
+                self.assertAlmostEquals(row[column], expected[column])
+        other_auc = results[mba.column_name('other_score', mba.SUBGROUP_AUC)]
+        self.assertTrue(np.isnan(other_auc[0]))
+        self.assertAlmostEquals(other_auc[1], 0.0)
+
+    def test_negative_rates_for_labels(self):
+        df = self.make_biased_dataset()
+        df['label'] = df['label'].astype(bool)
+        df['insult'] = df['model_score'] > 0.5
+        results = mba.per_subgroup_negative_rates_for_labels(
+            df, ['subgroup'], [['model_score']], 0.5, ['label', 'insult'])
+        self.assertEqual(results[mba.LABEL].tolist(), ['label', 'insult'])
+        expected = mba.per_subgroup_negative_rates(
+            df, ['subgroup'], [['model_score']], 0.5, 'insult')
+        self.assertEqual(results['model_score_fnr_values'][1],
+                         expected['model_score_fnr_values'][0])
         
     
 
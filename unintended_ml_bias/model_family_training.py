@@ -0,0 +1,195 @@
+"""Trains a family of ToxModels that differ only in their random seed.
+
+Model families (e.g. wiki_cnn_v3_100, wiki_cnn_v3_101, wiki_cnn_v3_102) are
+used to measure how much bias metrics vary from training run to training run.
+Every member shares the same tokenizer, embedding matrix and tokenized data,
+so train_model_family prepares those once:
+
+  1. Fits the tokenizer and builds the embedding matrix in this process.
+  2. Tokenizes the training and validation data into cached shards (see
+     training_pipeline).
+  3. Trains every seed in its own worker process, with a bounded number of
+     TensorFlow threads per process.
+
+Each member is saved like a model trained with ToxModel.train (<name>_model.h5,
+<name>_hparams.json, <name>_tokenizer.pkl), so ToxModel(<name>) loads it. A
+<family>_family.json manifest lists the members; pass it to
+model_bias_analysis.read_model_family to get the family's model names.
+
+Example usage:
+
+  manifest_path = train_model_family('wiki_cnn_v3', [100, 101, 102],
+                                     'wiki_train.csv', 'wiki_dev.csv',
+                                     'comment', 'is_toxic')
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import multiprocessing
+import os
+import random
+
+import numpy as np
+
+try:
+  import model_tool
+  import training_pipeline
+except ImportError:
+  from unintended_ml_bias import model_tool
+  from unintended_ml_bias import training_pipeline
+
+
+def member_name(family_name, seed):
+  return '{}_{}'.format(family_name, seed)
+
+
+def manifest_path(model_dir, family_name):
+  return os.path.join(model_dir, '%s_family.json' % family_name)
+
+
+def _train_member(args):
+  """Trains one family member. Runs in its own worker process."""
+  (family_name, seed, model_dir, hparams, tokenizer, embedding_path,
+   shard_dirs, threads_per_process) = args
+  # Set before TensorFlow is first imported, which happens in this process,
+  # so that its MKL/OpenMP thread pools are bounded too.
+  for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS']:
+    os.environ[variable] = str(threads_per_process)
+  import keras.backend as K  # pylint: disable=g-import-not-at-top
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+  K.set_session(
+      tf.Session(
+          config=tf.ConfigProto(
+              intra_op_parallelism_threads=threads_per_process,
+              inter_op_parallelism_threads=threads_per_process)))
+  random.seed(seed)
+  np.random.seed(seed)
+  tf.set_random_seed(seed)
+
+  model = model_tool.ToxModel(model_dir=model_dir, hparams=hparams)
+  model.model_name = member_name(family_name, seed)
+  model.update_hparams({'seed': seed})
+  model.save_hparams(model.model_name)
+  model.tokenizer = tokenizer
+  model.save_tokenizer()
+  model.embedding_matrix = np.load(embedding_path, mmap_mode='r')
+  model.build_model()
+  model.fit_shards(shard_dirs, seed=seed)
+  return model.model_name
+
+
+def _prepare_family(family_name, training_data_path, validation_data_path,
+                    text_column, label_column, model_dir, embeddings_path,
+                    hparams, num_workers):
+  """Fits the tokenizer and prepares the shards and embeddings of a family.
+
+  Returns:
+    (base, shard_dirs, embedding_path): a ToxModel with the family's hparams
+    and tokenizer, the shard directories and the saved embedding matrix.
+  """
+  base = model_tool.ToxModel(
+      model_dir=model_dir, embeddings_path=embeddings_path, hparams=hparams)
+  base.model_name = family_name
+  print('Fitting tokenizer...')
+  base.fit_and_save_tokenizer(
+      training_pipeline.iter_csv_texts(training_data_path, text_column))
+  print('Preparing data...')
+  shard_dirs = base.prepare_shards(
+      training_data_path,
+      validation_data_path,
+      text_column,
+      label_column,
+      os.path.join(model_dir, '%s_shards' % family_name),
+      num_workers=num_workers)
+  print('Loading embeddings...')
+  base.load_embeddings()
+  embedding_path = os.path.join(model_dir, '%s_embedding.npy' % family_name)
+  np.save(embedding_path, base.embedding_matrix)
+  return base, shard_dirs, embedding_path
+
+
+def _write_manifest(family_name, seeds, model_names, model_dir,
+                    training_data_path, validation_data_path, hparams):
+  path = manifest_path(model_dir, family_name)
+  with open(path, 'w') as f:
+    json.dump({
+        'family_name': family_name,
+        'model_names': model_names,
+        'seeds': list(seeds),
+        'model_dir': os.path.abspath(model_dir),
+        'training_data_path': os.path.abspath(training_data_path),
+        'validation_data_path': os.path.abspath(validation_data_path),
+        'hparams': hparams,
+    }, f, sort_keys=True, indent=2)
+  return path
+
+
+def train_model_family(family_name,
+                       seeds,
+                       training_data_path,
+                       validation_data_path,
+                       text_column,
+                       label_column,
+                       model_dir=model_tool.DEFAULT_MODEL_DIR,
+                       embeddings_path=model_tool.DEFAULT_EMBEDDINGS_PATH,
+                       hparams=None,
+                       num_processes=None,
+                       threads_per_process=None):
+  """Trains one model per seed, concurrently, and writes a family manifest.
+
+  Args:
+    family_name: Prefix of the member model names, '<family_name>_<seed>'.
+    seeds: List of integer random seeds, one per member.
+    training_data_path: CSV of training data.
+    validation_data_path: CSV of validation data.
+    text_column: Column containing the text.
+    label_column: Column containing the boolean label.
+    model_dir: Directory to save the members and the manifest to.
+    embeddings_path: Word embeddings to initialize the models with.
+    hparams: Hyperparameters overriding model_tool.DEFAULT_HPARAMS.
+    num_processes: Number of members trained at once. Defaults to one process
+      per seed.
+    threads_per_process: TensorFlow threads per process. Defaults to splitting
+      the CPUs evenly across processes.
+
+  Returns:
+    Path to the family manifest.
+  """
+  num_processes = num_processes or len(seeds)
+  threads_per_process = threads_per_process or max(
+      1, multiprocessing.cpu_count() // num_processes)
+
+  base, shard_dirs, embedding_path = _prepare_family(
+      family_name, training_data_path, validation_data_path, text_column,
+      label_column, model_dir, embeddings_path, hparams, num_processes)
+
+  print('Training {} models in {} processes with {} threads each...'.format(
+      len(seeds), num_processes, threads_per_process))
+  tasks = [(family_name, seed, model_dir, base.hparams, base.tokenizer,
+            embedding_path, shard_dirs, threads_per_process) for seed in seeds]
+  # A fresh process per member, so that no TensorFlow state is shared.
+  pool = multiprocessing.Pool(num_processes, maxtasksperchild=1)
+  try:
+    model_names = pool.map(_train_member, tasks, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+  path = _write_manifest(family_name, seeds, model_names, model_dir,
+                         training_data_path, validation_data_path,
+                         base.hparams)
+  print('Family manifest saved to {}'.format(path))
+  return path
+
+
+def load_model_family(family_name, model_dir=model_tool.DEFAULT_MODEL_DIR):
+  """Returns the list of ToxModels of a trained family, e.g. for scoring."""
+  with open(manifest_path(model_dir, family_name)) as f:
+    manifest = json.load(f)
+  return [
+      model_tool.ToxModel(model_name, model_dir=model_dir)
+      for model_name in manifest['model_names']
+  ]
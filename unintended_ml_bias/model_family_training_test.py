@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+import keras.backend as K
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import model_bias_analysis as mba
+import model_family_training
+
+HPARAMS = {
+    'max_sequence_length': 8,
+    'max_num_words': 20,
+    'embedding_dim': 4,
+    'cnn_filter_sizes': [4],
+    'cnn_kernel_sizes': [3],
+    'cnn_pooling_sizes': [2],
+    'epochs': 1,
+    'batch_size': 8,
+    'verbose': False,
+}
+
+
+class ModelFamilyTrainingTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.model_dir = tempfile.mkdtemp()
+    rng = np.random.RandomState(0)
+    words = ['you', 'are', 'nice', 'idiot', 'gay', 'tall', 'hate', 'love']
+    for split, size in [('train', 64), ('valid', 16)]:
+      texts = [' '.join(rng.choice(words, 4)) for _ in range(size)]
+      pd.DataFrame({
+          'comment': texts,
+          'is_toxic': ['idiot' in text or 'hate' in text for text in texts],
+      }).to_csv(os.path.join(self.model_dir, '%s.csv' % split), index=False)
+    self.embeddings_path = os.path.join(self.model_dir, 'embeddings.txt')
+    with open(self.embeddings_path, 'w') as f:
+      for word in words:
+        f.write(' '.join([word] + ['%.2f' % v for v in rng.randn(4)]) + '\n')
+
+  def tearDown(self):
+    shutil.rmtree(self.model_dir)
+    K.clear_session()
+
+  def test_train_members(self):
+    # Members are trained in this process, as train_model_family's worker
+    # processes would.
+    base, shard_dirs, embedding_path = model_family_training._prepare_family(
+        'tiny', os.path.join(self.model_dir, 'train.csv'),
+        os.path.join(self.model_dir, 'valid.csv'), 'comment', 'is_toxic',
+        self.model_dir, self.embeddings_path, HPARAMS, 1)
+    model_names = [
+        model_family_training._train_member(
+            ('tiny', seed, self.model_dir, base.hparams, base.tokenizer,
+             embedding_path, shard_dirs, 1)) for seed in [100, 101]
+    ]
+    self.assertEqual(model_names, ['tiny_100', 'tiny_101'])
+    path = model_family_training._write_manifest(
+        'tiny', [100, 101], model_names, self.model_dir,
+        os.path.join(self.model_dir, 'train.csv'),
+        os.path.join(self.model_dir, 'valid.csv'), base.hparams)
+    self.assertEqual(mba.read_model_family(path), model_names)
+
+    models = model_family_training.load_model_family('tiny', self.model_dir)
+    self.assertEqual([model.hparams['seed'] for model in models], [100, 101])
+    scores = [model.predict(['you idiot', 'you are nice']) for model in models]
+    self.assertEqual(scores[0].shape, (2,))
+    # Members differ only in their seed, so their scores differ.
+    self.assertNotAllClose(scores[0], scores[1])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -7,28 +7,19 @@ import cPickle
 import datetime
 import json
 import os
-from keras.callbacks import EarlyStopping
-from keras.callbacks import ModelCheckpoint
-from keras.layers import Conv1D
-from keras.layers import Dense
-from keras.layers import Dropout
-from keras.layers import Embedding
-from keras.layers import Embedding
-from keras.layers import Flatten
-from keras.layers import GlobalMaxPooling1D
-from keras.layers import Input
-from keras.layers import MaxPooling1D
-from keras.models import load_model
-from keras.models import Model
-from keras.optimizers import RMSprop
-from keras.preprocessing.sequence import pad_sequences
-from keras.preprocessing.text import Tokenizer
-from keras.utils import to_categorical
 import numpy as np
 import pandas as pd
-from sklearn import metrics
 
-print('HELLO from model_tool')
+try:
+  import fast_tokenizer
+  import profiling
+except ImportError:
+  from unintended_ml_bias import fast_tokenizer
+  from unintended_ml_bias import profiling
+
+# Keras/TensorFlow and sklearn take seconds to import, so they are imported by
+# the methods that need them. Scoring with a loaded model, or computing metrics,
+# does not need to pay for the model building and training imports.
 
 DEFAULT_EMBEDDINGS_PATH = '../data/glove.6B/glove.6B.100d.txt'
 DEFAULT_MODEL_DIR = '../models'
@@ -51,12 +42,18 @@ DEFAULT_HPARAMS = {
     'verbose': True
 }
 
+# Batch size used to score texts. Larger than the training batch size, since
+# inference needs no gradients.
+DEFAULT_PREDICT_BATCH_SIZE = 1024
+
 
 def compute_auc(y_true, y_pred):
-  try:
-    return metrics.roc_auc_score(y_true, y_pred)
-  except ValueError:
-    return np.nan
+  from sklearn import metrics
+  with profiling.stage('roc_auc_score', rows=len(y_true)):
+    try:
+      return metrics.roc_auc_score(y_true, y_pred)
+    except ValueError:
+      return np.nan
 
 
 ### Model scoring
@@ -70,7 +67,8 @@ def score_dataset(df, models, text_col):
     for model in models:
         name = model.get_model_name()
         print('{} Scoring with {}...'.format(datetime.datetime.now(), name))
-        df[name] = model.predict(df[text_col])
+        with profiling.stage('score_dataset', model=name, rows=len(df)):
+            df[name] = model.predict(df[text_col])
 
 def load_maybe_score(models, orig_path, scored_path, postprocess_fn):
     if os.path.exists(scored_path):
@@ -99,6 +97,15 @@ def postprocess_wiki_dataset(wiki_data):
                      inplace=True)
 
 
+def _training_pipeline():
+  """Imports training_pipeline, which imports Keras, when it is needed."""
+  try:
+    import training_pipeline
+  except ImportError:
+    from unintended_ml_bias import training_pipeline
+  return training_pipeline
+
+
 class ToxModel():
   """Toxicity model."""
 
@@ -112,6 +119,11 @@ class ToxModel():
     self.model_name = model_name
     self.model = None
     self.tokenizer = None
+    self.sequence_tokenizer = None
+    # Number of processes used to tokenize texts in prep_text.
+    self.tokenizer_workers = 1
+    # Number of texts per distinct padded sequence in the last predict call.
+    self.dedup_ratio = None
     self.hparams = DEFAULT_HPARAMS.copy()
     if hparams:
       self.update_hparams(hparams)
@@ -140,12 +152,14 @@ class ToxModel():
       json.dump(self.hparams, f, sort_keys=True)
 
   def load_model_from_name(self, model_name):
+    from keras.models import load_model
     self.model = load_model(
         os.path.join(self.model_dir, '%s_model.h5' % model_name))
     self.tokenizer = cPickle.load(
         open(
             os.path.join(self.model_dir, '%s_tokenizer.pkl' % model_name),
             'rb'))
+    self.sequence_tokenizer = None
     with open(
         os.path.join(self.model_dir, '%s_hparams.json' % self.model_name),
         'r') as f:
@@ -153,8 +167,14 @@ class ToxModel():
 
   def fit_and_save_tokenizer(self, texts):
     """Fits tokenizer on texts and pickles the tokenizer state."""
+    from keras.preprocessing.text import Tokenizer
     self.tokenizer = Tokenizer(num_words=self.hparams['max_num_words'])
     self.tokenizer.fit_on_texts(texts)
+    self.sequence_tokenizer = None
+    self.save_tokenizer()
+
+  def save_tokenizer(self):
+    """Pickles the tokenizer state."""
     cPickle.dump(self.tokenizer,
                  open(
                      os.path.join(self.model_dir,
@@ -171,9 +191,15 @@ class ToxModel():
     Returns:
       A tokenized and padded text sequence as a model input.
     """
-    text_sequences = self.tokenizer.texts_to_sequences(texts)
-    return pad_sequences(
-        text_sequences, maxlen=self.hparams['max_sequence_length'])
+    if (self.sequence_tokenizer is None or
+        self.sequence_tokenizer.max_sequence_length !=
+        self.hparams['max_sequence_length']):
+      self.sequence_tokenizer = fast_tokenizer.SequenceTokenizer.from_keras(
+          self.tokenizer, self.hparams['max_sequence_length'])
+    texts = list(texts)
+    with profiling.stage('prep_text', model=self.model_name, rows=len(texts)):
+      return self.sequence_tokenizer.texts_to_padded(
+          texts, num_workers=self.tokenizer_workers)
 
   def load_embeddings(self):
     """Loads word embeddings."""
@@ -198,6 +224,8 @@ class ToxModel():
   def train(self, training_data_path, validation_data_path, text_column,
             label_column, model_name):
     """Trains the model."""
+    from keras.models import load_model
+    from keras.utils import to_categorical
     self.model_name = model_name
     self.save_hparams(model_name)
 
@@ -224,19 +252,7 @@ class ToxModel():
     print('Training model...')
 
     save_path = os.path.join(self.model_dir, '%s_model.h5' % self.model_name)
-    callbacks = [
-        ModelCheckpoint(
-            save_path, save_best_only=True, verbose=self.hparams['verbose'])
-    ]
-
-    if self.hparams['stop_early']:
-      callbacks.append(
-          EarlyStopping(
-              min_delta=self.hparams['es_min_delta'],
-              monitor='val_loss',
-              patience=self.hparams['es_patience'],
-              verbose=self.hparams['verbose'],
-              mode='auto'))
+    callbacks = self.training_callbacks(save_path)
 
     self.model.fit(
         train_text,
@@ -252,8 +268,136 @@ class ToxModel():
     self.model = load_model(save_path)
     print('Model loaded!')
 
+  def train_streaming(self,
+                      training_data_path,
+                      validation_data_path,
+                      text_column,
+                      label_column,
+                      model_name,
+                      cache_dir=None,
+                      rows_per_shard=None,
+                      num_workers=1):
+    """Trains the model without holding the datasets in memory.
+
+    Like train, but the data is read in chunks, tokenized by num_workers
+    background processes into padded shards cached under cache_dir, and fed to
+    the model batch by batch from memory-mapped shards. See training_pipeline.
+    """
+    training_pipeline = _training_pipeline()
+    rows_per_shard = rows_per_shard or training_pipeline.DEFAULT_ROWS_PER_SHARD
+    self.model_name = model_name
+    self.save_hparams(model_name)
+    cache_dir = cache_dir or os.path.join(self.model_dir,
+                                          '%s_shards' % model_name)
+
+    print('Fitting tokenizer...')
+    self.fit_and_save_tokenizer(
+        training_pipeline.iter_csv_texts(training_data_path, text_column,
+                                         rows_per_shard))
+    print('Tokenizer fitted!')
+
+    print('Preparing data...')
+    shard_dirs = self.prepare_shards(training_data_path, validation_data_path,
+                                     text_column, label_column, cache_dir,
+                                     rows_per_shard, num_workers)
+    print('Data prepared!')
+
+    print('Loading embeddings...')
+    self.load_embeddings()
+    print('Embeddings loaded!')
+
+    print('Building model graph...')
+    self.build_model()
+    print('Training model...')
+    self.fit_shards(shard_dirs, num_workers)
+
+  def prepare_shards(self,
+                     training_data_path,
+                     validation_data_path,
+                     text_column,
+                     label_column,
+                     cache_dir,
+                     rows_per_shard=None,
+                     num_workers=1):
+    """Tokenizes the training and validation data into cached shards.
+
+    The tokenizer must be initialized before calling this method.
+
+    Returns:
+      Dict with the 'train' and 'valid' shard directories.
+    """
+    training_pipeline = _training_pipeline()
+    rows_per_shard = rows_per_shard or training_pipeline.DEFAULT_ROWS_PER_SHARD
+    sequence_tokenizer = fast_tokenizer.SequenceTokenizer.from_keras(
+        self.tokenizer, self.hparams['max_sequence_length'])
+    shard_dirs = {}
+    for split, path in [('train', training_data_path),
+                        ('valid', validation_data_path)]:
+      shard_dirs[split] = os.path.join(cache_dir, split)
+      training_pipeline.build_shards(path, text_column, label_column,
+                                     sequence_tokenizer, shard_dirs[split],
+                                     rows_per_shard, num_workers)
+    return shard_dirs
+
+  def fit_shards(self, shard_dirs, num_workers=1, seed=None,
+                 extra_callbacks=None):
+    """Fits the built model on shards from prepare_shards.
+
+    The best model is checkpointed to the model dir and loaded at the end.
+    extra_callbacks are Keras callbacks run after the training callbacks.
+    """
+    from keras.models import load_model
+    training_pipeline = _training_pipeline()
+    train_sequence = training_pipeline.ShardSequence(
+        shard_dirs['train'], self.hparams['batch_size'], seed=seed)
+    valid_sequence = training_pipeline.ShardSequence(
+        shard_dirs['valid'], self.hparams['batch_size'], shuffle=False)
+    save_path = os.path.join(self.model_dir, '%s_model.h5' % self.model_name)
+    self.model.fit_generator(
+        train_sequence,
+        steps_per_epoch=len(train_sequence),
+        epochs=self.hparams['epochs'],
+        validation_data=valid_sequence,
+        validation_steps=len(valid_sequence),
+        callbacks=self.training_callbacks(save_path) + list(
+            extra_callbacks or []),
+        max_queue_size=10,
+        workers=max(num_workers, 1),
+        verbose=2)
+    print('Model trained!')
+    print('Best model saved to {}'.format(save_path))
+    print('Loading best model from checkpoint...')
+    self.model = load_model(save_path)
+    print('Model loaded!')
+
+  def training_callbacks(self, save_path):
+    """Returns the checkpointing and early stopping training callbacks."""
+    from keras.callbacks import EarlyStopping
+    from keras.callbacks import ModelCheckpoint
+    callbacks = [
+        ModelCheckpoint(
+            save_path, save_best_only=True, verbose=self.hparams['verbose'])
+    ]
+
+    if self.hparams['stop_early']:
+      callbacks.append(
+          EarlyStopping(
+              min_delta=self.hparams['es_min_delta'],
+              monitor='val_loss',
+              patience=self.hparams['es_patience'],
+              verbose=self.hparams['verbose'],
+              mode='auto'))
+    return callbacks
+
   def build_model(self):
     """Builds model graph."""
+    from keras.layers import Dense
+    from keras.layers import Dropout
+    from keras.layers import Embedding
+    from keras.layers import Flatten
+    from keras.layers import Input
+    from keras.models import Model
+    from keras.optimizers import RMSprop
     sequence_input = Input(
         shape=(self.hparams['max_sequence_length'],), dtype='int32')
     embedding_layer = Embedding(
@@ -282,6 +426,9 @@ class ToxModel():
         loss='categorical_crossentropy', optimizer=rmsprop, metrics=['acc'])
 
   def build_conv_layer(self, input_tensor, filter_size, kernel_size, pool_size):
+    from keras.layers import Conv1D
+    from keras.layers import GlobalMaxPooling1D
+    from keras.layers import MaxPooling1D
     output = Conv1D(
         filter_size, kernel_size, activation='relu', padding='same')(
             input_tensor)
@@ -292,10 +439,21 @@ class ToxModel():
       output = GlobalMaxPooling1D()(output)
     return output
 
-  def predict(self, texts):
-    """Returns model predictions on texts."""
+  def predict(self, texts, batch_size=DEFAULT_PREDICT_BATCH_SIZE):
+    """Returns model predictions on texts.
+
+    Texts with the same padded sequence (e.g. differing only in punctuation or
+    out-of-vocabulary words) are scored once. The number of texts per distinct
+    sequence is kept in dedup_ratio.
+    """
     data = self.prep_text(texts)
-    return self.model.predict(data)[:, 1]
+    with profiling.stage('dedup', model=self.model_name, rows=len(data)):
+      unique, inverse = fast_tokenizer.unique_sequences(data)
+    self.dedup_ratio = len(data) / len(unique) if len(unique) else 1.0
+    with profiling.stage('inference', model=self.model_name, rows=len(unique)):
+      if not len(unique):
+        return np.zeros(0, dtype=np.float32)
+      return self.model.predict(unique, batch_size=batch_size)[:, 1][inverse]
 
   def score_auc(self, texts, labels):
     preds = self.predict(texts)
@@ -0,0 +1,197 @@
+"""NumPy-only inference for exported ToxModel CNNs.
+
+Loading a ToxModel needs Keras/TensorFlow and the pickled Keras Tokenizer,
+which makes scoring workers slow to start. export_model writes everything
+needed to score with the model in a compact format:
+
+  <model_name>_numpy_weights.npz: float32 weights of the Keras model. The
+      embedding matrix is truncated to the max_num_words rows the tokenizer
+      can emit.
+  <model_name>_word_index.json: the tokenizer's word index, restricted to
+      words with an index below max_num_words.
+  <model_name>_hparams.json: the model hyperparameters.
+
+NumpyToxModel loads these files and scores text using only NumPy. It has the
+same get_model_name/predict interface as ToxModel, so it can be passed to
+model_tool.score_dataset.
+
+Example usage:
+
+  export_model(model_tool.ToxModel('wiki_cnn_v3_100'), '../models')
+  model = NumpyToxModel('wiki_cnn_v3_100', '../models')
+  scores = model.predict(texts)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+
+try:
+  import fast_tokenizer
+except ImportError:
+  from unintended_ml_bias import fast_tokenizer
+
+DEFAULT_MODEL_DIR = '../models'
+
+
+def _weights_path(model_dir, model_name):
+  return os.path.join(model_dir, '%s_numpy_weights.npz' % model_name)
+
+
+def _word_index_path(model_dir, model_name):
+  return os.path.join(model_dir, '%s_word_index.json' % model_name)
+
+
+def _hparams_path(model_dir, model_name):
+  return os.path.join(model_dir, '%s_hparams.json' % model_name)
+
+
+def export_model(tox_model, export_dir=None):
+  """Exports a trained ToxModel for NumpyToxModel.
+
+  Args:
+    tox_model: A trained or loaded model_tool.ToxModel.
+    export_dir: Directory to write to. Defaults to the model's model_dir.
+  """
+  export_dir = export_dir or tox_model.model_dir
+  model_name = tox_model.get_model_name()
+  num_words = tox_model.hparams['max_num_words']
+
+  weights = {}
+  num_conv = num_dense = 0
+  for layer in tox_model.model.layers:
+    layer_type = type(layer).__name__
+    layer_weights = layer.get_weights()
+    if layer_type == 'Embedding':
+      weights['embedding'] = layer_weights[0][:num_words]
+    elif layer_type == 'Conv1D':
+      weights['conv_%d_kernel' % num_conv] = layer_weights[0]
+      weights['conv_%d_bias' % num_conv] = layer_weights[1]
+      num_conv += 1
+    elif layer_type == 'Dense':
+      weights['dense_%d_kernel' % num_dense] = layer_weights[0]
+      weights['dense_%d_bias' % num_dense] = layer_weights[1]
+      num_dense += 1
+  np.savez(
+      _weights_path(export_dir, model_name),
+      **dict((k, v.astype(np.float32)) for k, v in weights.items()))
+
+  word_index = dict((word, i)
+                    for word, i in tox_model.tokenizer.word_index.items()
+                    if i < num_words)
+  with open(_word_index_path(export_dir, model_name), 'w') as f:
+    json.dump(word_index, f)
+  with open(_hparams_path(export_dir, model_name), 'w') as f:
+    json.dump(tox_model.hparams, f, sort_keys=True)
+
+
+def _conv1d_same(x, kernel, bias):
+  """1D convolution with 'same' padding and stride 1, followed by relu.
+
+  Builds a strided view of all kernel-sized windows and computes the
+  convolution as a single matrix product.
+
+  Args:
+    x: [batch, length, channels] inputs.
+    kernel: [kernel_size, channels, filters] weights.
+    bias: [filters] bias.
+  """
+  kernel_size, channels, filters = kernel.shape
+  batch, length, _ = x.shape
+  pad_before = (kernel_size - 1) // 2
+  padded = np.zeros((batch, length + kernel_size - 1, channels), x.dtype)
+  padded[:, pad_before:pad_before + length] = x
+  s0, s1, s2 = padded.strides
+  windows = np.lib.stride_tricks.as_strided(
+      padded, shape=(batch, length, kernel_size, channels),
+      strides=(s0, s1, s1, s2))
+  output = np.dot(windows.reshape(batch * length, kernel_size * channels),
+                  kernel.reshape(kernel_size * channels, filters))
+  output += bias
+  np.maximum(output, 0, out=output)
+  return output.reshape(batch, length, filters)
+
+
+def _max_pool1d_same(x, pool_size):
+  """1D max pooling with 'same' padding and stride pool_size."""
+  batch, length, channels = x.shape
+  out_length = -(-length // pool_size)
+  pad_total = out_length * pool_size - length
+  pad_before = pad_total // 2
+  padded = np.full((batch, out_length * pool_size, channels), -np.inf,
+                   x.dtype)
+  padded[:, pad_before:pad_before + length] = x
+  return padded.reshape(batch, out_length, pool_size, channels).max(axis=2)
+
+
+class NumpyToxModel(object):
+  """Toxicity model scored with NumPy only, from an export_model export."""
+
+  def __init__(self, model_name, model_dir=DEFAULT_MODEL_DIR, batch_size=128):
+    self.model_name = model_name
+    self.model_dir = model_dir
+    self.batch_size = batch_size
+    # Number of texts per distinct padded sequence in the last predict call.
+    self.dedup_ratio = None
+    with open(_hparams_path(model_dir, model_name)) as f:
+      self.hparams = json.load(f)
+    with open(_word_index_path(model_dir, model_name)) as f:
+      self.word_index = json.load(f)
+    self.sequence_tokenizer = fast_tokenizer.SequenceTokenizer(
+        self.word_index, self.hparams['max_num_words'],
+        self.hparams['max_sequence_length'])
+    weights = np.load(_weights_path(model_dir, model_name))
+    self.embedding = weights['embedding']
+    self.conv_layers = []
+    for i, pool_size in enumerate(self.hparams['cnn_pooling_sizes']):
+      self.conv_layers.append((weights['conv_%d_kernel' % i],
+                               weights['conv_%d_bias' % i], pool_size))
+    self.dense_layers = []
+    while 'dense_%d_kernel' % len(self.dense_layers) in weights:
+      i = len(self.dense_layers)
+      self.dense_layers.append((weights['dense_%d_kernel' % i],
+                                weights['dense_%d_bias' % i]))
+
+  def get_model_name(self):
+    return self.model_name
+
+  def prep_text(self, texts, num_workers=1):
+    """Turns texts into padded sequences as a model input."""
+    return self.sequence_tokenizer.texts_to_padded(texts, num_workers)
+
+  def predict_sequences(self, sequences):
+    """Returns the positive class probability of padded token sequences."""
+    scores = np.empty(len(sequences), dtype=np.float32)
+    for start in range(0, len(sequences), self.batch_size):
+      x = self.embedding[sequences[start:start + self.batch_size]]
+      for kernel, bias, pool_size in self.conv_layers:
+        x = _conv1d_same(x, kernel, bias)
+        if pool_size:
+          x = _max_pool1d_same(x, pool_size)
+        else:
+          x = x.max(axis=1, keepdims=True)
+      x = x.reshape(len(x), -1)
+      for kernel, bias in self.dense_layers[:-1]:
+        x = np.maximum(np.dot(x, kernel) + bias, 0)
+      kernel, bias = self.dense_layers[-1]
+      logits = np.dot(x, kernel) + bias
+      # Softmax probability of the second (toxic) class.
+      scores[start:start + self.batch_size] = 1 / (
+          1 + np.exp(logits[:, 0] - logits[:, 1]))
+    return scores
+
+  def predict(self, texts, num_workers=1):
+    """Returns model predictions on texts.
+
+    Texts with the same padded sequence are scored once, as in
+    model_tool.ToxModel.predict.
+    """
+    unique, inverse = fast_tokenizer.unique_sequences(
+        self.prep_text(texts, num_workers))
+    self.dedup_ratio = len(inverse) / len(unique) if len(unique) else 1.0
+    return self.predict_sequences(unique)[inverse]
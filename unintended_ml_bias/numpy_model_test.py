@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import shutil
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+import model_tool
+import numpy_model
+
+TEXTS = [
+    'You are a wonderful person!', 'i hate you, you idiot', '',
+    'Being gay is great.', 'THE, the; the-the the the the the the the the',
+    'a b c d e f g h i j k l m n o p q r s t u v w x y z'
+]
+
+
+class NumpyModelTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.model_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.model_dir)
+
+  def build_tox_model(self):
+    np.random.seed(0)
+    tox_model = model_tool.ToxModel(
+        model_dir=self.model_dir,
+        hparams={
+            'max_sequence_length': 20,
+            'max_num_words': 30,
+            'embedding_dim': 8,
+            'cnn_filter_sizes': [4, 6],
+            'cnn_kernel_sizes': [3, 4],
+            'cnn_pooling_sizes': [2, 4],
+        })
+    tox_model.model_name = 'test'
+    tox_model.fit_and_save_tokenizer(TEXTS)
+    tox_model.embedding_matrix = np.random.randn(
+        len(tox_model.tokenizer.word_index) + 1, 8)
+    tox_model.build_model()
+    return tox_model
+
+  def test_matches_keras_predictions(self):
+    tox_model = self.build_tox_model()
+    numpy_model.export_model(tox_model)
+    exported = numpy_model.NumpyToxModel('test', self.model_dir, batch_size=4)
+    self.assertAllEqual(exported.prep_text(TEXTS), tox_model.prep_text(TEXTS))
+    self.assertAllClose(
+        exported.predict(TEXTS), tox_model.predict(TEXTS), atol=1e-5)
+    self.assertEqual(exported.get_model_name(), 'test')
+
+  def test_deduplicates_sequences(self):
+    tox_model = self.build_tox_model()
+    numpy_model.export_model(tox_model)
+    exported = numpy_model.NumpyToxModel('test', self.model_dir)
+    # Differ from TEXTS only in punctuation and out-of-vocabulary words.
+    texts = TEXTS + ['You are a wonderful person.', 'i hate you zzzz you idiot!']
+    expected = tox_model.predict(TEXTS)
+    scores = tox_model.predict(texts)
+    self.assertAllClose(scores[:len(TEXTS)], expected)
+    self.assertAllClose(scores[len(TEXTS):], expected[:2])
+    self.assertAlmostEqual(tox_model.dedup_ratio, 8 / 6)
+    self.assertAllClose(exported.predict(texts), scores, atol=1e-5)
+    self.assertAlmostEqual(exported.dedup_ratio, 8 / 6)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,156 @@
+"""Opt-in timing instrumentation for the bias analysis pipeline.
+
+model_bias_analysis and model_tool wrap their expensive stages (regex tagging,
+metric computations, merges, tokenization, model inference) in
+profiling.stage. While profiling is disabled, stage returns a shared no-op
+context manager, so instrumentation costs one function call per stage.
+
+When enabled, every stage records its call count, total wall time and number of
+rows processed, keyed by the stage name and, where they apply, the subgroup,
+model and metric.
+
+Example usage:
+
+  with profiling.profile() as profiler:
+    model_bias_analysis.compute_bias_metrics_for_model_families(
+        dataset, subgroups, model_families, 'label')
+  print(profiler.to_frame().sort_values('seconds', ascending=False))
+  profiler.save_json('bias_analysis_profile.json')
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import json
+import timeit
+
+STAGE = 'stage'
+SUBGROUP = 'subgroup'
+MODEL = 'model'
+METRIC = 'metric'
+CALLS = 'calls'
+SECONDS = 'seconds'
+ROWS = 'rows'
+
+STATS_COLUMNS = [STAGE, SUBGROUP, MODEL, METRIC, CALLS, SECONDS, ROWS]
+
+
+class _NullStage(object):
+  """Context manager that records nothing, used while profiling is disabled."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+  """Times one execution of a stage and adds it to the profiler's stats."""
+
+  def __init__(self, stats, key, rows):
+    self._stats = stats
+    self._key = key
+    self.rows = rows
+
+  def __enter__(self):
+    self._start = timeit.default_timer()
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    seconds = timeit.default_timer() - self._start
+    stats = self._stats.get(self._key)
+    if stats is None:
+      stats = self._stats[self._key] = [0, 0.0, 0]
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] += self.rows or 0
+    return False
+
+
+class Profiler(object):
+  """Accumulates per-stage call counts, wall time and rows."""
+
+  def __init__(self):
+    # (stage, subgroup, model, metric) -> [calls, seconds, rows].
+    self._stats = {}
+
+  def stage(self, name, subgroup=None, model=None, metric=None, rows=None):
+    """Returns a context manager timing one execution of a stage."""
+    return _Stage(self._stats, (name, subgroup, model, metric), rows)
+
+  def reset(self):
+    self._stats = {}
+
+  def to_dict(self):
+    """Returns the stats as a list of dicts, one per stage and labels."""
+    records = []
+    for key, (calls, seconds, rows) in sorted(
+        self._stats.items(), key=lambda item: -item[1][1]):
+      record = dict(zip([STAGE, SUBGROUP, MODEL, METRIC], key))
+      record.update({CALLS: calls, SECONDS: seconds, ROWS: rows})
+      records.append(record)
+    return records
+
+  def to_json(self):
+    return json.dumps(self.to_dict(), sort_keys=True)
+
+  def save_json(self, path):
+    with open(path, 'w') as f:
+      json.dump(self.to_dict(), f, sort_keys=True, indent=2)
+
+  def to_frame(self):
+    """Returns the stats as a DataFrame with the STATS_COLUMNS columns."""
+    import pandas as pd  # pylint: disable=g-import-not-at-top
+    return pd.DataFrame(self.to_dict(), columns=STATS_COLUMNS)
+
+  def summary(self):
+    """Returns the stats summed over labels, one row per stage."""
+    frame = self.to_frame()
+    return frame.groupby(STAGE)[[CALLS, SECONDS, ROWS]].sum().sort_values(
+        SECONDS, ascending=False)
+
+
+_active_profiler = None
+
+
+def enable():
+  """Starts profiling into a new Profiler, and returns it."""
+  global _active_profiler
+  _active_profiler = Profiler()
+  return _active_profiler
+
+
+def disable():
+  """Stops profiling, and returns the Profiler that was active, if any."""
+  global _active_profiler
+  profiler, _active_profiler = _active_profiler, None
+  return profiler
+
+
+def active_profiler():
+  return _active_profiler
+
+
+@contextlib.contextmanager
+def profile():
+  """Context manager profiling its body. Yields the Profiler."""
+  global _active_profiler
+  previous = _active_profiler
+  profiler = enable()
+  try:
+    yield profiler
+  finally:
+    _active_profiler = previous
+
+
+def stage(name, subgroup=None, model=None, metric=None, rows=None):
+  """Returns a context manager timing a stage, if profiling is enabled."""
+  if _active_profiler is None:
+    return _NULL_STAGE
+  return _active_profiler.stage(name, subgroup, model, metric, rows)
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+
+import pandas as pd
+import tensorflow as tf
+import model_bias_analysis as mba
+import profiling
+
+
+class ProfilingTest(tf.test.TestCase):
+
+  def make_dataset(self):
+    return pd.DataFrame({
+        'text': ['a gay man', 'a muslim', 'hello', 'gay and muslim'] * 5,
+        'label': [True, False, False, True] * 5,
+        'model': [0.9, 0.2, 0.1, 0.6] * 5,
+    })
+
+  def test_disabled_records_nothing(self):
+    self.assertIsNone(profiling.active_profiler())
+    with profiling.stage('anything', rows=10):
+      pass
+    self.assertIsNone(profiling.active_profiler())
+
+  def test_profile_bias_metrics(self):
+    dataset = self.make_dataset()
+    with profiling.profile() as profiler:
+      mba.add_subgroup_columns_from_text(dataset, 'text', ['gay', 'muslim'])
+      mba.compute_bias_metrics_for_models(dataset, ['gay', 'muslim'],
+                                          ['model'], 'label')
+    self.assertIsNone(profiling.active_profiler())
+
+    stats = profiler.to_frame()
+    tagging = stats[stats[profiling.STAGE] == 'regex_tagging']
+    self.assertEqual(sorted(tagging[profiling.SUBGROUP]), ['gay', 'muslim'])
+    self.assertEqual(tagging[profiling.ROWS].tolist(), [20, 20])
+    metrics = stats[stats[profiling.STAGE] == 'bias_metric']
+    self.assertEqual(len(metrics), 2 * len(mba.METRICS))
+    self.assertEqual(metrics[profiling.CALLS].sum(), 2 * len(mba.METRICS))
+    self.assertTrue((stats[profiling.SECONDS] >= 0).all())
+
+    records = json.loads(profiler.to_json())
+    self.assertEqual(len(records), len(stats))
+    self.assertEqual(
+        set(profiler.summary().index), {'regex_tagging', 'bias_metric'})
+
+
+if __name__ == '__main__':
+  tf.test.main()
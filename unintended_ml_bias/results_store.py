@@ -0,0 +1,213 @@
+"""Store of computed bias metrics, and bias regression diffs between models.
+
+Comparing a candidate model with the production baseline used to mean
+reloading and re-merging results CSVs like model_card/unitary_results.csv by
+hand, or recomputing the baseline's metrics. ResultsStore caches the results of
+model_bias_analysis.compute_bias_metrics_for_model in a directory, keyed by:
+
+  - the model,
+  - a fingerprint of the evaluation dataset: its label and subgroup columns,
+  - the list of subgroups and the label column,
+  - the store's FORMAT_VERSION, which changes when the metrics do.
+
+ResultsStore.diff then reuses the stored metrics of the baseline, computes
+only those of the candidate, and reports the subgroups and metrics that differ
+from the baseline by more than a tolerance. This makes it cheap enough to run
+as a gate after every training run:
+
+  store = ResultsStore('../results_store')
+  diffs = store.diff(madlibs, terms, 'wiki_cnn_v3_100', 'wiki_cnn_v3_new',
+                     'label')
+  if diffs[REGRESSION].any():
+    raise ValueError('bias regression:\n%s' % diffs[diffs[REGRESSION]])
+
+Model scores are not part of the fingerprint, so a model re-scored under the
+same name must be recomputed with overwrite=True. diff always recomputes the
+candidate, since it is usually retrained under the same name.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import model_bias_analysis
+
+# Version of the stored results. Bump it when the metrics change, so that
+# results computed by older code are not reused.
+FORMAT_VERSION = 1
+
+DEFAULT_TOLERANCE = 0.01
+
+METRIC = 'metric'
+BASELINE = 'baseline'
+CANDIDATE = 'candidate'
+DELTA = 'delta'
+REGRESSION = 'regression'
+
+
+def dataset_fingerprint(dataset, subgroups, label_col):
+  """Returns a hash of the number of rows, labels and subgroups of dataset."""
+  digest = hashlib.sha1(str(len(dataset)).encode('utf-8'))
+  for column in [label_col] + list(subgroups):
+    digest.update(json.dumps(column).encode('utf-8'))
+    digest.update(np.asarray(dataset[column], dtype=bool).tobytes())
+  return digest.hexdigest()
+
+
+def _is_regression(metric, baseline, candidate):
+  """Whether candidate is more biased than baseline on a metric."""
+  if metric in model_bias_analysis.AEGS:
+    return np.abs(candidate) > np.abs(baseline)
+  return candidate < baseline
+
+
+class ResultsStore(object):
+  """Bias metrics of models, cached in a directory of CSV files."""
+
+  def __init__(self, root_dir):
+    self.root_dir = root_dir
+    if not os.path.exists(root_dir):
+      os.makedirs(root_dir)
+
+  def _key(self, model, fingerprint, subgroups, label_col):
+    key = {
+        'format_version': FORMAT_VERSION,
+        'model': model,
+        'dataset_fingerprint': fingerprint,
+        'subgroups': list(subgroups),
+        'label_col': label_col,
+    }
+    name = hashlib.sha1(json.dumps(key, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+    return key, os.path.join(self.root_dir, name)
+
+  def get(self, dataset, subgroups, model, label_col):
+    """Returns the stored metrics of a model on dataset, or None."""
+    fingerprint = dataset_fingerprint(dataset, subgroups, label_col)
+    _, path = self._key(model, fingerprint, subgroups, label_col)
+    if not os.path.exists(path + '.csv'):
+      return None
+    # Subgroups stay strings, even if they look like numbers.
+    return pd.read_csv(
+        path + '.csv',
+        dtype={model_bias_analysis.SUBGROUP: object},
+        encoding='utf-8')
+
+  def put(self, dataset, subgroups, model, label_col, results):
+    """Stores the metrics of a model on dataset."""
+    fingerprint = dataset_fingerprint(dataset, subgroups, label_col)
+    key, path = self._key(model, fingerprint, subgroups, label_col)
+    # Written atomically, so that concurrent gates never read partial files.
+    results.to_csv(path + '.csv.tmp', index=False, encoding='utf-8')
+    os.rename(path + '.csv.tmp', path + '.csv')
+    with open(path + '.json', 'w') as f:
+      json.dump(key, f, sort_keys=True)
+
+  def compute(self,
+              dataset,
+              subgroups,
+              model,
+              label_col,
+              overwrite=False,
+              context=None):
+    """Returns the metrics of a model on dataset, computing them if needed.
+
+    Args:
+      dataset: DataFrame of scored examples.
+      subgroups: Boolean subgroup columns.
+      model: Model score column. Only read if the metrics aren't stored.
+      label_col: Boolean label column.
+      overwrite: Whether to recompute stored metrics.
+      context: Optional analysis_context.AnalysisContext wrapping dataset.
+
+    Returns:
+      DataFrame like model_bias_analysis.compute_bias_metrics_for_model.
+    """
+    if not overwrite:
+      results = self.get(dataset, subgroups, model, label_col)
+      if results is not None:
+        return results
+    results = model_bias_analysis.compute_bias_metrics_for_model(
+        dataset, subgroups, model, label_col, context=context)
+    self.put(dataset, subgroups, model, label_col, results)
+    return results
+
+  def entries(self):
+    """Returns a DataFrame describing every stored result."""
+    records = []
+    for name in sorted(os.listdir(self.root_dir)):
+      if name.endswith('.json'):
+        with open(os.path.join(self.root_dir, name)) as f:
+          records.append(json.load(f))
+    return pd.DataFrame(records)
+
+  def diff(self,
+           dataset,
+           subgroups,
+           baseline_model,
+           candidate_model,
+           label_col,
+           tolerances=None,
+           context=None):
+    """Reports the bias metrics of a candidate that moved from a baseline.
+
+    Args:
+      dataset: DataFrame of examples, scored by the candidate, and by the
+        baseline unless its metrics are stored.
+      subgroups: Boolean subgroup columns.
+      baseline_model: Baseline model name. Its stored metrics are reused.
+      candidate_model: Candidate model name. Its metrics are always
+        recomputed, and stored to serve as a later baseline.
+      label_col: Boolean label column.
+      tolerances: Optional dict of metric to the largest change not reported.
+        Metrics not in it use DEFAULT_TOLERANCE.
+      context: Optional analysis_context.AnalysisContext wrapping dataset.
+
+    Returns:
+      DataFrame with SUBGROUP, METRIC, BASELINE, CANDIDATE, DELTA and
+      REGRESSION columns, and a row per subgroup and metric that changed by
+      more than its tolerance. REGRESSION is True when the candidate is more
+      biased: a lower AUC, or an AEG further from 0.
+    """
+    tolerances = tolerances or {}
+    baseline = self.compute(dataset, subgroups, baseline_model, label_col,
+                            context=context)
+    candidate = self.compute(dataset, subgroups, candidate_model, label_col,
+                             overwrite=True, context=context)
+    baseline = baseline.set_index(model_bias_analysis.SUBGROUP)
+    candidate = candidate.set_index(model_bias_analysis.SUBGROUP)
+    frames = []
+    for metric in model_bias_analysis.METRICS:
+      baseline_values = baseline[model_bias_analysis.column_name(
+          baseline_model, metric)].astype(float)
+      candidate_values = candidate[model_bias_analysis.column_name(
+          candidate_model, metric)].astype(float).loc[baseline.index]
+      delta = candidate_values - baseline_values
+      tolerance = tolerances.get(metric, DEFAULT_TOLERANCE)
+      changed = (delta.abs() > tolerance).values
+      frames.append(
+          pd.DataFrame({
+              model_bias_analysis.SUBGROUP: baseline.index[changed],
+              METRIC: metric,
+              BASELINE: baseline_values.values[changed],
+              CANDIDATE: candidate_values.values[changed],
+              DELTA: delta.values[changed],
+              REGRESSION:
+                  _is_regression(metric, baseline_values.values[changed],
+                                 candidate_values.values[changed]),
+          }))
+    return pd.concat(
+        frames, ignore_index=True)[[
+            model_bias_analysis.SUBGROUP, METRIC, BASELINE, CANDIDATE, DELTA,
+            REGRESSION
+        ]]
@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import model_bias_analysis as mba
+import results_store
+
+
+class ResultsStoreTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.root_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.root_dir)
+
+  def make_dataset(self, size=200):
+    rng = np.random.RandomState(11)
+    label = rng.rand(size) < 0.4
+    gay = rng.rand(size) < 0.3
+    noise = rng.rand(size)
+    return pd.DataFrame({
+        'label': label,
+        'gay': gay,
+        'tall': rng.rand(size) < 0.3,
+        'baseline': 0.5 * label + 0.5 * noise,
+        # Same as the baseline, but scores gay negatives higher.
+        'candidate': 0.5 * label + 0.5 * noise + 0.3 * (gay & ~label),
+    })
+
+  def test_compute_caches_results(self):
+    dataset = self.make_dataset()
+    store = results_store.ResultsStore(self.root_dir)
+    self.assertIsNone(store.get(dataset, ['gay'], 'baseline', 'label'))
+    results = store.compute(dataset, ['gay'], 'baseline', 'label')
+    # Stored results are used even without the model's scores.
+    cached = store.compute(
+        dataset.drop('baseline', axis=1), ['gay'], 'baseline', 'label')
+    column = mba.column_name('baseline', mba.SUBGROUP_AUC)
+    self.assertAlmostEqual(cached[column][0], results[column][0])
+    self.assertEqual(len(store.entries()), 1)
+    # A different dataset or subgroup list is a different entry.
+    changed = dataset.copy()
+    changed.loc[0, 'gay'] = not changed.loc[0, 'gay']
+    self.assertIsNone(store.get(changed, ['gay'], 'baseline', 'label'))
+    self.assertIsNone(store.get(dataset, ['gay', 'tall'], 'baseline',
+                                'label'))
+
+  def test_non_ascii_subgroups(self):
+    dataset = self.make_dataset().rename(columns={'gay': u'chr\xe9tien'})
+    store = results_store.ResultsStore(self.root_dir)
+    results = store.compute(dataset, [u'chr\xe9tien'], 'baseline', 'label')
+    cached = store.get(dataset, [u'chr\xe9tien'], 'baseline', 'label')
+    self.assertEqual(cached[mba.SUBGROUP].tolist(), [u'chr\xe9tien'])
+    column = mba.column_name('baseline', mba.SUBGROUP_AUC)
+    self.assertAlmostEqual(cached[column][0], results[column][0])
+    diffs = store.diff(dataset, [u'chr\xe9tien'], 'baseline', 'candidate',
+                       'label')
+    self.assertGreater(len(diffs), 0)
+    self.assertEqual(set(diffs[mba.SUBGROUP]), set([u'chr\xe9tien']))
+
+  def test_diff(self):
+    dataset = self.make_dataset()
+    store = results_store.ResultsStore(self.root_dir)
+    diffs = store.diff(dataset, ['gay', 'tall'], 'baseline', 'candidate',
+                       'label')
+    negative_aeg = diffs[(diffs[results_store.METRIC] == mba.NEGATIVE_AEG) &
+                         (diffs[mba.SUBGROUP] == 'gay')]
+    self.assertEqual(len(negative_aeg), 1)
+    self.assertTrue(negative_aeg[results_store.REGRESSION].iloc[0])
+    self.assertAlmostEqual(
+        negative_aeg[results_store.DELTA].iloc[0],
+        negative_aeg[results_store.CANDIDATE].iloc[0] -
+        negative_aeg[results_store.BASELINE].iloc[0])
+    # Larger tolerances hide the change.
+    tolerances = dict((metric, 1.0) for metric in mba.METRICS)
+    self.assertEqual(
+        len(store.diff(dataset, ['gay', 'tall'], 'baseline', 'candidate',
+                       'label', tolerances)), 0)
+
+  def test_diff_recomputes_retrained_candidate(self):
+    dataset = self.make_dataset()
+    store = results_store.ResultsStore(self.root_dir)
+    retrained = dataset.copy()
+    retrained['candidate'] = retrained['baseline']
+    self.assertEqual(
+        len(store.diff(retrained, ['gay'], 'baseline', 'candidate', 'label')),
+        0)
+    # The candidate is retrained under the same name, and more biased.
+    diffs = store.diff(dataset, ['gay'], 'baseline', 'candidate', 'label')
+    self.assertTrue(diffs[results_store.REGRESSION].any())
+
+
+if __name__ == '__main__':
+  tf.test.main()
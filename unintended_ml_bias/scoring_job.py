@@ -0,0 +1,201 @@
+"""Chunked, resumable scoring of large datasets.
+
+model_tool.load_maybe_score scores the whole dataset with every model and
+writes the scored CSV once at the end, so a crash hours into scoring a large
+eval set loses all the work. run_scoring_job instead:
+
+  1. Reads the input CSV in chunks of chunk_size rows.
+  2. Scores each chunk with all models (using model_tool.score_dataset), in a
+     pool of worker processes that each load the models once and keep them
+     loaded for all the chunks they score.
+  3. Writes every scored chunk atomically to checkpoint_dir as soon as it is
+     done.
+  4. Concatenates the chunks into the scored CSV, in the same format as
+     load_maybe_score writes.
+
+When restarted after a crash, chunks already in checkpoint_dir are not scored
+again.
+
+Example usage:
+
+  run_scoring_job('wiki_test.csv', 'wiki_test_scored.csv',
+                  ['wiki_cnn_v3_100', 'wiki_cnn_v3_101'], 'text',
+                  '/tmp/wiki_test_checkpoints', num_workers=4,
+                  postprocess_fn=model_tool.postprocess_wiki_dataset)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+
+import pandas as pd
+
+try:
+  import model_tool
+except ImportError:
+  from unintended_ml_bias import model_tool
+
+DEFAULT_CHUNK_SIZE = 50000
+
+_JOB_FILE = 'job.json'
+
+
+def _chunk_path(checkpoint_dir, chunk_index):
+  return os.path.join(checkpoint_dir, 'chunk_%05d.csv' % chunk_index)
+
+
+def _qualified_name(fn):
+  """Returns module.name of a function or class, to recognize it across runs."""
+  if fn is None:
+    return None
+  return '{}.{}'.format(fn.__module__, getattr(fn, '__name__', repr(fn)))
+
+
+def _job_key(input_path, model_names, text_col, chunk_size, model_dir,
+             postprocess_fn, model_class):
+  stat = os.stat(input_path)
+  return {
+      'input_path': os.path.abspath(input_path),
+      'input_size': stat.st_size,
+      'input_mtime': stat.st_mtime,
+      'model_names': list(model_names),
+      'model_dir': os.path.abspath(model_dir) if model_dir else model_dir,
+      'model_class': _qualified_name(model_class),
+      'postprocess_fn': _qualified_name(postprocess_fn),
+      'text_col': text_col,
+      'chunk_size': chunk_size,
+  }
+
+
+def _check_job(checkpoint_dir, key):
+  """Records the job in checkpoint_dir, or checks it matches a previous run."""
+  if not os.path.exists(checkpoint_dir):
+    os.makedirs(checkpoint_dir)
+  job_path = os.path.join(checkpoint_dir, _JOB_FILE)
+  if os.path.exists(job_path):
+    with open(job_path) as f:
+      previous_key = json.load(f)
+    if previous_key != key:
+      raise ValueError(
+          'checkpoint directory {} contains chunks of a different job: {}'
+          .format(checkpoint_dir, previous_key))
+  else:
+    with open(job_path, 'w') as f:
+      json.dump(key, f, sort_keys=True)
+
+
+_worker_models = None
+
+
+def _init_worker(model_names, model_dir, model_class):
+  global _worker_models
+  _worker_models = [model_class(name, model_dir=model_dir)
+                    for name in model_names]
+
+
+def _score_chunk(args):
+  """Scores one chunk and saves it. Runs in a worker with loaded models."""
+  chunk_index, chunk, text_col, path = args
+  model_tool.score_dataset(chunk, _worker_models, text_col)
+  tmp_path = path + '.tmp'
+  chunk.to_csv(tmp_path, header=chunk_index == 0)
+  os.rename(tmp_path, path)
+  return chunk_index
+
+
+def _concatenate(chunk_paths, output_path):
+  tmp_path = output_path + '.tmp'
+  with open(tmp_path, 'wb') as output:
+    for path in chunk_paths:
+      with open(path, 'rb') as f:
+        shutil.copyfileobj(f, output)
+  os.rename(tmp_path, output_path)
+
+
+def run_scoring_job(input_path,
+                    output_path,
+                    model_names,
+                    text_col,
+                    checkpoint_dir,
+                    model_dir=model_tool.DEFAULT_MODEL_DIR,
+                    chunk_size=DEFAULT_CHUNK_SIZE,
+                    num_workers=1,
+                    postprocess_fn=None,
+                    model_class=model_tool.ToxModel):
+  """Scores a CSV with several models, checkpointing every chunk.
+
+  Models are loaded in the worker processes, so the calling process should not
+  have loaded TensorFlow models itself.
+
+  Args:
+    input_path: CSV of examples to score.
+    output_path: Path of the scored CSV. It has all the input columns, and a
+      score column per model.
+    model_names: Names of the models to score with.
+    text_col: Column containing the text to score, after postprocess_fn.
+    checkpoint_dir: Directory to save the scored chunks in. Reusing it resumes
+      an interrupted job.
+    model_dir: Directory the models are loaded from.
+    chunk_size: Number of rows per chunk.
+    num_workers: Number of worker processes, each with its own copy of the
+      models. 1 scores in this process.
+    postprocess_fn: Optional function modifying each chunk in place before
+      scoring, e.g. model_tool.postprocess_wiki_dataset.
+    model_class: Class of the models, constructed as
+      model_class(model_name, model_dir=model_dir), e.g.
+      numpy_model.NumpyToxModel.
+
+  Returns:
+    output_path.
+  """
+  _check_job(checkpoint_dir,
+             _job_key(input_path, model_names, text_col, chunk_size, model_dir,
+                      postprocess_fn, model_class))
+
+  def pending_chunks():
+    for chunk_index, chunk in enumerate(
+        pd.read_csv(input_path, chunksize=chunk_size)):
+      path = _chunk_path(checkpoint_dir, chunk_index)
+      chunk_paths.append(path)
+      if os.path.exists(path):
+        continue
+      if postprocess_fn:
+        postprocess_fn(chunk)
+      yield chunk_index, chunk, text_col, path
+
+  def report(chunk_index):
+    print('{} Scored chunk {}'.format(datetime.datetime.now(), chunk_index))
+
+  chunk_paths = []
+  if num_workers <= 1:
+    _init_worker(model_names, model_dir, model_class)
+    for args in pending_chunks():
+      report(_score_chunk(args))
+  else:
+    pool = multiprocessing.Pool(
+        num_workers,
+        initializer=_init_worker,
+        initargs=(model_names, model_dir, model_class))
+    try:
+      # Only a couple of chunks per worker are read ahead, to bound memory.
+      in_flight = collections.deque()
+      for args in pending_chunks():
+        if len(in_flight) >= 2 * num_workers:
+          report(in_flight.popleft().get())
+        in_flight.append(pool.apply_async(_score_chunk, (args,)))
+      while in_flight:
+        report(in_flight.popleft().get())
+    finally:
+      pool.close()
+      pool.join()
+
+  print('Saving scores to:', output_path)
+  _concatenate(chunk_paths, output_path)
+  return output_path
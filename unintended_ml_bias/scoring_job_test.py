@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import pandas as pd
+import tensorflow as tf
+import scoring_job
+
+
+class FakeModel(object):
+  """Scores texts by their length. Fails on texts containing fail_on."""
+
+  fail_on = None
+
+  def __init__(self, model_name, model_dir=None):
+    self.model_name = model_name
+    self.model_dir = model_dir
+
+  def get_model_name(self):
+    return self.model_name
+
+  def predict(self, texts):
+    if self.fail_on and any(self.fail_on in text for text in texts):
+      raise RuntimeError('crash')
+    return [len(text) / 100 for text in texts]
+
+
+class ScoringJobTest(tf.test.TestCase):
+
+  def write_input(self, texts):
+    path = os.path.join(self.get_temp_dir(), 'input.csv')
+    pd.DataFrame({'text': texts, 'label': [True] * len(texts)}).to_csv(
+        path, index=False)
+    return path
+
+  def expected_scores(self, input_path):
+    expected = pd.read_csv(input_path)
+    for name in ['model_a', 'model_b']:
+      expected[name] = [len(text) / 100 for text in expected['text']]
+    return expected
+
+  def test_parallel_job_matches_whole_dataset(self):
+    input_path = self.write_input(['text number %d' % i for i in range(25)])
+    output_path = os.path.join(self.get_temp_dir(), 'parallel_scored.csv')
+    scoring_job.run_scoring_job(
+        input_path, output_path, ['model_a', 'model_b'], 'text',
+        os.path.join(self.get_temp_dir(), 'parallel_checkpoints'),
+        chunk_size=4, num_workers=2, model_class=FakeModel)
+    expected_path = os.path.join(self.get_temp_dir(), 'expected.csv')
+    self.expected_scores(input_path).to_csv(expected_path)
+    with open(output_path) as output, open(expected_path) as expected:
+      self.assertEqual(output.read(), expected.read())
+
+  def test_resumes_after_crash(self):
+    checkpoint_dir = os.path.join(self.get_temp_dir(), 'resume_checkpoints')
+    output_path = os.path.join(self.get_temp_dir(), 'resume_scored.csv')
+    texts = ['text number %d' % i for i in range(10)]
+    input_path = self.write_input(texts)
+    FakeModel.fail_on = 'number 5'
+    try:
+      with self.assertRaises(RuntimeError):
+        scoring_job.run_scoring_job(
+            input_path, output_path, ['model_a', 'model_b'], 'text',
+            checkpoint_dir, chunk_size=3, model_class=FakeModel)
+    finally:
+      FakeModel.fail_on = None
+    first_chunk_path = scoring_job._chunk_path(checkpoint_dir, 0)
+    self.assertTrue(os.path.exists(first_chunk_path))
+    self.assertFalse(
+        os.path.exists(scoring_job._chunk_path(checkpoint_dir, 1)))
+
+    # Mark the finished chunk, to check that it isn't scored again.
+    first_chunk = pd.read_csv(first_chunk_path, index_col=0)
+    first_chunk['model_a'] = -1.0
+    first_chunk.to_csv(first_chunk_path)
+    scoring_job.run_scoring_job(
+        input_path, output_path, ['model_a', 'model_b'], 'text',
+        checkpoint_dir, chunk_size=3, model_class=FakeModel)
+    scored = pd.read_csv(output_path, index_col=0)
+    self.assertEqual(len(scored), 10)
+    self.assertEqual(scored['model_a'][:3].tolist(), [-1.0] * 3)
+    self.assertEqual(scored['model_a'][3:].tolist(),
+                     [len(text) / 100 for text in texts[3:]])
+
+  def test_different_job_raises(self):
+    checkpoint_dir = os.path.join(self.get_temp_dir(), 'other_checkpoints')
+    input_path = self.write_input(['a', 'b'])
+    output_path = os.path.join(self.get_temp_dir(), 'other_scored.csv')
+    scoring_job.run_scoring_job(input_path, output_path, ['model_a'], 'text',
+                                checkpoint_dir, model_class=FakeModel)
+    with self.assertRaises(ValueError):
+      scoring_job.run_scoring_job(input_path, output_path, ['model_b'], 'text',
+                                  checkpoint_dir, model_class=FakeModel)
+    with self.assertRaises(ValueError):
+      scoring_job.run_scoring_job(input_path, output_path, ['model_a'], 'text',
+                                  checkpoint_dir, model_class=FakeModel,
+                                  model_dir=self.get_temp_dir())
+    with self.assertRaises(ValueError):
+      scoring_job.run_scoring_job(input_path, output_path, ['model_a'], 'text',
+                                  checkpoint_dir, model_class=FakeModel,
+                                  postprocess_fn=lambda chunk: None)
+    # The same job resumes.
+    scoring_job.run_scoring_job(input_path, output_path, ['model_a'], 'text',
+                                checkpoint_dir, model_class=FakeModel)
+
+
+if __name__ == '__main__':
+  tf.test.main()
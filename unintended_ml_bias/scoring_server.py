@@ -0,0 +1,497 @@
+"""Local scoring server for ToxModels, with request coalescing.
+
+Loading a ToxModel (the Keras model and the tokenizer pickle) takes a while,
+so instead of loading models in every process that needs scores, run one
+server that keeps the models loaded:
+
+  python scoring_server.py --models wiki_cnn_v3_100,wiki_cnn_v3_101 \
+      --port 8000
+
+and score texts with any number of models per request:
+
+  client = ScoringClient(port=8000)
+  scores = client.score(['some text', 'more text'],
+                        ['wiki_cnn_v3_100', 'wiki_cnn_v3_101'])
+  # {'wiki_cnn_v3_100': [0.1, 0.3], 'wiki_cnn_v3_101': [0.2, 0.2]}
+
+The server can also listen on a Unix socket (--unix_socket) instead of a TCP
+port.
+
+Every model has a BatchingScorer thread that coalesces the texts of concurrent
+requests into micro-batches of up to max_batch_size texts, waiting at most
+max_latency seconds for a batch to fill, and scores each batch with a single
+predict call. A request with more than max_batch_size texts is scored in a
+batch of its own.
+
+The HTTP API is:
+
+  GET /models: {"models": [<model name>, ...]}
+  POST /score {"texts": [...], "models": [...]}: {"scores": {<model>: [...]}}
+
+load_test measures the throughput and latency of a running server.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import threading
+import timeit
+
+import numpy as np
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler  # Python 2
+  from BaseHTTPServer import HTTPServer
+  from httplib import HTTPConnection
+  import Queue as queue
+  from SocketServer import ThreadingMixIn
+  from SocketServer import UnixStreamServer
+except ImportError:
+  from http.client import HTTPConnection  # Python 3
+  from http.server import BaseHTTPRequestHandler
+  from http.server import HTTPServer
+  import queue
+  from socketserver import ThreadingMixIn
+  from socketserver import UnixStreamServer
+
+try:
+  import model_tool
+except ImportError:
+  from unintended_ml_bias import model_tool
+
+DEFAULT_MAX_BATCH_SIZE = 128
+DEFAULT_MAX_LATENCY = 0.01
+
+# Keras models shouldn't be loaded by several threads at once.
+_load_lock = threading.Lock()
+
+
+def _model_session(model_class):
+  """Returns a new (graph, session) for a Keras model class, else None.
+
+  Each Keras model gets its own graph and session, so that scorer threads
+  never race on the shared default graph.
+  """
+  try:
+    if not issubclass(model_class, model_tool.ToxModel):
+      return None
+  except TypeError:  # model_class is a factory function.
+    return None
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+  graph = tf.Graph()
+  return graph, tf.Session(graph=graph)
+
+
+@contextlib.contextmanager
+def _entered(model_session):
+  """Makes a model's graph and session the default ones, if it has any."""
+  if model_session is None:
+    yield
+    return
+  graph, session = model_session
+  with graph.as_default(), session.as_default():
+    yield
+
+
+class _PendingRequest(object):
+  """Texts waiting to be scored, and their scores once they are."""
+
+  def __init__(self, texts):
+    self.texts = texts
+    self.scores = None
+    self.error = None
+    self.done = threading.Event()
+
+  def result(self):
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.scores
+
+
+class BatchingScorer(object):
+  """Scores texts with one model, coalescing concurrent requests.
+
+  The model is loaded and always called from the scorer's own thread.
+  """
+
+  def __init__(self,
+               model_name,
+               model_dir=model_tool.DEFAULT_MODEL_DIR,
+               model_class=model_tool.ToxModel,
+               max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+               max_latency=DEFAULT_MAX_LATENCY):
+    self.model_name = model_name
+    self.max_batch_size = max_batch_size
+    self.max_latency = max_latency
+    self.num_batches = 0
+    self._requests = queue.Queue()
+    # A request that didn't fit in the previous batch.
+    self._carried = None
+    self._loaded = threading.Event()
+    self._load_error = None
+    self._thread = threading.Thread(
+        target=self._run, args=(model_dir, model_class))
+    self._thread.daemon = True
+    self._thread.start()
+    self._loaded.wait()
+    if self._load_error is not None:
+      raise self._load_error
+
+  def submit(self, texts):
+    """Queues texts for scoring. Returns a request whose result() waits."""
+    request = _PendingRequest(list(texts))
+    self._requests.put(request)
+    return request
+
+  def score(self, texts):
+    """Returns the scores of texts. Blocks until they are scored."""
+    return self.submit(texts).result()
+
+  def close(self):
+    self._requests.put(None)
+    self._thread.join()
+
+  def _next_batch(self):
+    """Waits for a request, then for more until the batch is full or late.
+
+    A request that would take the batch past max_batch_size is carried over to
+    the next batch.
+    """
+    if self._carried is not None:
+      batch = [self._carried]
+      self._carried = None
+    else:
+      batch = [self._requests.get()]
+    if batch[0] is None:
+      return None
+    size = len(batch[0].texts)
+    deadline = timeit.default_timer() + self.max_latency
+    while size < self.max_batch_size:
+      timeout = deadline - timeit.default_timer()
+      if timeout <= 0:
+        break
+      try:
+        request = self._requests.get(timeout=timeout)
+      except queue.Empty:
+        break
+      if request is None:
+        self._requests.put(None)
+        break
+      if size + len(request.texts) > self.max_batch_size:
+        self._carried = request
+        break
+      batch.append(request)
+      size += len(request.texts)
+    return batch
+
+  def _run(self, model_dir, model_class):
+    try:
+      with _load_lock:
+        model_session = _model_session(model_class)
+        with _entered(model_session):
+          model = model_class(self.model_name, model_dir=model_dir)
+          if model_session is not None:
+            # Keras builds the predict function lazily, which is not
+            # thread-safe, so it is built here.
+            model.model._make_predict_function()
+    except Exception as e:  # pylint: disable=broad-except
+      self._load_error = e
+      return
+    finally:
+      self._loaded.set()
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+      texts = [text for request in batch for text in request.texts]
+      try:
+        with _entered(model_session):
+          scores = np.asarray(model.predict(texts), dtype=float).tolist()
+      except Exception as e:  # pylint: disable=broad-except
+        for request in batch:
+          request.error = e
+          request.done.set()
+        continue
+      self.num_batches += 1
+      start = 0
+      for request in batch:
+        request.scores = scores[start:start + len(request.texts)]
+        start += len(request.texts)
+        request.done.set()
+
+
+class _ScoringHandler(BaseHTTPRequestHandler):
+  """Handles the HTTP API. The server has a scorers dict of model name."""
+
+  protocol_version = 'HTTP/1.1'
+
+  def _send_json(self, code, value):
+    body = json.dumps(value).encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    if self.path != '/models':
+      self._send_json(404, {'error': 'unknown path: %s' % self.path})
+      return
+    self._send_json(200, {'models': sorted(self.server.scorers)})
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    if self.headers.get('Content-Length') is None:
+      self._send_json(411, {'error': 'Content-Length required'})
+      return
+    try:
+      length = int(self.headers['Content-Length'])
+    except ValueError:
+      self._send_json(400, {'error': 'invalid Content-Length'})
+      return
+    body = self.rfile.read(length)
+    if self.path != '/score':
+      self._send_json(404, {'error': 'unknown path: %s' % self.path})
+      return
+    try:
+      request = json.loads(body.decode('utf-8'))
+      texts = request['texts']
+      models = request.get('models') or sorted(self.server.scorers)
+      unknown = [model for model in models if model not in self.server.scorers]
+      if unknown:
+        raise ValueError('unknown models: %s' % ', '.join(unknown))
+    except (KeyError, ValueError) as e:
+      self._send_json(400, {'error': str(e)})
+      return
+    # Submit to every model before waiting, so the models score in parallel.
+    pending = [(model, self.server.scorers[model].submit(texts))
+               for model in models]
+    try:
+      scores = dict((model, request.result()) for model, request in pending)
+    except Exception as e:  # pylint: disable=broad-except
+      self._send_json(500, {'error': str(e)})
+      return
+    self._send_json(200, {'scores': scores})
+
+  def address_string(self):
+    # Unix socket clients have no address.
+    return str(self.client_address[0]) if self.client_address else 'unix'
+
+  def log_message(self, *args):
+    if self.server.verbose:
+      BaseHTTPRequestHandler.log_message(self, *args)
+
+
+def _close_scorers(server):
+  """Stops the scorer threads of a server."""
+  for scorer in server.scorers.values():
+    scorer.close()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def server_close(self):
+    HTTPServer.server_close(self)
+    _close_scorers(self)
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+  daemon_threads = True
+
+  def server_close(self):
+    UnixStreamServer.server_close(self)
+    _close_scorers(self)
+
+
+def make_server(model_names,
+                model_dir=model_tool.DEFAULT_MODEL_DIR,
+                host='localhost',
+                port=8000,
+                unix_socket=None,
+                max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                max_latency=DEFAULT_MAX_LATENCY,
+                model_class=model_tool.ToxModel,
+                verbose=False):
+  """Loads the models and returns a server ready to serve_forever.
+
+  Args:
+    model_names: Names of the models to serve.
+    model_dir: Directory the models are loaded from.
+    host: Host to listen on.
+    port: Port to listen on. 0 picks a free port, see server.server_address.
+    unix_socket: Path of a Unix socket to listen on instead of host and port.
+    max_batch_size: Maximum number of texts scored by one predict call.
+    max_latency: Maximum seconds a request waits for its batch to fill.
+    model_class: Class of the models, constructed as
+      model_class(model_name, model_dir=model_dir).
+    verbose: Whether to log every request.
+  """
+  scorers = dict((name, BatchingScorer(name, model_dir, model_class,
+                                       max_batch_size, max_latency))
+                 for name in model_names)
+  if unix_socket:
+    if os.path.exists(unix_socket):
+      os.remove(unix_socket)
+    server = _ThreadingUnixHTTPServer(unix_socket, _ScoringHandler)
+  else:
+    server = _ThreadingHTTPServer((host, port), _ScoringHandler)
+  server.scorers = scorers
+  server.verbose = verbose
+  return server
+
+
+class _UnixHTTPConnection(HTTPConnection):
+
+  def __init__(self, path, timeout):
+    HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+    self._path = path
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.settimeout(self.timeout)
+    self.sock.connect(self._path)
+
+
+class ScoringClient(object):
+  """Client of a scoring server, keeping its connection open between requests.
+
+  Not thread-safe: use one client per thread.
+  """
+
+  def __init__(self, host='localhost', port=8000, unix_socket=None,
+               timeout=60):
+    if unix_socket:
+      self._connection = _UnixHTTPConnection(unix_socket, timeout)
+    else:
+      self._connection = HTTPConnection(host, port, timeout=timeout)
+
+  def _request(self, method, path, body=None):
+    headers = {'Content-Type': 'application/json'} if body else {}
+    self._connection.request(method, path, body, headers)
+    response = self._connection.getresponse()
+    result = json.loads(response.read().decode('utf-8'))
+    if response.status != 200:
+      raise ValueError('scoring server error {}: {}'.format(
+          response.status, result.get('error')))
+    return result
+
+  def models(self):
+    return self._request('GET', '/models')['models']
+
+  def score(self, texts, models=None):
+    """Returns a dict of model name to the list of scores of texts.
+
+    Scores with all the server's models if models is None.
+    """
+    body = json.dumps({'texts': list(texts), 'models': models})
+    return self._request('POST', '/score', body)['scores']
+
+  def close(self):
+    self._connection.close()
+
+
+def load_test(client_fn,
+              texts,
+              models=None,
+              num_requests=1000,
+              concurrency=16,
+              texts_per_request=1):
+  """Sends requests from concurrent clients and measures their latency.
+
+  Args:
+    client_fn: Function returning a new ScoringClient, called once per client.
+    texts: Texts to score. Requests cycle through them.
+    models: Models to score with, or None for all the server's models.
+    num_requests: Total number of requests.
+    concurrency: Number of concurrent clients, each in its own thread.
+    texts_per_request: Number of texts per request.
+
+  Returns:
+    Dict with the number of requests, requests and texts scored per second,
+    and the mean, p50 and p99 request latency in milliseconds.
+  """
+  latencies = []
+  errors = []
+  counter = iter(range(num_requests))
+  counter_lock = threading.Lock()
+
+  def run_client():
+    client = client_fn()
+    try:
+      while True:
+        with counter_lock:
+          i = next(counter, None)
+        if i is None:
+          return
+        start = i * texts_per_request
+        request_texts = [
+            texts[j % len(texts)]
+            for j in range(start, start + texts_per_request)
+        ]
+        request_start = timeit.default_timer()
+        client.score(request_texts, models)
+        latencies.append(timeit.default_timer() - request_start)
+    except Exception as e:  # pylint: disable=broad-except
+      errors.append(e)
+    finally:
+      client.close()
+
+  threads = [threading.Thread(target=run_client) for _ in range(concurrency)]
+  start = timeit.default_timer()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  seconds = timeit.default_timer() - start
+  if errors:
+    raise errors[0]
+  latencies_ms = np.array(latencies) * 1000
+  return {
+      'requests': num_requests,
+      'requests_per_second': num_requests / seconds,
+      'texts_per_second': num_requests * texts_per_request / seconds,
+      'mean_ms': latencies_ms.mean(),
+      'p50_ms': np.percentile(latencies_ms, 50),
+      'p99_ms': np.percentile(latencies_ms, 99),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--models', required=True,
+                      help='Comma-separated names of the models to serve.')
+  parser.add_argument('--model_dir', default=model_tool.DEFAULT_MODEL_DIR)
+  parser.add_argument('--host', default='localhost')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--unix_socket', help='Listen on this socket path.')
+  parser.add_argument('--max_batch_size', type=int,
+                      default=DEFAULT_MAX_BATCH_SIZE)
+  parser.add_argument('--max_latency_ms', type=float,
+                      default=DEFAULT_MAX_LATENCY * 1000)
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+  server = make_server(
+      args.models.split(','),
+      model_dir=args.model_dir,
+      host=args.host,
+      port=args.port,
+      unix_socket=args.unix_socket,
+      max_batch_size=args.max_batch_size,
+      max_latency=args.max_latency_ms / 1000,
+      verbose=args.verbose)
+  print('Serving {} on {}'.format(args.models, server.server_address))
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+import model_tool
+import scoring_server
+
+
+class FakeModel(object):
+  """Scores texts by their length, divided by the model's number."""
+
+  def __init__(self, model_name, model_dir=None):
+    self.model_name = model_name
+    self.divisor = int(model_name.split('_')[-1])
+    self.batch_sizes = []
+
+  def predict(self, texts):
+    self.batch_sizes.append(len(texts))
+    return [len(text) / self.divisor for text in texts]
+
+
+class FakeKerasModel(model_tool.ToxModel):
+  """A ToxModel with an untrained one-layer Keras model."""
+
+  def __init__(self, model_name, model_dir=None):
+    from keras.layers import Dense
+    from keras.models import Sequential
+    self.model_name = model_name
+    self.model = Sequential(
+        [Dense(2, activation='softmax', input_shape=(1,))])
+
+  def predict(self, texts):
+    lengths = np.array([[len(text)] for text in texts], dtype=np.float32)
+    return self.model.predict(lengths)[:, 1]
+
+
+class ScoringServerTest(tf.test.TestCase):
+
+  def start_server(self, **kwargs):
+    server = scoring_server.make_server(['model_1', 'model_2'],
+                                        model_class=FakeModel, **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return server
+
+  def test_score(self):
+    server = self.start_server(port=0)
+    client = scoring_server.ScoringClient(port=server.server_address[1])
+    self.assertEqual(client.models(), ['model_1', 'model_2'])
+    self.assertEqual(
+        client.score(['ab', 'abcd'], ['model_2']), {'model_2': [1.0, 2.0]})
+    self.assertEqual(
+        client.score(['ab']), {'model_1': [2.0], 'model_2': [1.0]})
+    with self.assertRaises(ValueError):
+      client.score(['ab'], ['model_3'])
+    client.close()
+
+  def test_unix_socket(self):
+    path = os.path.join(self.get_temp_dir(), 'scoring.sock')
+    self.start_server(unix_socket=path)
+    client = scoring_server.ScoringClient(unix_socket=path)
+    self.assertEqual(client.score(['abc'], ['model_1']), {'model_1': [3.0]})
+    client.close()
+
+  def test_requests_are_coalesced(self):
+    scorer = scoring_server.BatchingScorer(
+        'model_1', model_class=FakeModel, max_batch_size=8, max_latency=0.2)
+    results = {}
+
+    def score(i):
+      results[i] = scorer.score(['x' * i])
+
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    scorer.close()
+    self.assertEqual(results, dict((i, [float(i)]) for i in range(8)))
+    self.assertLess(scorer.num_batches, 8)
+
+  def test_batches_are_not_overfilled(self):
+    models = []
+
+    def model_class(model_name, model_dir=None):
+      models.append(FakeModel(model_name, model_dir))
+      return models[-1]
+
+    scorer = scoring_server.BatchingScorer(
+        'model_1', model_class=model_class, max_batch_size=4, max_latency=0.2)
+    requests = [scorer.submit(['x'] * 3) for _ in range(3)]
+    requests.append(scorer.submit(['x'] * 6))
+    for request in requests:
+      request.result()
+    scorer.close()
+    # Only the request larger than max_batch_size gets a larger batch.
+    self.assertEqual(sorted(models[0].batch_sizes), [3, 3, 3, 6])
+
+  def test_missing_content_length(self):
+    server = self.start_server(port=0)
+    connection = scoring_server.HTTPConnection('localhost',
+                                               server.server_address[1])
+    connection.putrequest('POST', '/score')
+    connection.endheaders()
+    self.assertEqual(connection.getresponse().status, 411)
+    connection.close()
+
+  def test_server_close_stops_scorers(self):
+    server = scoring_server.make_server(['model_1'], port=0,
+                                        model_class=FakeModel)
+    server.server_close()
+    self.assertFalse(server.scorers['model_1']._thread.is_alive())
+
+  def test_keras_models_have_own_graphs(self):
+    scorers = [
+        scoring_server.BatchingScorer(name, model_class=FakeKerasModel)
+        for name in ['keras_1', 'keras_2']
+    ]
+    results = []
+
+    def score(scorer):
+      for _ in range(5):
+        results.append(len(scorer.score(['a', 'bb', 'ccc'])))
+
+    threads = [
+        threading.Thread(target=score, args=(scorer,)) for scorer in scorers
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    for scorer in scorers:
+      scorer.close()
+    self.assertEqual(results, [3] * 10)
+
+  def test_load_test(self):
+    server = self.start_server(port=0, max_latency=0.001)
+    port = server.server_address[1]
+    stats = scoring_server.load_test(
+        lambda: scoring_server.ScoringClient(port=port), ['a', 'bb'],
+        num_requests=50, concurrency=4, texts_per_request=2)
+    self.assertEqual(stats['requests'], 50)
+    self.assertGreater(stats['texts_per_second'], 0)
+    self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,341 @@
+"""Permutation tests of the significance of subgroup bias metrics.
+
+A subgroup's AEG or cross AUC gap can be large just by chance, especially for
+small (e.g. intersectional) subgroups. permutation_test compares each metric
+computed by compute_bias_metrics_for_subgroup_and_model with its distribution
+under one of two null hypotheses:
+
+  MEMBERSHIP: the subgroup is a random sample of the dataset. Each permutation
+      draws as many positive and negative examples as the subgroup has, at
+      random from all positive and negative examples.
+  LABEL: within the subgroup, labels are unrelated to the examples. Each
+      permutation shuffles the labels among the subgroup's examples.
+
+The p-value of a metric is the fraction of permutations whose metric is at
+least as far from the mean of the permutations as the observed metric.
+
+Every metric is a normalized Mann-Whitney U statistic, i.e. a sum over the
+subgroup's examples of a per-example count, which is precomputed once per model
+from the sorted scores. A batch of permutations is a 2-D matrix of example
+indices, so the metrics of a whole batch are computed with a few vectorized
+sums. Subgroups and models are tested in parallel worker processes, each with
+its own random seed derived from seed, so results don't depend on the number
+of workers.
+
+P-values can be corrected for testing many subgroups with the Holm or the
+Benjamini-Hochberg method.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+
+import numpy as np
+
+try:
+  import analysis_context
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import analysis_context
+  from unintended_ml_bias import model_bias_analysis
+
+MEMBERSHIP = 'membership'
+LABEL = 'label'
+
+HOLM = 'holm'
+BENJAMINI_HOCHBERG = 'benjamini_hochberg'
+
+P_VALUE = 'p_value'
+
+# Maximum number of random numbers drawn at once for a batch of permutations.
+_MAX_BATCH_ELEMENTS = 10000000
+
+
+def p_value_column(model, metric):
+  return model_bias_analysis.column_name(model, metric + '_' + P_VALUE)
+
+
+def adjust_p_values(p_values, method=HOLM):
+  """Corrects p-values for multiple comparisons.
+
+  Args:
+    p_values: Array of p-values. NaNs are ignored.
+    method: HOLM (family-wise error rate) or BENJAMINI_HOCHBERG (false
+      discovery rate).
+
+  Returns:
+    Array of adjusted p-values.
+  """
+  p_values = np.asarray(p_values, dtype=float)
+  adjusted = np.full(len(p_values), np.nan)
+  valid = np.flatnonzero(~np.isnan(p_values))
+  n = len(valid)
+  if not n:
+    return adjusted
+  order = valid[np.argsort(p_values[valid], kind='mergesort')]
+  sorted_p = p_values[order]
+  if method == HOLM:
+    sorted_adjusted = np.maximum.accumulate(sorted_p * (n - np.arange(n)))
+  elif method == BENJAMINI_HOCHBERG:
+    sorted_adjusted = np.minimum.accumulate(
+        (sorted_p * n / np.arange(1, n + 1))[::-1])[::-1]
+  else:
+    raise ValueError('unknown correction method: %s' % method)
+  adjusted[order] = np.minimum(sorted_adjusted, 1)
+  return adjusted
+
+
+def _random_subsets(rng, n, k, batch_size):
+  """Returns a [batch_size, k] matrix of random k-subsets of range(n)."""
+  if not k:
+    return np.zeros((batch_size, 0), dtype=int)
+  if k * k < n:
+    # Sample with replacement, and redraw the rare rows with duplicates.
+    subsets = rng.randint(n, size=(batch_size, k))
+    while True:
+      sorted_subsets = np.sort(subsets, axis=1)
+      duplicates = np.flatnonzero(
+          (sorted_subsets[:, 1:] == sorted_subsets[:, :-1]).any(axis=1))
+      if not len(duplicates):
+        return subsets
+      subsets[duplicates] = rng.randint(n, size=(len(duplicates), k))
+  return rng.rand(batch_size, n).argpartition(k - 1, axis=1)[:, :k]
+
+
+def _batched_pairs(positive_ranks, negative_ranks, num_ranks):
+  """Counts (positive > negative) pairs, ties 1/2, in each row of a batch."""
+  count_around = analysis_context.count_around
+  batch_size, num_negative = negative_ranks.shape
+  offsets = np.arange(batch_size)[:, np.newaxis] * (num_ranks + 1)
+  flat_negative = np.sort((negative_ranks + offsets).ravel())
+  counts = count_around(flat_negative, (positive_ranks + offsets).ravel())
+  counts = counts.reshape(positive_ranks.shape)
+  counts -= (np.arange(batch_size) * num_negative)[:, np.newaxis]
+  return counts.sum(axis=1)
+
+
+def _metrics(u, negative_cross, positive_cross, negative_mwu, positive_mwu):
+  return {
+      model_bias_analysis.SUBGROUP_AUC: u,
+      model_bias_analysis.NEGATIVE_CROSS_AUC: negative_cross,
+      model_bias_analysis.POSITIVE_CROSS_AUC: positive_cross,
+      model_bias_analysis.NEGATIVE_AEG: 0.5 - negative_mwu,
+      model_bias_analysis.POSITIVE_AEG: 0.5 - positive_mwu,
+  }
+
+
+class _ModelRanks(object):
+  """Per-example counts of one model's scores, shared by all subgroups."""
+
+  def __init__(self, scores, labels):
+    self.scores = scores
+    self.labels = labels
+    self.positive = np.flatnonzero(labels)
+    self.negative = np.flatnonzero(~labels)
+    count_around = analysis_context.count_around
+    positive_scores = np.sort(scores[self.positive])
+    negative_scores = np.sort(scores[self.negative])
+    num_positive = len(self.positive)
+    num_negative = len(self.negative)
+    # Positives scoring above each negative, and negatives below each
+    # positive.
+    self.positives_above = num_positive - count_around(
+        positive_scores, scores[self.negative])
+    self.negatives_below = count_around(negative_scores,
+                                        scores[self.positive])
+    # Examples of the same label scoring above, counting itself as one half.
+    self.negative_rank = num_negative - count_around(negative_scores,
+                                                     scores[self.negative])
+    self.positive_rank = num_positive - count_around(positive_scores,
+                                                     scores[self.positive])
+    unique_scores, dense_ranks = np.unique(scores, return_inverse=True)
+    self.num_ranks = len(unique_scores)
+    self.dense_ranks = dense_ranks
+
+
+def _membership_null(ranks, num_subgroup_positive, num_subgroup_negative,
+                     num_permutations, rng):
+  """Returns each metric for random subgroups of the same label counts."""
+  kp, kn = num_subgroup_positive, num_subgroup_negative
+  num_positive, num_negative = len(ranks.positive), len(ranks.negative)
+  batch_size = max(1, _MAX_BATCH_ELEMENTS // max(num_positive, num_negative))
+  batches = []
+  for start in range(0, num_permutations, batch_size):
+    size = min(batch_size, num_permutations - start)
+    positive = _random_subsets(rng, num_positive, kp, size)
+    negative = _random_subsets(rng, num_negative, kn, size)
+    u = _batched_pairs(ranks.dense_ranks[ranks.positive[positive]],
+                       ranks.dense_ranks[ranks.negative[negative]],
+                       ranks.num_ranks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      batches.append(
+          _metrics(
+              u / (kp * kn),
+              (ranks.positives_above[negative].sum(axis=1) - u) /
+              (kn * (num_positive - kp)),
+              (ranks.negatives_below[positive].sum(axis=1) - u) /
+              (kp * (num_negative - kn)),
+              (ranks.negative_rank[negative].sum(axis=1) - kn * kn / 2) /
+              (kn * (num_negative - kn)),
+              (ranks.positive_rank[positive].sum(axis=1) - kp * kp / 2) /
+              (kp * (num_positive - kp))))
+  return dict((metric, np.concatenate([batch[metric] for batch in batches]))
+              for metric in model_bias_analysis.METRICS)
+
+
+def _label_null(ranks, in_subgroup, num_permutations, rng):
+  """Returns each metric with labels shuffled within the subgroup."""
+  members = np.flatnonzero(in_subgroup)
+  kp = int(ranks.labels[members].sum())
+  kn = len(members) - kp
+  background = ~in_subgroup
+  background_positive = np.sort(ranks.scores[background & ranks.labels])
+  background_negative = np.sort(ranks.scores[background & ~ranks.labels])
+  num_bp, num_bn = len(background_positive), len(background_negative)
+  member_scores = ranks.scores[members]
+  count_around = analysis_context.count_around
+  # Per-member counts against the fixed background, and ranks within the
+  # subgroup.
+  bp_above = num_bp - count_around(background_positive, member_scores)
+  bn_below = count_around(background_negative, member_scores)
+  bn_above = num_bn - bn_below
+  member_rank = count_around(np.sort(member_scores), member_scores) + 0.5
+  batch_size = max(1, _MAX_BATCH_ELEMENTS // max(len(members), 1))
+  batches = []
+  for start in range(0, num_permutations, batch_size):
+    size = min(batch_size, num_permutations - start)
+    positive = _random_subsets(rng, len(members), kp, size)
+
+    def positive_sum(values):
+      return values[positive].sum(axis=1)
+
+    def negative_sum(values):
+      return values.sum() - positive_sum(values)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+      batches.append(
+          _metrics((positive_sum(member_rank) - kp * (kp + 1) / 2) / (kp * kn),
+                   negative_sum(bp_above) / (kn * num_bp),
+                   positive_sum(bn_below) / (kp * num_bn),
+                   negative_sum(bn_above) / (kn * num_bn),
+                   positive_sum(bp_above) / (kp * num_bp)))
+  return dict((metric, np.concatenate([batch[metric] for batch in batches]))
+              for metric in model_bias_analysis.METRICS)
+
+
+_worker_data = None
+_worker_ranks = {}
+
+
+def _init_worker(data):
+  global _worker_data
+  _worker_data = data
+  _worker_ranks.clear()
+
+
+def _test_subgroup(args):
+  """Returns the null distribution of each metric for a model and subgroup."""
+  model, subgroup, mode, num_permutations, seed = args
+  if model not in _worker_ranks:
+    _worker_ranks[model] = _ModelRanks(_worker_data['scores'][model],
+                                       _worker_data['labels'])
+  ranks = _worker_ranks[model]
+  in_subgroup = _worker_data['subgroups'][subgroup]
+  rng = np.random.RandomState(seed)
+  if not in_subgroup.any() or in_subgroup.all():
+    return dict((metric, np.full(num_permutations, np.nan))
+                for metric in model_bias_analysis.METRICS)
+  if mode == LABEL:
+    return _label_null(ranks, in_subgroup, num_permutations, rng)
+  num_subgroup_positive = int((in_subgroup & ranks.labels).sum())
+  num_subgroup_negative = int(in_subgroup.sum()) - num_subgroup_positive
+  return _membership_null(ranks, num_subgroup_positive, num_subgroup_negative,
+                          num_permutations, rng)
+
+
+def _p_value(observed, null):
+  """Two-sided permutation p-value of observed around the mean of null."""
+  null = null[~np.isnan(null)]
+  if observed is None or np.isnan(observed) or not len(null):
+    return np.nan
+  observed = float(observed)
+  center = null.mean()
+  extreme = np.abs(null - center) >= abs(observed - center) - 1e-12
+  return (1 + extreme.sum()) / (1 + len(null))
+
+
+def permutation_test(dataset,
+                     subgroups,
+                     models,
+                     label_col,
+                     num_permutations=1000,
+                     mode=MEMBERSHIP,
+                     seed=0,
+                     num_workers=1,
+                     correction=HOLM,
+                     context=None):
+  """Computes bias metrics and their permutation test p-values.
+
+  Args:
+    dataset: DataFrame of scored examples.
+    subgroups: Boolean subgroup columns.
+    models: Model score columns.
+    label_col: Boolean label column.
+    num_permutations: Number of permutations per subgroup and model.
+    mode: MEMBERSHIP or LABEL, the null hypothesis (see the module docstring).
+    seed: Random seed.
+    num_workers: Number of worker processes.
+    correction: HOLM, BENJAMINI_HOCHBERG, or None for no multiple comparison
+      correction across subgroups.
+    context: Optional analysis_context.AnalysisContext wrapping dataset.
+
+  Returns:
+    The DataFrame of compute_bias_metrics_for_models, with a p-value column
+    (see p_value_column) per model and metric.
+  """
+  if mode not in (MEMBERSHIP, LABEL):
+    raise ValueError('unknown permutation mode: %s' % mode)
+  if context is None:
+    context = analysis_context.AnalysisContext(dataset)
+  results = model_bias_analysis.compute_bias_metrics_for_models(
+      dataset, subgroups, models, label_col, context=context)
+  data = {
+      'labels': context.mask(label_col),
+      'scores': dict((model, np.asarray(dataset[model], dtype=float))
+                     for model in models),
+      'subgroups': dict((subgroup, context.mask(subgroup))
+                        for subgroup in subgroups),
+  }
+  # Each task has its own seed, so results don't depend on num_workers.
+  tasks = [(model, subgroup, mode, num_permutations,
+            [seed, model_index, subgroup_index])
+           for model_index, model in enumerate(models)
+           for subgroup_index, subgroup in enumerate(subgroups)]
+  if num_workers <= 1:
+    _init_worker(data)
+    nulls = [_test_subgroup(task) for task in tasks]
+  else:
+    pool = multiprocessing.Pool(
+        num_workers, initializer=_init_worker, initargs=(data,))
+    try:
+      nulls = pool.map(_test_subgroup, tasks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+  results = results.set_index(model_bias_analysis.SUBGROUP).loc[subgroups]
+  for model_index, model in enumerate(models):
+    model_nulls = nulls[model_index * len(subgroups):(model_index + 1) *
+                        len(subgroups)]
+    for metric in model_bias_analysis.METRICS:
+      observed = results[model_bias_analysis.column_name(model, metric)]
+      p_values = np.array([
+          _p_value(value, null[metric])
+          for value, null in zip(observed, model_nulls)
+      ])
+      if correction:
+        p_values = adjust_p_values(p_values, correction)
+      results[p_value_column(model, metric)] = p_values
+  return results.reset_index()
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import model_bias_analysis as mba
+import significance
+
+
+class SignificanceTest(tf.test.TestCase):
+
+  def make_dataset(self, size=400):
+    rng = np.random.RandomState(3)
+    label = rng.rand(size) < 0.4
+    biased = rng.rand(size) < 0.2
+    unbiased = rng.rand(size) < 0.2
+    return pd.DataFrame({
+        'label': label,
+        'biased': biased,
+        'unbiased': unbiased,
+        # Rounded, so that there are tied scores.
+        'model': np.round(0.4 * label + 0.3 * biased + 0.3 * rng.rand(size),
+                          2),
+    })
+
+  def null_matches_model_bias_analysis(self, mode):
+    dataset = self.make_dataset()
+    data = {
+        'labels': dataset['label'].values,
+        'scores': {'model': dataset['model'].values},
+        'subgroups': {'biased': dataset['biased'].values},
+    }
+    significance._init_worker(data)
+    null = significance._test_subgroup(('model', 'biased', mode, 5, [1, 2]))
+    # Redraw the subsets of the first permutation.
+    rng = np.random.RandomState([1, 2])
+    labels = dataset['label'].values
+    in_subgroup = dataset['biased'].values
+    if mode == significance.MEMBERSHIP:
+      positive = np.flatnonzero(labels)
+      negative = np.flatnonzero(~labels)
+      kp = (in_subgroup & labels).sum()
+      kn = (in_subgroup & ~labels).sum()
+      permuted = np.zeros(len(dataset), dtype=bool)
+      permuted[positive[significance._random_subsets(rng, len(positive), kp,
+                                                     5)[0]]] = True
+      permuted[negative[significance._random_subsets(rng, len(negative), kn,
+                                                     5)[0]]] = True
+      dataset['permuted'] = permuted
+      label_col = 'label'
+    else:
+      members = np.flatnonzero(in_subgroup)
+      kp = labels[members].sum()
+      permuted_labels = labels.copy()
+      permuted_labels[members] = False
+      permuted_labels[members[significance._random_subsets(
+          rng, len(members), kp, 5)[0]]] = True
+      dataset['permuted'] = in_subgroup
+      dataset['permuted_label'] = permuted_labels
+      label_col = 'permuted_label'
+    expected = mba.compute_bias_metrics_for_subgroup_and_model(
+        dataset, 'permuted', 'model', label_col)
+    for metric in mba.METRICS:
+      self.assertEqual(len(null[metric]), 5)
+      self.assertAlmostEqual(null[metric][0],
+                             expected[mba.column_name('model', metric)])
+
+  def test_membership_null_matches_model_bias_analysis(self):
+    self.null_matches_model_bias_analysis(significance.MEMBERSHIP)
+
+  def test_label_null_matches_model_bias_analysis(self):
+    self.null_matches_model_bias_analysis(significance.LABEL)
+
+  def test_permutation_test(self):
+    dataset = self.make_dataset()
+    results = significance.permutation_test(
+        dataset, ['biased', 'unbiased'], ['model'],
+        'label',
+        num_permutations=200,
+        correction=None).set_index(mba.SUBGROUP)
+    column = significance.p_value_column('model', mba.NEGATIVE_AEG)
+    self.assertLess(results.loc['biased', column], 0.01)
+    self.assertGreater(results.loc['unbiased', column], 0.05)
+    self.assertEqual(results.loc['biased', mba.SUBSET_SIZE],
+                     dataset['biased'].sum())
+
+  def test_workers_and_seed(self):
+    dataset = self.make_dataset()
+    args = (dataset, ['biased', 'unbiased'], ['model'], 'label')
+    serial = significance.permutation_test(*args, num_permutations=50, seed=4)
+    parallel = significance.permutation_test(
+        *args, num_permutations=50, seed=4, num_workers=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    other_seed = significance.permutation_test(
+        *args, num_permutations=50, seed=5)
+    columns = [significance.p_value_column('model', m) for m in mba.METRICS]
+    self.assertNotEqual(serial[columns].values.tolist(),
+                        other_seed[columns].values.tolist())
+
+  def test_adjust_p_values(self):
+    p_values = [0.01, 0.04, np.nan, 0.03]
+    self.assertAllClose(
+        significance.adjust_p_values(p_values, significance.HOLM),
+        [0.03, 0.06, np.nan, 0.06])
+    self.assertAllClose(
+        significance.adjust_p_values(p_values,
+                                     significance.BENJAMINI_HOCHBERG),
+        [0.03, 0.04, np.nan, 0.04])
+    with self.assertRaises(ValueError):
+      significance.adjust_p_values(p_values, 'bonferroni')
+
+
+if __name__ == '__main__':
+  tf.test.main()
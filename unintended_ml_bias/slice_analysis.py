@@ -0,0 +1,169 @@
+"""Bias metrics of the slices of a categorical or binned column.
+
+model_bias_analysis computes metrics for boolean subgroup columns, one mask at
+a time. compute_slice_metrics instead slices the data by the values of any
+column, like the Template column of the madlibs datasets, the language of the
+new_madlibber outputs, or binned comment lengths, and computes the same
+metrics for every slice at once.
+
+The column is factorized once into integer slice codes. Each metric is then a
+grouped sum over the slice codes of a per-row count computed from the sorted
+scores of a model (as in term_discovery, where the slices are terms), so each
+model takes one sort and a few np.bincount calls, whatever the number of
+slices.
+
+Example usage:
+
+  madlibs['length'] = madlibs['phrase'].str.len()
+  results = compute_slice_metrics(madlibs, 'length', ['wiki_cnn_v3_100'],
+                                  'label', bins=[0, 20, 40, 80, 1000],
+                                  threshold=0.5)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+try:
+  import analysis_context
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import analysis_context
+  from unintended_ml_bias import model_bias_analysis
+
+TNR = 'tnr'
+FNR = 'fnr'
+
+
+def factorize(values, bins=None):
+  """Returns integer slice codes of values, and the value of each slice.
+
+  Args:
+    values: Array-like of a value per row.
+    bins: Optional increasing bin edges, or number of bins, to bin numeric
+      values with pd.cut.
+
+  Returns:
+    (codes, slice_values): codes[i] is the slice of row i, or -1 for missing
+    values and values outside of the bins.
+  """
+  if bins is not None:
+    binned = pd.cut(np.asarray(values), bins)
+    return np.asarray(binned.codes), list(binned.categories)
+  codes, uniques = pd.factorize(np.asarray(values), sort=True)
+  return codes, list(uniques)
+
+
+def _model_slice_metrics(scores, labels, codes, num_slices):
+  """Returns each bias metric of every slice, for one model's scores."""
+
+  def grouped_sum(vector):
+    return np.bincount(codes, weights=vector, minlength=num_slices)
+
+  num_positive = labels.sum()
+  num_negative = len(labels) - num_positive
+  slice_positive = grouped_sum(labels.astype(float))
+  slice_negative = np.bincount(codes, minlength=num_slices) - slice_positive
+  positive_scores = np.sort(scores[labels])
+  negative_scores = np.sort(scores[~labels])
+  count_around = analysis_context.count_around
+  # Positives scoring above, and negatives scoring below, every row.
+  positives_above = num_positive - count_around(positive_scores, scores)
+  negatives_below = count_around(negative_scores, scores)
+  # Ranks among the rows of the same label, counting the row itself as one
+  # half.
+  rank_among_negatives = num_negative - count_around(negative_scores, scores)
+  rank_among_positives = num_positive - count_around(positive_scores, scores)
+  within = analysis_context.within_group_pairs(
+      codes, np.arange(len(codes)),
+      np.unique(scores, return_inverse=True)[1], labels, num_slices)
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return {
+        model_bias_analysis.SUBGROUP_AUC:
+            within / (slice_positive * slice_negative),
+        model_bias_analysis.NEGATIVE_CROSS_AUC:
+            (grouped_sum(positives_above * ~labels) - within) /
+            (slice_negative * (num_positive - slice_positive)),
+        model_bias_analysis.POSITIVE_CROSS_AUC:
+            (grouped_sum(negatives_below * labels) - within) /
+            (slice_positive * (num_negative - slice_negative)),
+        model_bias_analysis.NEGATIVE_AEG:
+            0.5 - (grouped_sum(rank_among_negatives * ~labels) -
+                   slice_negative**2 / 2) /
+            (slice_negative * (num_negative - slice_negative)),
+        model_bias_analysis.POSITIVE_AEG:
+            0.5 - (grouped_sum(rank_among_positives * labels) -
+                   slice_positive**2 / 2) /
+            (slice_positive * (num_positive - slice_positive)),
+    }
+
+
+def _model_negative_rates(scores, labels, codes, num_slices, threshold):
+  """Returns the true and false negative rates of every slice."""
+  below = scores < threshold
+  true_negatives = np.bincount(
+      codes, weights=below & ~labels, minlength=num_slices)
+  false_negatives = np.bincount(
+      codes, weights=below & labels, minlength=num_slices)
+  positives = np.bincount(codes, weights=labels, minlength=num_slices)
+  negatives = np.bincount(codes, minlength=num_slices) - positives
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return {TNR: true_negatives / negatives, FNR: false_negatives / positives}
+
+
+def compute_slice_metrics(dataset,
+                          slice_col,
+                          models,
+                          label_col,
+                          bins=None,
+                          threshold=None):
+  """Computes per-slice bias metrics for a list of models.
+
+  Each slice is compared with the rest of the data, like a subgroup with its
+  background in compute_bias_metrics_for_models.
+
+  Args:
+    dataset: DataFrame of scored examples.
+    slice_col: Column to slice by, or array of a slice value per row.
+    models: Model score columns.
+    label_col: Boolean label column.
+    bins: Optional bin edges or number of bins for a numeric slice_col (see
+      factorize). Rows outside of the bins are only in the background.
+    threshold: Optional threshold to also compute the true and false negative
+      rates (TNR and FNR) of each slice. Can either be a float, or a
+      dictionary mapping model name to float threshold.
+
+  Returns:
+    DataFrame in the layout of model_bias_analysis.compute_bias_metrics_for_
+    models, with a row per slice value.
+  """
+  values = dataset[slice_col] if np.isscalar(slice_col) else slice_col
+  codes, slice_values = factorize(values, bins)
+  num_slices = len(slice_values)
+  labels = np.asarray(dataset[label_col], dtype=bool)
+  # Rows without a slice get their own code, dropped from the results.
+  codes = np.where(codes < 0, num_slices, codes)
+  results = pd.DataFrame({
+      model_bias_analysis.SUBGROUP: slice_values,
+      model_bias_analysis.SUBSET_SIZE:
+          np.bincount(codes, minlength=num_slices + 1)[:num_slices],
+  })
+  for model in models:
+    scores = np.asarray(dataset[model], dtype=float)
+    metrics = _model_slice_metrics(scores, labels, codes, num_slices + 1)
+    metric_names = list(model_bias_analysis.METRICS)
+    if threshold is not None:
+      model_threshold = (
+          threshold[model] if isinstance(threshold, dict) else threshold)
+      metrics.update(
+          _model_negative_rates(scores, labels, codes, num_slices + 1,
+                                model_threshold))
+      metric_names += [TNR, FNR]
+    for metric in metric_names:
+      results[model_bias_analysis.column_name(model, metric)] = (
+          metrics[metric][:num_slices])
+  return results
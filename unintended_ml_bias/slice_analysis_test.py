@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import model_bias_analysis as mba
+import slice_analysis
+
+
+class SliceAnalysisTest(tf.test.TestCase):
+
+  def make_dataset(self, size=300):
+    rng = np.random.RandomState(5)
+    template = rng.choice(['a', 'b', 'c'], size)
+    label = rng.rand(size) < 0.4
+    return pd.DataFrame({
+        'template': template,
+        'length': rng.randint(1, 100, size),
+        'label': label,
+        # Rounded, so that there are tied scores.
+        'model': np.round(
+            0.4 * label + 0.2 * (template == 'b') + 0.4 * rng.rand(size), 2),
+    })
+
+  def test_matches_model_bias_analysis(self):
+    dataset = self.make_dataset()
+    results = slice_analysis.compute_slice_metrics(dataset, 'template',
+                                                   ['model'], 'label')
+    self.assertEqual(results[mba.SUBGROUP].tolist(), ['a', 'b', 'c'])
+    for value in ['a', 'b', 'c']:
+      dataset[value] = dataset['template'] == value
+    expected = mba.compute_bias_metrics_for_models(dataset, ['a', 'b', 'c'],
+                                                   ['model'], 'label')
+    self.assertEqual(results[mba.SUBSET_SIZE].tolist(),
+                     expected[mba.SUBSET_SIZE].tolist())
+    for metric in mba.METRICS:
+      column = mba.column_name('model', metric)
+      self.assertAllClose(results[column].values,
+                          expected[column].astype(float).values)
+
+  def test_bins(self):
+    dataset = self.make_dataset()
+    results = slice_analysis.compute_slice_metrics(
+        dataset, 'length', ['model'], 'label', bins=[0, 50, 80])
+    self.assertEqual(len(results), 2)
+    self.assertEqual(results[mba.SUBSET_SIZE].tolist(), [
+        (dataset['length'] <= 50).sum(),
+        ((dataset['length'] > 50) & (dataset['length'] <= 80)).sum()
+    ])
+    # Rows outside of the bins are in the background of every slice.
+    dataset['short'] = dataset['length'] <= 50
+    expected = mba.compute_bias_metrics_for_subgroup_and_model(
+        dataset, 'short', 'model', 'label')
+    for metric in mba.METRICS:
+      column = mba.column_name('model', metric)
+      self.assertAlmostEqual(results[column][0], expected[column])
+
+  def test_negative_rates(self):
+    dataset = self.make_dataset()
+    results = slice_analysis.compute_slice_metrics(
+        dataset, dataset['template'].values, ['model'], 'label',
+        threshold={'model': 0.5})
+    subset = dataset[dataset['template'] == 'a']
+    below = subset['model'] < 0.5
+    self.assertAlmostEqual(
+        results[mba.column_name('model', slice_analysis.TNR)][0],
+        (below & ~subset['label']).sum() / (~subset['label']).sum())
+    self.assertAlmostEqual(
+        results[mba.column_name('model', slice_analysis.FNR)][0],
+        (below & subset['label']).sum() / subset['label'].sum())
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,141 @@
+"""Discovers the terms that models are most biased on, over a whole vocabulary.
+
+compute_bias_metrics_for_models evaluates hand-picked subgroups, one
+DataFrame filter at a time. compute_term_bias_metrics instead treats every term
+of a term_index.TermIndex that appears in at least min_count documents as a
+candidate subgroup, and computes the same metrics for all of them at once.
+
+Every metric is a normalized Mann-Whitney U statistic of two subsets of the
+data. With the scores of a model sorted once, each can be written as a sum
+over a term's postings of a per-document vector, minus a correction computed
+within the term's postings:
+
+  - For the AEGs, the rank sum of a term's negative (or positive) documents
+    among all negative (positive) documents.
+  - For the cross AUCs, the number of positive documents scoring above each
+    document (or negative documents scoring below it), minus the within-term
+    pairs.
+  - The within-term pairs also give the subgroup AUC. They are counted in one
+    segmented pass over all postings sorted by term and score.
+
+The sums over postings are sparse matrix-vector products of the term-document
+membership matrix, computed on the index's CSR arrays.
+
+Example usage:
+
+  index = term_index.TermIndex.from_frame(dataset, 'comment', 'is_toxic')
+  results = compute_term_bias_metrics(index, dataset, ['wiki_cnn_v3_100'],
+                                      min_count=50)
+  print(most_biased_terms(results, 'wiki_cnn_v3_100'))
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+try:
+  import analysis_context
+  import model_bias_analysis
+except ImportError:
+  from unintended_ml_bias import analysis_context
+  from unintended_ml_bias import model_bias_analysis
+
+
+def compute_term_bias_metrics(index,
+                              dataset,
+                              models,
+                              min_count=10,
+                              max_fraction=None):
+  """Computes the bias metrics of every frequent term as a subgroup.
+
+  Args:
+    index: term_index.TermIndex of the dataset's texts and labels.
+    dataset: DataFrame with a score column per model, with rows in the order
+      of the index's documents.
+    models: Model score columns.
+    min_count: Minimum number of documents containing a term.
+    max_fraction: Optional maximum fraction of documents containing a term, to
+      skip terms like 'the' that are in most documents.
+
+  Returns:
+    DataFrame in the layout of model_bias_analysis.compute_bias_metrics_for_
+    models, with a row per term.
+  """
+  counts = np.diff(index.indptr)
+  keep = counts >= min_count
+  if max_fraction is not None:
+    keep &= counts <= max_fraction * len(index)
+  term_ids = np.flatnonzero(keep)
+  num_terms = len(term_ids)
+  # CSR arrays of the kept terms' rows of the membership matrix.
+  rows = np.repeat(np.arange(num_terms), counts[term_ids])
+  doc_ids = index.doc_ids[np.repeat(keep, counts)]
+
+  def matvec(vector):
+    return np.bincount(rows, weights=vector[doc_ids], minlength=num_terms)
+
+  labels = index.labels
+  num_positive = labels.sum()
+  num_negative = len(labels) - num_positive
+  term_positive = matvec(labels.astype(float))
+  term_negative = counts[term_ids] - term_positive
+  results = pd.DataFrame({
+      model_bias_analysis.SUBGROUP: [index.vocabulary[i] for i in term_ids],
+      model_bias_analysis.SUBSET_SIZE: counts[term_ids],
+  })
+  count_around = analysis_context.count_around
+  for model in models:
+    scores = np.asarray(dataset[model], dtype=float)
+    positive_scores = np.sort(scores[labels])
+    negative_scores = np.sort(scores[~labels])
+    # Positives scoring above, and negatives scoring below, every document.
+    positives_above = num_positive - count_around(positive_scores, scores)
+    negatives_below = count_around(negative_scores, scores)
+    # Ranks among the documents of the same label, counting the document
+    # itself as one half.
+    rank_among_negatives = num_negative - count_around(negative_scores, scores)
+    rank_among_positives = num_positive - count_around(positive_scores, scores)
+    within = analysis_context.within_group_pairs(
+        rows, doc_ids, np.unique(scores, return_inverse=True)[1], labels,
+        num_terms)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+      subgroup_auc = within / (term_positive * term_negative)
+      negative_cross_auc = (matvec(positives_above * ~labels) - within) / (
+          term_negative * (num_positive - term_positive))
+      positive_cross_auc = (matvec(negatives_below * labels) - within) / (
+          term_positive * (num_negative - term_negative))
+      negative_mwu = (matvec(rank_among_negatives * ~labels) -
+                      term_negative**2 / 2) / (
+                          term_negative * (num_negative - term_negative))
+      positive_mwu = (matvec(rank_among_positives * labels) -
+                      term_positive**2 / 2) / (
+                          term_positive * (num_positive - term_positive))
+    for metric, values in [
+        (model_bias_analysis.SUBGROUP_AUC, subgroup_auc),
+        (model_bias_analysis.NEGATIVE_CROSS_AUC, negative_cross_auc),
+        (model_bias_analysis.POSITIVE_CROSS_AUC, positive_cross_auc),
+        (model_bias_analysis.NEGATIVE_AEG, 0.5 - negative_mwu),
+        (model_bias_analysis.POSITIVE_AEG, 0.5 - positive_mwu),
+    ]:
+      results[model_bias_analysis.column_name(model, metric)] = values
+  return results
+
+
+def most_biased_terms(results,
+                      model,
+                      metric=model_bias_analysis.SUBGROUP_AUC,
+                      num_terms=20):
+  """Returns the num_terms rows of results most biased on a metric.
+
+  The most biased terms have the lowest AUCs, or the AEGs furthest from 0.
+  """
+  values = results[model_bias_analysis.column_name(model, metric)]
+  if metric in model_bias_analysis.AEGS:
+    values = -values.abs()
+  order = np.argsort(values.values, kind='mergesort')
+  order = order[~np.isnan(values.values[order])]
+  return results.iloc[order[:num_terms]]
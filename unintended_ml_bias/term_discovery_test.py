@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import model_bias_analysis as mba
+import term_discovery
+import term_index
+
+
+class TermDiscoveryTest(tf.test.TestCase):
+
+  def make_dataset(self, size=300):
+    rng = np.random.RandomState(2)
+    words = np.array(['gay', 'muslim', 'tall', 'box', 'music', 'the'])
+    texts = [
+        ' '.join(rng.choice(words, rng.randint(1, 4)))
+        for _ in range(size)
+    ]
+    label = rng.rand(size) < 0.4
+    gay = np.array(['gay' in text.split() for text in texts])
+    return pd.DataFrame({
+        'text': texts,
+        'label': label,
+        # Rounded, so that there are tied scores.
+        'model': np.round(0.4 * label + 0.3 * gay + 0.3 * rng.rand(size), 2),
+    })
+
+  def test_matches_model_bias_analysis(self):
+    dataset = self.make_dataset()
+    index = term_index.TermIndex.from_frame(dataset, 'text', 'label')
+    results = term_discovery.compute_term_bias_metrics(
+        index, dataset, ['model'], min_count=1)
+    terms = results[mba.SUBGROUP].tolist()
+    self.assertEqual(sorted(terms), ['box', 'gay', 'music', 'muslim', 'tall',
+                                     'the'])
+    mba.add_subgroup_columns_from_text(dataset, 'text', terms)
+    expected = mba.compute_bias_metrics_for_models(dataset, terms, ['model'],
+                                                   'label')
+    self.assertEqual(results[mba.SUBSET_SIZE].tolist(),
+                     expected[mba.SUBSET_SIZE].tolist())
+    for metric in mba.METRICS:
+      column = mba.column_name('model', metric)
+      self.assertAllClose(results[column].values,
+                          expected[column].astype(float).values)
+
+  def test_most_biased_terms(self):
+    dataset = self.make_dataset()
+    index = term_index.TermIndex.from_frame(dataset, 'text', 'label')
+    results = term_discovery.compute_term_bias_metrics(
+        index, dataset, ['model'], min_count=1)
+    top = term_discovery.most_biased_terms(
+        results, 'model', mba.NEGATIVE_AEG, num_terms=1)
+    self.assertEqual(top[mba.SUBGROUP].tolist(), ['gay'])
+
+  def test_min_count(self):
+    dataset = self.make_dataset()
+    dataset.loc[0, 'text'] = 'rare'
+    index = term_index.TermIndex.from_frame(dataset, 'text', 'label')
+    results = term_discovery.compute_term_bias_metrics(
+        index, dataset, ['model'], min_count=2)
+    self.assertNotIn('rare', results[mba.SUBGROUP].tolist())
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,203 @@
+"""Inverted index of a text dataset, for term-level dataset bias statistics.
+
+Dataset_bias_analysis.ipynb measures identity-term skew in training data, e.g.
+the fraction of comments containing 'gay' that are labeled toxic, by scanning
+the whole corpus with str.contains once per term and length cutoff. TermIndex
+tokenizes the corpus once and keeps:
+
+  - an inverted index from each term to the sorted ids of the documents that
+    contain it, in CSR form (indptr into one doc_ids array),
+  - the character length and the boolean label of every document.
+
+Class balance, length-bucketed toxicity ratios and co-occurrence counts of any
+list of terms are then computed from the postings alone. The index can be
+saved and loaded, to audit new training sets before training on them.
+
+Terms are matched as whole words, split like the Keras Tokenizer does (see
+fast_tokenizer.text_to_word_sequence), not as substrings: 'gay' doesn't match
+'gayle'. A multi-word term like 'african american' matches documents
+containing all of its words.
+
+Example usage:
+
+  index = TermIndex.from_frame(train_comments, 'comment', 'toxic')
+  index.save('../data/wiki_train_index')
+  print(index.class_balance(['gay', 'muslim', 'tall']))
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+  import fast_tokenizer
+except ImportError:
+  from unintended_ml_bias import fast_tokenizer
+
+TERM = 'term'
+NUM_DOCUMENTS = 'num_documents'
+TOXIC_FRACTION = 'toxic_fraction'
+
+
+class TermIndex(object):
+  """Term postings, document lengths and labels of a text dataset."""
+
+  def __init__(self, vocabulary, indptr, doc_ids, lengths, labels):
+    """Initializes the index. Use build or from_frame to index texts.
+
+    Args:
+      vocabulary: List of terms. Term i has postings
+        doc_ids[indptr[i]:indptr[i + 1]].
+      indptr: int64 [len(vocabulary) + 1] offsets into doc_ids.
+      doc_ids: int32 sorted document ids of each term, concatenated.
+      lengths: int32 character length of each document.
+      labels: Boolean label of each document.
+    """
+    self.vocabulary = list(vocabulary)
+    self.term_ids = dict((term, i) for i, term in enumerate(self.vocabulary))
+    self.indptr = indptr
+    self.doc_ids = doc_ids
+    self.lengths = lengths
+    self.labels = labels
+
+  @classmethod
+  def build(cls, texts, labels):
+    """Indexes texts, with their boolean labels, in a single pass."""
+    term_ids = {}
+    # (term id, doc id) pairs, in increasing doc id order.
+    pair_terms = array.array('i')
+    pair_docs = array.array('i')
+    lengths = array.array('i')
+    for doc_id, text in enumerate(texts):
+      lengths.append(len(text))
+      for term in set(fast_tokenizer.text_to_word_sequence(text)):
+        pair_terms.append(term_ids.setdefault(term, len(term_ids)))
+        pair_docs.append(doc_id)
+    pair_terms = np.frombuffer(pair_terms, dtype=np.int32)
+    pair_docs = np.frombuffer(pair_docs, dtype=np.int32)
+    # A stable sort keeps each term's doc ids sorted.
+    order = np.argsort(pair_terms, kind='mergesort')
+    indptr = np.zeros(len(term_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_terms, minlength=len(term_ids)), out=indptr[1:])
+    vocabulary = [None] * len(term_ids)
+    for term, i in term_ids.items():
+      vocabulary[i] = term
+    return cls(vocabulary, indptr, pair_docs[order].copy(),
+               np.frombuffer(lengths, dtype=np.int32).copy(),
+               np.asarray(labels, dtype=bool))
+
+  @classmethod
+  def from_frame(cls, df, text_col, label_col):
+    return cls.build(df[text_col], df[label_col])
+
+  def __len__(self):
+    return len(self.labels)
+
+  def postings(self, term):
+    """Returns the sorted ids of the documents containing every word of term."""
+    docs = None
+    for word in fast_tokenizer.text_to_word_sequence(term):
+      i = self.term_ids.get(word)
+      if i is None:
+        return np.array([], dtype=np.int32)
+      word_docs = self.doc_ids[self.indptr[i]:self.indptr[i + 1]]
+      docs = word_docs if docs is None else np.intersect1d(
+          docs, word_docs, assume_unique=True)
+    return np.array([], dtype=np.int32) if docs is None else docs
+
+  def _documents(self, term, max_length=None):
+    """Postings of term, or all documents if term is None, up to max_length."""
+    if term is None:
+      docs = np.arange(len(self), dtype=np.int32)
+    else:
+      docs = self.postings(term)
+    if max_length is not None:
+      docs = docs[self.lengths[docs] <= max_length]
+    return docs
+
+  def class_balance(self, terms, max_length=None):
+    """Returns the number and toxic fraction of documents containing each term.
+
+    Args:
+      terms: List of terms. None stands for all documents.
+      max_length: Only count documents of at most max_length characters.
+
+    Returns:
+      DataFrame with TERM, NUM_DOCUMENTS and TOXIC_FRACTION columns, one row
+      per term.
+    """
+    records = []
+    for term in terms:
+      docs = self._documents(term, max_length)
+      records.append({
+          TERM: term,
+          NUM_DOCUMENTS: len(docs),
+          TOXIC_FRACTION: self.labels[docs].mean() if len(docs) else np.nan,
+      })
+    return pd.DataFrame(records, columns=[TERM, NUM_DOCUMENTS, TOXIC_FRACTION])
+
+  def toxicity_ratio_by_length(self, terms, bins):
+    """Returns the toxic fraction of documents containing each term, by length.
+
+    Args:
+      terms: List of terms. None stands for all documents.
+      bins: Increasing length bin edges. Bin i holds lengths in
+        (bins[i], bins[i + 1]], like pd.cut.
+
+    Returns:
+      DataFrame indexed by the (low, high] length bins, with one column per
+      term. Bins without documents are NaN.
+    """
+    bins = np.asarray(bins)
+    num_bins = len(bins) - 1
+    # Documents outside of the bins go to bin num_bins, which is dropped.
+    doc_bins = np.searchsorted(bins, self.lengths, side='left') - 1
+    doc_bins[(doc_bins < 0) | (doc_bins >= num_bins)] = num_bins
+    ratios = {}
+    for term in terms:
+      docs = self._documents(term)
+      counts = np.bincount(doc_bins[docs], minlength=num_bins + 1)
+      toxic = np.bincount(
+          doc_bins[docs], weights=self.labels[docs], minlength=num_bins + 1)
+      with np.errstate(invalid='ignore', divide='ignore'):
+        ratios[term] = (toxic / counts)[:num_bins]
+    index = pd.IntervalIndex.from_breaks(bins, closed='right')
+    return pd.DataFrame(ratios, index=index, columns=list(terms))
+
+  def cooccurrence(self, terms):
+    """Returns a terms x terms DataFrame of the number of shared documents.
+
+    The diagonal holds the number of documents containing each term.
+    """
+    postings = [self.postings(term) for term in terms]
+    docs = np.unique(np.concatenate(postings + [np.array([], np.int32)]))
+    membership = np.zeros((len(docs), len(terms)), dtype=np.int32)
+    for i, term_docs in enumerate(postings):
+      membership[np.searchsorted(docs, term_docs), i] = 1
+    return pd.DataFrame(
+        membership.T.dot(membership), index=list(terms), columns=list(terms))
+
+  def save(self, path_prefix):
+    """Saves the index to <path_prefix>.npz and <path_prefix>_vocabulary.json."""
+    np.savez(
+        path_prefix + '.npz',
+        indptr=self.indptr,
+        doc_ids=self.doc_ids,
+        lengths=self.lengths,
+        labels=self.labels)
+    with open(path_prefix + '_vocabulary.json', 'w') as f:
+      json.dump(self.vocabulary, f)
+
+  @classmethod
+  def load(cls, path_prefix):
+    arrays = np.load(path_prefix + '.npz')
+    with open(path_prefix + '_vocabulary.json') as f:
+      vocabulary = json.load(f)
+    return cls(vocabulary, arrays['indptr'], arrays['doc_ids'],
+               arrays['lengths'], arrays['labels'])
@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import term_index
+
+
+class TermIndexTest(tf.test.TestCase):
+
+  def make_index(self):
+    df = pd.DataFrame({
+        'comment': [
+            'I am gay.', 'Gay and Muslim people', 'hello there',
+            'a muslim', 'gayle is tall', 'african american gay man'
+        ],
+        'toxic': [True, True, False, False, False, True],
+    })
+    return term_index.TermIndex.from_frame(df, 'comment', 'toxic'), df
+
+  def test_postings(self):
+    index, _ = self.make_index()
+    self.assertEqual(index.postings('gay').tolist(), [0, 1, 5])
+    self.assertEqual(index.postings('african american').tolist(), [5])
+    self.assertEqual(index.postings('unknown').tolist(), [])
+
+  def test_class_balance(self):
+    index, df = self.make_index()
+    balance = index.class_balance([None, 'gay', 'muslim', 'unknown'])
+    self.assertEqual(balance[term_index.NUM_DOCUMENTS].tolist(), [6, 3, 2, 0])
+    self.assertAllClose(balance[term_index.TOXIC_FRACTION][:3],
+                        [0.5, 1.0, 0.5])
+    self.assertTrue(np.isnan(balance[term_index.TOXIC_FRACTION][3]))
+    short = index.class_balance(['gay'], max_length=10)
+    self.assertEqual(short[term_index.NUM_DOCUMENTS].tolist(), [1])
+
+  def test_toxicity_ratio_by_length(self):
+    index, df = self.make_index()
+    ratios = index.toxicity_ratio_by_length([None, 'gay'], [0, 10, 20, 30])
+    lengths = df['comment'].str.len()
+    expected = df.groupby(pd.cut(lengths, [0, 10, 20, 30]))['toxic'].mean()
+    self.assertAllClose(ratios[None].values, expected.values)
+    self.assertAllClose(ratios['gay'].values, [1.0, np.nan, 1.0])
+
+  def test_cooccurrence(self):
+    index, _ = self.make_index()
+    counts = index.cooccurrence(['gay', 'muslim', 'tall'])
+    self.assertEqual(counts.loc['gay', 'gay'], 3)
+    self.assertEqual(counts.loc['gay', 'muslim'], 1)
+    self.assertEqual(counts.loc['muslim', 'tall'], 0)
+
+  def test_save_load(self):
+    index, _ = self.make_index()
+    path = os.path.join(self.get_temp_dir(), 'index')
+    index.save(path)
+    loaded = term_index.TermIndex.load(path)
+    self.assertEqual(loaded.postings('gay').tolist(), [0, 1, 5])
+    self.assertAllEqual(loaded.lengths, index.lengths)
+    self.assertAllEqual(loaded.labels, index.labels)
+
+
+if __name__ == '__main__':
+  tf.test.main()
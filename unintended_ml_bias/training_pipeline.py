@@ -0,0 +1,187 @@
+"""Streaming input pipeline for training ToxModels on large datasets.
+
+ToxModel.train holds the whole tokenized training and validation sets in
+memory. This pipeline instead:
+
+  1. Streams the CSV in chunks to fit the tokenizer (iter_csv_texts).
+  2. Tokenizes chunks in background worker processes, each writing a padded
+     int32 shard (and its labels) to a cache directory as .npy files
+     (build_shards). The cache is reused by later epochs and later runs with
+     the same data and tokenizer.
+  3. Feeds Keras batch by batch from the memory-mapped shards (ShardSequence).
+
+Peak memory is bounded by the chunk size, not by the size of the dataset.
+See ToxModel.train_streaming.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import multiprocessing
+import os
+
+from keras.utils import Sequence
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROWS_PER_SHARD = 100000
+
+_MANIFEST = 'manifest.json'
+
+
+def iter_csv_texts(csv_path, text_column, chunksize=DEFAULT_ROWS_PER_SHARD):
+  """Yields the texts of a CSV column, reading chunksize rows at a time."""
+  for chunk in pd.read_csv(csv_path, usecols=[text_column],
+                           chunksize=chunksize):
+    for text in chunk[text_column]:
+      yield text
+
+
+def _shard_paths(shard_dir, shard_index):
+  return (os.path.join(shard_dir, 'shard_%05d_text.npy' % shard_index),
+          os.path.join(shard_dir, 'shard_%05d_labels.npy' % shard_index))
+
+
+def _save_atomically(path, array):
+  tmp_path = path + '.tmp.npy'
+  np.save(tmp_path, array)
+  os.rename(tmp_path, path)
+
+
+def _tokenizer_fingerprint(sequence_tokenizer):
+  digest = hashlib.md5()
+  digest.update(
+      json.dumps(sorted(sequence_tokenizer.word_index.items())).encode('utf-8'))
+  digest.update(str(sequence_tokenizer.max_sequence_length).encode('utf-8'))
+  return digest.hexdigest()
+
+
+def _cache_key(csv_path, text_column, label_column, sequence_tokenizer,
+               rows_per_shard):
+  stat = os.stat(csv_path)
+  return {
+      'csv_path': os.path.abspath(csv_path),
+      'csv_size': stat.st_size,
+      'csv_mtime': stat.st_mtime,
+      'text_column': text_column,
+      'label_column': label_column,
+      'rows_per_shard': rows_per_shard,
+      'tokenizer': _tokenizer_fingerprint(sequence_tokenizer),
+  }
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(sequence_tokenizer):
+  global _worker_tokenizer
+  _worker_tokenizer = sequence_tokenizer
+
+
+def _write_shard(args):
+  """Tokenizes one chunk and saves it as a shard. Runs in a pool worker."""
+  shard_dir, shard_index, texts, labels = args
+  text_path, labels_path = _shard_paths(shard_dir, shard_index)
+  _save_atomically(text_path, _worker_tokenizer.texts_to_padded(texts))
+  _save_atomically(labels_path, np.asarray(labels, dtype=np.int8))
+  return len(texts)
+
+
+def build_shards(csv_path,
+                 text_column,
+                 label_column,
+                 sequence_tokenizer,
+                 shard_dir,
+                 rows_per_shard=DEFAULT_ROWS_PER_SHARD,
+                 num_workers=1):
+  """Tokenizes a CSV into padded int32 shards, unless already cached.
+
+  Args:
+    csv_path: CSV file with the text and label columns.
+    text_column: Column containing the text.
+    label_column: Column containing the boolean or 0/1 label.
+    sequence_tokenizer: fast_tokenizer.SequenceTokenizer to tokenize with.
+    shard_dir: Directory to cache the shards in.
+    rows_per_shard: Number of rows per shard (and per chunk read from the CSV).
+    num_workers: Number of worker processes tokenizing shards.
+
+  Returns:
+    List of the number of rows in each shard.
+  """
+  key = _cache_key(csv_path, text_column, label_column, sequence_tokenizer,
+                   rows_per_shard)
+  manifest_path = os.path.join(shard_dir, _MANIFEST)
+  if os.path.exists(manifest_path):
+    with open(manifest_path) as f:
+      manifest = json.load(f)
+    if manifest['key'] == key:
+      print('Using cached shards:', shard_dir)
+      return manifest['shard_sizes']
+    os.remove(manifest_path)
+  if not os.path.exists(shard_dir):
+    os.makedirs(shard_dir)
+
+  chunks = pd.read_csv(
+      csv_path, usecols=[text_column, label_column], chunksize=rows_per_shard)
+  tasks = ((shard_dir, shard_index, list(chunk[text_column]),
+            list(chunk[label_column]))
+           for shard_index, chunk in enumerate(chunks))
+  pool = multiprocessing.Pool(
+      max(num_workers, 1),
+      initializer=_init_worker,
+      initargs=(sequence_tokenizer,))
+  try:
+    # imap only reads ahead as far as the workers consume, which keeps memory
+    # bounded by a few chunks.
+    shard_sizes = list(pool.imap(_write_shard, tasks))
+  finally:
+    pool.close()
+    pool.join()
+
+  with open(manifest_path, 'w') as f:
+    json.dump({'key': key, 'shard_sizes': shard_sizes}, f, sort_keys=True)
+  return shard_sizes
+
+
+class ShardSequence(Sequence):
+  """Keras Sequence of (padded text, one-hot label) batches from shards.
+
+  Batches never span two shards, so each batch is one contiguous read from a
+  memory-mapped shard. Batch order is shuffled every epoch if shuffle is set.
+  """
+
+  def __init__(self, shard_dir, batch_size, shuffle=True, seed=None):
+    with open(os.path.join(shard_dir, _MANIFEST)) as f:
+      shard_sizes = json.load(f)['shard_sizes']
+    self.texts = []
+    self.labels = []
+    self.batches = []
+    for shard_index, shard_size in enumerate(shard_sizes):
+      text_path, labels_path = _shard_paths(shard_dir, shard_index)
+      self.texts.append(np.load(text_path, mmap_mode='r'))
+      self.labels.append(np.load(labels_path, mmap_mode='r'))
+      self.batches.extend(
+          (shard_index, start) for start in range(0, shard_size, batch_size))
+    self.num_examples = sum(shard_sizes)
+    self.batch_size = batch_size
+    self.shuffle = shuffle
+    self._rng = np.random.RandomState(seed)
+    self.on_epoch_end()
+
+  def __len__(self):
+    return len(self.batches)
+
+  def __getitem__(self, index):
+    shard_index, start = self.batches[self._order[index]]
+    end = start + self.batch_size
+    text = np.asarray(self.texts[shard_index][start:end])
+    labels = np.asarray(self.labels[shard_index][start:end])
+    return text, np.eye(2, dtype=np.float32)[labels]
+
+  def on_epoch_end(self):
+    self._order = np.arange(len(self.batches))
+    if self.shuffle:
+      self._rng.shuffle(self._order)
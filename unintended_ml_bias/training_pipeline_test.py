@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import fast_tokenizer
+import training_pipeline
+
+
+class TrainingPipelineTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.csv_path = os.path.join(self.tmp_dir, 'train.csv')
+    pd.DataFrame({
+        'comment': ['comment number %d' % i for i in range(25)],
+        'is_toxic': [i % 3 == 0 for i in range(25)],
+    }).to_csv(self.csv_path)
+    self.tokenizer = fast_tokenizer.SequenceTokenizer(
+        {'comment': 1, 'number': 2, '7': 3}, None, 4)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_shards_round_trip(self):
+    shard_dir = os.path.join(self.tmp_dir, 'shards')
+    shard_sizes = training_pipeline.build_shards(
+        self.csv_path, 'comment', 'is_toxic', self.tokenizer, shard_dir,
+        rows_per_shard=10, num_workers=2)
+    self.assertEqual(shard_sizes, [10, 10, 5])
+    sequence = training_pipeline.ShardSequence(
+        shard_dir, batch_size=4, shuffle=False)
+    self.assertEqual(len(sequence), 8)
+    texts = np.concatenate([sequence[i][0] for i in range(len(sequence))])
+    labels = np.concatenate([sequence[i][1] for i in range(len(sequence))])
+    self.assertAllEqual(texts[7], [0, 1, 2, 3])
+    self.assertAllEqual(texts[8], [0, 0, 1, 2])
+    self.assertAllEqual(labels[:, 1], [i % 3 == 0 for i in range(25)])
+
+  def test_shards_are_cached(self):
+    shard_dir = os.path.join(self.tmp_dir, 'shards')
+    training_pipeline.build_shards(self.csv_path, 'comment', 'is_toxic',
+                                   self.tokenizer, shard_dir, 10)
+    os.remove(os.path.join(shard_dir, 'shard_00000_text.npy'))
+    # The cached manifest matches, so the shards are not rebuilt.
+    training_pipeline.build_shards(self.csv_path, 'comment', 'is_toxic',
+                                   self.tokenizer, shard_dir, 10)
+    self.assertFalse(
+        os.path.exists(os.path.join(shard_dir, 'shard_00000_text.npy')))
+
+
+if __name__ == '__main__':
+  tf.test.main()